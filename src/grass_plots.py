@@ -2,355 +2,74 @@ import requests
 import json
 
 import numpy as np
-from functools import reduce
 
 import plotly.express as px
 #from plotly.offline import plot as plotlyOffline
 
+from src.grassroots_grids   import observation_layers, treatment_codes
+from src.grassroots_spatial import add_outlier_overlay
+from src.grassroots_lod     import lod_figure, MAX_CELLS
+from src.grassroots_compact import typed_array, lean_figure
+from src.grassroots_instrument import timed
+from src.grassroots_requests   import INTERACTIVE
+import src.grassroots_requests as grassroots_requests
+from src.grassroots_engine     import (lookup_keys, searchPhenotypeTrait, searchPhenotypeUnit, search_phenotype,
+                                       search_phenotype_index, dict_phenotypes, build_grid, oddShapeValues,
+                                       oddShapeAccession, oddShapePlotID, value_strings, render_prep, hover_grids)
+
 server_url = "http://localhost:2000/grassroots/public_backend"
 
 '''
 Get study using id
-returns JSON from backend
+returns JSON from backend (grassroots_requests.get_plot on server_url)
 '''
-def get_plot(id):
-    plot_request = {
-            "services": [{
-                "so:name": "Search Field Trials",
-                "start_service": True,
-                "parameter_set": {
-                    "level": "advanced",
-                    "parameters": [{
-                        "param": "ST Id",
-                        "current_value": id
-                    }, {
-                        "param": "Get all Plots for Study",
-                        "current_value": True
-                    }, {
-                        "param": "ST Search Studies",
-                        "current_value": True
-                    }]
-                }
-            }]
-        }
-    res = requests.post(server_url, data=json.dumps(plot_request))
-    return json.dumps(res.json())
+def get_plot(id, priority=INTERACTIVE):
+    return grassroots_requests.get_plot(id, priority, url=server_url)
 
 ####################################################################
-def get_all_fieldtrials():
-    list_all_ft_request = {
-        "services": [
-            {
-                "so:name": "Search Field Trials",
-                "start_service": True,
-                "parameter_set": {
-                    "level": "simple",
-                    "parameters": [
-                        {
-                            "param": "FT Keyword Search",
-                            "current_value": ""
-                        },
-
-                        {
-                            "param": "FT Study Facet",
-                            "current_value": True
-                        },
-                        {
-                            "param": "FT Results Page Number",
-                            "current_value": 0
-                        },
-                        {
-                            "param": "FT Results Page Size",
-                            "current_value": 500
-                        }
-                    ]
-                }
-            }
-        ]
-    }
-    res = requests.post(server_url, data=json.dumps(list_all_ft_request))
-    return json.dumps(res.json())
-
-###################################################################
-def lookup_keys(dictionary, keys, default=None):
-     return reduce(lambda d, key: d.get(key, default) if isinstance(d, dict) else default, keys.split("."), dictionary)
-
-###################################################################
-def searchPhenotypeTrait(listPheno, value):
-
-    name = listPheno[value]['definition']['trait']['so:name']
-
-    return name
-
-###################################################################
-def searchPhenotypeUnit(listPheno, value):
-
-    name = listPheno[value]['definition']['unit']['so:name']
-
-    return name
-
-###################################################################
-def search_phenotype(list_observations, value):
-
-    found = False
-    for i in range(len(list_observations)):
-
-        dic            = list_observations[i]
-        phenotype_name = lookup_keys(dic, 'phenotype.variable')
-        if  (phenotype_name == value ):
-              return True
-              break
-
-    return found
-
-############################################################################
-def search_phenotype_index(list_observations, value):
-
-    for i in range(len(list_observations)):
-
-        dic            = list_observations[i]
-        phenotype_name = lookup_keys(dic, 'phenotype.variable')
-        if  (phenotype_name == value ):
-              return i
-
+def get_all_fieldtrials(priority=INTERACTIVE):
+    return grassroots_requests.get_all_fieldtrials(priority, url=server_url)
 
 ####################################################################
-def dict_phenotypes(pheno, plots):
-    """Extract traits of phenotypes 
-
-    Args:
-        pheno: list of phenotypes of a particular study 
-        plots     : plots data of a particular study
+def numpy_data(json, pheno, current_name, total_rows, total_columns, dtype=np.float64):
+    """create numpy matrices for plotting (legacy dense positional view of build_grid, see StudyGrid)
 
     Returns:
-        dictionary: keys: phenotypes names, values: traits
+        list: rows, columns, values, accession, trait, unit, plot IDs, raw layer, corrected layer, status
     """
 
-    names = []
-    traits = []
-    for key in pheno:
-        #print("-->", key)
-         
-
-        names.append(key)
-        traits.append(pheno[key]['definition']['trait']['so:name'])
-
-    phenoDict = dict(zip(names, traits))
-
-    for j in range(len(plots)):
-        if ( 'discard' in plots[j]['rows'][0] ):
-            pass
-        if ('observations' in plots[j]['rows'][0]):
-            for k in range(len(plots[j]['rows'][0]['observations'])):
-                if ('raw_value' in plots[j]['rows'][0]['observations'][k]):
-                    rawValue = plots[j]['rows'][0]['observations'][k]['raw_value']
-                if ('corrected_value' in plots[j]['rows'][0]['observations'][k]):
-                    rawValue = plots[j]['rows'][0]['observations'][k]['corrected_value']
-                if ( type(rawValue) == str):
-                    name = plots[j]['rows'][0]['observations'][k]['phenotype']['variable']
-                    if( name in phenoDict.keys() ):
-                        #print("Remove:", phenoDict[name])
-                        del phenoDict[name]
-    
-    return phenoDict    
-
+    grid = build_grid(json, pheno, current_name, total_rows, total_columns, dtype).dense()   # odd shapes densified here, to plot
 
-####################################################################
-def numpy_data(json, pheno, current_name, total_rows, total_columns):
-    """create numpy matrices for plotting
-
-    Args:
-        json     : Plots data of a particular study
-        pheno    : Phenotypes of particular study
-        name     : Name of current study
-
-    Returns:
-        matrices: matrix with numpy matrices...
-    """
-
-
-    traitName = searchPhenotypeTrait(pheno, current_name)
-    unit      = searchPhenotypeUnit( pheno, current_name)
-
-    dtID= np.dtype(('U', 4))
-
-    row_raw   = np.array([])
-    matrix    = np.array([])
-    row_acc   = np.array([])
-    accession = np.array([])
-    plotsIds  = np.array([], dtype=dtID)  #format of strings
-
-    matrices = []
-
-    num_columns = 1
-    row    = 1
-    column = 1
-    #loop throght observations in the same fashion as in old JS code. 
-    for j in range(len(json)):
-        if ( int( json[j]['row_index'] ) == row ):
-            if  (int( json[j]['column_index'] ) == column):
-               if column > num_columns:
-                   num_columns = column
-
-               if   ( 'discard' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-               elif ( 'blank' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-      
-               elif ( 'observations' in json[j]['rows'][0] ):
-                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
-                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
-                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                        row_raw  = np.append(row_raw, rawValue) 
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-                    else:
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-               else:
-                    if ( 'rows' in json[j] ):
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-         
-  
-               column+=1
-               columns = json[j]['column_index']#
-
-        elif ( int( json[j]['row_index'] ) > row  ):
-            if column > num_columns:
-                   num_columns = column
-
-            if   ( 'discard' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-            elif   ( 'blank' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-        
-            elif ( 'observations' in json[j]['rows'][0] ):
-                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
-                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
-                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                        row_raw  = np.append(row_raw, rawValue) 
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-                    else:
-                        row_raw  = np.append(row_raw, np.inf )
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-            else:
-                    if ( 'rows' in json[j] ):
-                        ##print("rows with no observations------",json[j])
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-             
-
-            row+=1
-            column=2
-            columns = json[j]['column_index']
-
-
-    #column = columns # use actual number of columns instead of counter
-    column = num_columns-1
-
-    if column<columns:
-        column=columns
-    
-    #######print("number of plots and shape check", len(json), row, column, row*(column) )
-    if (len(json) != row*column):
-        #print("NOT rectangular")
-        if(total_columns!=None):
-          if(column<total_columns):
-             column=total_columns
-
-        # fit odd shape plot into bigger rectangular plot.
-        row_raw  = oddShapeValues(   json, row, column, current_name)
-        row_acc  = oddShapeAccession(json, row, column, current_name)
-        plotsIds = oddShapePlotID(   json, row, column, current_name)
-
-    matrices.append(row)
-    matrices.append(column)
-    matrices.append(row_raw)
-    matrices.append(row_acc)
-    matrices.append(traitName)
-    matrices.append(unit)
-    matrices.append(plotsIds)
-    
-    return matrices
+    return [grid.rows, grid.columns, grid.values, grid.accession, grid.trait, grid.unit,
+            grid.plot_ids, grid.raw_layer, grid.cor_layer, grid.status]
 
 
 ########################################################################################
 '''
 create treatments array for plotly text 
 '''
+@timed('treatments')
 def treatments(arraysJson, rows, columns):
 
-    dt= np.dtype(('U', 80))
-    matrix = np.zeros((rows,columns), dtype=dt)
-    matrix[:] = "N/A"
+    codes, labels = treatment_codes(arraysJson, rows, columns)
 
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = 'N/A'
-        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = 'N/A'
-    
-
-        elif ( 'treatments' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            value = []
-            label = []
-            treat = []
-            for k in range(len(arraysJson[r]['rows'][0]['treatments'])):
-                    value  = np.append(value, arraysJson[r]['rows'][0]['treatments'][k]["so:sameAs"] )
-                    label  = np.append(label, arraysJson[r]['rows'][0]['treatments'][k]["label"] )
-
-            for m in range(len(value)):
-                v1 = value[m]
-                v2 = label[m]
-                t  = v1 +' (' + v2 +')'        # combine name and label
-                treat  = np.append(treat, t)  # to create single matrix that contains all the treatment(s) info.  
-        
-            #string = ', '.join(value)
-            string = ', '.join(treat)
-            matrix[i][j] = string
-
-        ##else:
-        ##    matrix[i][j] = np.inf.  Possible Warning? No treatment saved in plots...
-
-    matrix  = matrix.flatten()
+    lookup = np.array(labels + ['N/A'], dtype=object)   # code -1 (no treatment, discarded) is the last entry
+    matrix = lookup[codes].flatten()
     return matrix
 ##############################################################################################
 '''
 test rendering plotly interactive heatmap
+outliers: optional list from study_outliers, marked on top of the heatmap
+lod: level of detail figure for very large fields, at most max_cells cells sent
+     per view (update it on zoom with grassroots_lod.lod_update)
+status: optional status grid of numpy_data (N/A, discarded and blank plots)
+lean: values and status codes only, no hover data; plot details are shown on
+      click (grassroots_drilldown.register_plot_details)
+color_range: optional (min, max) of the color scale (grassroots_sketch.color_range)
 '''
-def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments):
+@timed('plotly_plot')
+def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments, outliers=None, lod=False, max_cells=MAX_CELLS, status=None, lean=False,
+                color_range=None):
 
     ##numpy_matrix = np.flipud(numpy_matrix)      # To Match order shown originally in JS code
     #plotID      = np.flipud(IDs)        
@@ -358,70 +77,39 @@ def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments):
     Y    = size[0]
     X    = size[1]
 
-    indexInf     =  np.where(np.isinf(numpy_matrix))
-    indexDiscard =  np.where(np.isnan(numpy_matrix))
-    
-    numpy_matrix[indexInf] = np.nan # Replace Inf by NaN
-
-    strings     = np.array(["%s" % x for x in numpy_matrix])  #matrix has to be flattened for conversion to strings
-
-    for i in range(len(strings)):   #remove decimal place when floats are integers
-        string1 = strings[i]
-        string_split = string1.split('.')
-        if( len(string_split)==2):
-            if(string_split[1]=='0'):
-                integer = strings[i]
-                integer = integer[:-2]
-                strings[i] = integer
-    
-
-    strings[indexInf]     = 'N/A'    # use array of string for custumising hovering text
-    strings[indexDiscard] = 'N/A'
-
-    accession = accession.flatten()
-    accession[indexDiscard] = 'Discarded'
-    accession = accession.reshape(Y,X)                       
+    if lod:
+        return lod_figure(numpy_matrix.reshape(Y,X), accession, IDs, title, unit, max_cells=max_cells, color_range=color_range)
+    if lean:
+        return lean_figure(numpy_matrix, (Y,X), title, unit, status=status, color_range=color_range)
 
-    s_matrix = strings.reshape(Y,X)                  
-    s_matrix = np.flipud(s_matrix)      
-
-    numpy_matrix[indexInf] = np.inf # but back inf (N/A values)
-    numpy_matrix           = numpy_matrix.reshape(Y,X) 
-
-
-    numpy_matrix = np.flipud(numpy_matrix)  # For matching order of JS table
-    accession    = np.flipud(accession)        
-    plotID       = np.flipud(IDs)        
-
-    # Reverse Y ticks and start them from 1
-    Yvals = np.arange(0,Y)
-    Yaxis = np.arange(1,Y+1)
-    Yaxis = np.flip(Yaxis)
-    
-    Xvals = np.arange(0, X)
-    Xaxis = np.arange(1,X+1)
+    prep                = render_prep(numpy_matrix, (Y,X), status)   # views and masks, inputs left untouched
+    s_matrix, accession = hover_grids(prep, accession)        # 'N/A' values, 'Discarded' accessions
+    plotID              = IDs
 
     units = 'Units: '+unit
 
-    fig = px.imshow(numpy_matrix, aspect="auto",
+    # row 1 at the bottom (as in the JS table) through the axis, not flipped copies
+    fig = px.imshow(prep['values'], x=np.arange(1,X+1), y=np.arange(1,Y+1), origin='lower', aspect="auto",
             labels=dict(x="columns", y="rows", color=units),
-            color_continuous_scale=px.colors.sequential.Greens, height=800 )
+            color_continuous_scale=px.colors.sequential.Greens, range_color=color_range, height=800 )
     #print("_________",numpy_matrix[0][0], accession[0][0])
     #print("_________", accession[0] )
     #print(treatments)
     if len(treatments)>0:
         treatments = treatments.reshape(Y,X)
-        treatments = np.flipud(treatments)
 
+        # value strings go in text, apart from the phenotype independent channels (see phenotype_patch)
         fig.update_traces(
-        customdata = np.moveaxis([accession, s_matrix, plotID, treatments], 0,-1),
+        text       = s_matrix,
+        customdata = np.moveaxis([accession, plotID, treatments], 0,-1),
         #hovertemplate="Accession: %{customdata[0]}<br>raw value: %{customdata[1]:.2f}  <extra></extra>")
-        hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{customdata[1]}<br>Plot ID: %{customdata[2]} (column: %{x}, row: %{y})<br>Treatment: %{customdata[3]} <extra></extra>")
+        hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{text}<br>Plot ID: %{customdata[1]} (column: %{x}, row: %{y})<br>Treatment: %{customdata[2]} <extra></extra>")
 
     else:
         fig.update_traces(
-        customdata = np.moveaxis([accession, s_matrix, plotID], 0,-1),
-        hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{customdata[1]}<br>Plot ID: %{customdata[2]} (column: %{x}, row:%{y})<extra></extra>")
+        text       = s_matrix,
+        customdata = np.moveaxis([accession, plotID], 0,-1),
+        hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{text}<br>Plot ID: %{customdata[1]} (column: %{x}, row:%{y})<extra></extra>")
         #check=np.moveaxis([accession, s_matrix, plotID, treatments], 0,-1) 
         #print("PLOT_________", accession.shape )
         fig.update_layout(font=dict(family="Courier New, monospace",size=12,color="Black"),title={
@@ -429,14 +117,13 @@ def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments):
         'y':0.98,'x':0.5,
         'xanchor': 'center','yanchor': 'top'})
 
-    fig.update_layout( yaxis = dict(tickmode = 'array', tickvals = Yvals, ticktext = Yaxis ) )
-    fig.update_layout( xaxis = dict(tickmode = 'array', tickvals = Xvals, ticktext = Xaxis ) )
-
-
-    fig.update_xaxes(showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
-    fig.update_yaxes(showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
+    fig.update_xaxes(dtick=1, showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
+    fig.update_yaxes(dtick=1, showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
     fig['layout'].update(plot_bgcolor='black')
 
+    if outliers is not None:
+        add_outlier_overlay(fig, outliers)
+
     #plot_div = plot([Scatter(x=x_data, y=y_data, mode='lines', name='test', opacity=0.8, marker_color='green')], output_type='div')
     #plot_div = plotlyOffline(fig, output_type='div')
     #fig.show()   ## ADDED ONLY FOR DASH TEST
@@ -444,125 +131,37 @@ def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments):
     #return plot_div
     return fig
 
-####################################################################################
-def oddShapeValues(arraysJson, rows, columns, phenotype):
-
-    matrix = np.zeros((rows,columns))
-    matrix[:] = np.nan
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan
-        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-                indexCurrentPhenotype = search_phenotype_index (arraysJson[r]['rows'][0]['observations'], phenotype)
-                if ('raw_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
-                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                if ('corrected_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
-                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                matrix[i][j] = rawValue
-            else:
-                matrix[i][j] = np.inf
-
-        else:
-            if('rows' in arraysJson[r]):        #rows field exists but it has no observations!
-               i = int( arraysJson[r]['row_index']    )
-               j = int( arraysJson[r]['column_index'] )
-               i=i-1
-               j=j-1
-               matrix[i][j] = np.inf  # consider it N/A instead as default discarded (nan)
-    
-
-    #matrix = np.flipud(matrix)
-    #print(matrix)
-    matrix  = matrix.flatten()
-
-    return matrix
-#######################################################################
-def oddShapeAccession(arraysJson, rows, columns, phenotype):
-
-    dt= np.dtype(('U', 50)) # define string type for of strings (accession names)
-    matrix = np.empty((rows,columns), dtype=dt)
-    matrix[:] = 'Discarded' #  hovering text in empty plots
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan         #discarded plot
-        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan         #discarded plot
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-         #   if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
-        elif('rows' in arraysJson[r]):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
-
-
-    matrix  = matrix.flatten()
-
-    return matrix
-
-
-#######################################################################
-def oddShapePlotID(arraysJson, rows, columns, phenotype):
-
-    dt= np.dtype(('U', 40))
-    matrix = np.empty((rows,columns), dtype=dt)
-    matrix[:] = 'N/A'
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-            else:
-            #    matrix[i][j] = np.nan    # No values for that phenotype
-                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-
+##############################################################################################
+'''
+partial update of a figure from plotly_plot when only the phenotype changes:
+returns a dash.Patch replacing the z values (float32 typed array), the value
+strings of the hover text, the colorbar title and the title. Accessions, plot
+IDs, treatments and the layout stay in the browser. Use it as the output of a
+callback on the phenotype dropdown:
+
+    @app.callback(Output('heatmap', 'figure'), Input('phenotype', 'value'), ...)
+    def switch_phenotype(phenotype, ...):
+        grid = study_grid(single_study, phenotype).dense()
+        return phenotype_patch(grid.values, (grid.rows, grid.columns), grid.trait, grid.unit, grid.status)
+
+Not for figures with an outlier overlay or level of detail figures (lod=True).
+'''
+@timed('phenotype_patch')
+def phenotype_patch(numpy_matrix, shape, title, unit, status=None, color_range=None):
 
+    from dash import Patch
 
-    matrix  = matrix.flatten()
+    prep    = render_prep(numpy_matrix, shape, status)
+    z       = np.where(prep['measured'], prep['values'], np.nan).astype(np.float32)
+    strings = value_strings(prep['values'], ~prep['measured'])
 
-    return matrix
+    patched = Patch()
+    patched['data'][0]['z']    = typed_array(z)
+    patched['data'][0]['text'] = strings.tolist()
+    patched['layout']['coloraxis']['colorbar']['title']['text'] = 'Units: '+unit
+    patched['layout']['coloraxis']['cauto'] = color_range is None     # the previous trait's range must not stick
+    patched['layout']['coloraxis']['cmin']  = None if color_range is None else color_range[0]
+    patched['layout']['coloraxis']['cmax']  = None if color_range is None else color_range[1]
+    patched['layout']['title']['text'] = title
 
+    return patched
@@ -0,0 +1,235 @@
+import base64
+
+import numpy as np
+
+import plotly.express as px
+
+from src.grassroots_engine import render_prep, NOT_AVAILABLE, DISCARDED
+
+
+# plotly.js typed array codes
+TYPED_ARRAY_CODES = {np.dtype('int8')   : 'i1', np.dtype('uint8')  : 'u1',
+                     np.dtype('int16')  : 'i2', np.dtype('uint16') : 'u2',
+                     np.dtype('int32')  : 'i4', np.dtype('uint32') : 'u4',
+                     np.dtype('float32'): 'f4', np.dtype('float64'): 'f8'}
+
+STATUS_LABELS = ['', 'N/A', 'Discarded', 'Blank']   # indexed by the grassroots_engine status codes
+
+####################################################################################
+def typed_array(array):
+    """Base64 typed array spec understood by plotly.js ({dtype, bdata, shape})"""
+
+    array = np.ascontiguousarray(array)
+    spec  = {'dtype': TYPED_ARRAY_CODES[array.dtype],
+             'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+    if array.ndim > 1:
+        spec['shape'] = ', '.join(str(n) for n in array.shape)
+
+    return spec
+
+####################################################################################
+def code_grid(labels):
+    """Replace repeated strings by integer codes and a lookup table
+
+    Labels that are all plain non-negative integers (plot IDs) are sent as
+    numbers with no lookup table (None), as long as that is lossless: no
+    leading zeros and small enough for a uint32 typed array. Anything else
+    is interned like the other strings.
+    """
+
+    labels = np.asarray(labels).astype(str)
+    if labels.size > 0 and np.all(np.char.isdigit(labels)):
+        numbers = labels.astype(np.uint64)
+        if numbers.max() <= np.iinfo(np.uint32).max and np.all(numbers.astype(str) == labels):
+            return numbers.astype(np.uint32), None
+
+    lookup, codes = np.unique(labels, return_inverse=True)
+
+    return codes.reshape(labels.shape), lookup.tolist()
+
+####################################################################################
+def _smallest_uint(maximum):
+
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if maximum <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.int64
+
+####################################################################################
+def _status_codes(values, status=None):
+    """uint8 status grid of the values, derived from the NaN/inf sentinels when not given"""
+
+    if status is None:
+        prep   = render_prep(values, values.shape)
+        status = np.zeros(values.shape, dtype=np.uint8)
+        status[prep['not_available']] = NOT_AVAILABLE
+        status[prep['discarded']]     = DISCARDED
+
+    return np.asarray(status, dtype=np.uint8).reshape(values.shape)
+
+####################################################################################
+def compact_figure(numpy_matrix, accession, title, unit, IDs=None, treatments=None, colormap="Greens", dtype=np.float32, status=None,
+                   color_range=None):
+    """Lean figure of a field heatmap for the Dash app
+
+    Same inputs as plotly_plot, but values go as a base64 typed array and the
+    hover channels (accession, plot ID, treatment, N/A or discarded status) as
+    integer codes plus small lookup tables in layout.meta. The hover text is
+    expanded in the browser by EXPAND_HOVER_JS (see register_compact_figure).
+    Inputs are left untouched; rows are drawn with row 1 at the bottom as in
+    plotly_plot, through the axis rather than a flipped copy.
+
+    Args:
+        numpy_matrix: flat values with NaN (discarded) and inf (N/A) sentinels
+        accession   : accession names (rows, columns)
+        IDs         : optional plot IDs (rows, columns)
+        treatments  : optional flat treatment labels
+        dtype       : float type of the values sent to the browser
+        status      : optional status grid (build_grid), tells blank plots apart
+        color_range : optional (min, max) of the color scale (grassroots_sketch.color_range)
+
+    Returns:
+        dictionary: plotly figure, JSON serialisable
+    """
+
+    Y, X   = np.shape(accession)
+    values = np.asarray(numpy_matrix).reshape(Y, X)
+
+    status = _status_codes(values, status)
+
+    channels = [('Accession', accession)]
+    if IDs is not None:
+        channels.append(('Plot ID', IDs))
+    if treatments is not None and len(treatments) > 0:
+        channels.append(('Treatment', np.asarray(treatments).reshape(Y, X)))
+
+    codes   = []
+    lookups = []
+    for name, labels in channels:
+        code, lookup = code_grid(labels)
+        codes.append(code)
+        lookups.append(lookup)
+    codes.append(status)
+    lookups.append(STATUS_LABELS)
+
+    code_type  = _smallest_uint(max(code.max(initial=0) for code in codes))
+    customdata = np.stack(codes, axis=-1).astype(code_type)
+
+    figure = _heatmap_figure(values, title, unit, colormap, dtype, color_range)
+    figure['data'][0]['customdata']    = typed_array(customdata)
+    figure['data'][0]['hovertemplate'] = "%{text}<br> (column: %{x}, row: %{y})<extra></extra>"
+    figure['layout']['meta']           = {'channels': [name for name, labels in channels] + ['Status'],
+                                          'lookups' : lookups,
+                                          'rows'    : int(Y),
+                                          'columns' : int(X)}
+
+    return figure
+
+####################################################################################
+def _heatmap_figure(values, title, unit, colormap, dtype, color_range=None):
+    """Heatmap trace and layout shared by compact_figure and lean_figure"""
+
+    z = np.where(np.isfinite(values), values, np.nan).astype(dtype)
+
+    trace = {'type'         : 'heatmap',
+             'z'            : typed_array(z),
+             'x0': 1, 'dx': 1, 'y0': 1, 'dy': 1,
+             'colorscale'   : getattr(px.colors.sequential, colormap),
+             'colorbar'     : {'title': {'text': 'Units: ' + unit}}}
+    if color_range is not None:
+        trace['zmin'], trace['zmax'] = float(color_range[0]), float(color_range[1])
+
+    layout = {'title'       : {'text': title, 'y': 0.98, 'x': 0.5, 'xanchor': 'center', 'yanchor': 'top'},
+              'font'        : {'family': "Courier New, monospace", 'size': 12, 'color': "Black"},
+              'height'      : 600,
+              'plot_bgcolor': 'black',
+              'xaxis'       : {'title': {'text': 'columns'}, 'dtick': 1, 'showgrid': False, 'zeroline': False},
+              'yaxis'       : {'title': {'text': 'rows'},    'dtick': 1, 'showgrid': False, 'zeroline': False}}
+
+    return {'data': [trace], 'layout': layout}
+
+####################################################################################
+def lean_figure(numpy_matrix, shape, title, unit, colormap="Greens", dtype=np.float32, status=None, color_range=None):
+    """Heatmap figure with values and status codes only, for drill-down on click
+
+    Nothing per plot but the value (base64 typed array) and a status label
+    for the hover (empty for measured plots) goes to the browser; accession,
+    plot ID, treatments and
+    every observation of a plot are fetched when the cell is clicked
+    (grassroots_drilldown.register_plot_details). Unlike compact_figure it
+    needs no clientside expansion and goes straight into a dcc.Graph.
+
+    Args:
+        numpy_matrix: flat values with NaN (discarded) and inf (N/A) sentinels
+        shape       : (rows, columns) of the field
+        dtype       : float type of the values sent to the browser
+        status      : optional status grid (build_grid), default derived from the sentinels
+        color_range : optional (min, max) of the color scale (grassroots_sketch.color_range)
+
+    Returns:
+        dictionary: plotly figure, JSON serialisable
+    """
+
+    Y, X   = shape
+    values = np.asarray(numpy_matrix).reshape(Y, X)
+
+    status = _status_codes(values, status)
+
+    figure = _heatmap_figure(values, title, unit, colormap, dtype, color_range)
+    figure['data'][0]['text']          = np.array(STATUS_LABELS)[status].tolist()
+    figure['data'][0]['hovertemplate'] = "Value: %{z} %{text}<br> (column: %{x}, row: %{y})<br>click for details<extra></extra>"
+    figure['layout']['clickmode']      = 'event'
+
+    return figure
+
+####################################################################################
+# Dash clientside callback: decode the typed arrays and expand the codes of a
+# compact_figure into hover text, so repeated strings never travel over the wire.
+EXPAND_HOVER_JS = """
+function(fig) {
+    if (!fig) { return window.dash_clientside.no_update; }
+    var types = {i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+                 i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array};
+    function decode(spec) {
+        if (!spec || !spec.bdata) { return spec; }
+        var bin = atob(spec.bdata), bytes = new Uint8Array(bin.length);
+        for (var i = 0; i < bin.length; i++) { bytes[i] = bin.charCodeAt(i); }
+        return new types[spec.dtype](bytes.buffer);
+    }
+    var trace = fig.data[0], meta = fig.layout.meta;
+    var codes = decode(trace.customdata), z = decode(trace.z);
+    var n = meta.channels.length, status = n - 1;
+    function label(h, code) { return meta.lookups[h] ? meta.lookups[h][code] : code; }
+    var text = [];
+    for (var r = 0; r < meta.rows; r++) {
+        var line = [];
+        for (var c = 0; c < meta.columns; c++) {
+            var cell = r * meta.columns + c, k = cell * n, parts = [];
+            var flag = meta.lookups[status][codes[k + status]];
+            parts.push(meta.channels[0] + ': ' + (flag === 'Discarded' || flag === 'Blank' ? flag : label(0, codes[k])));
+            parts.push('Value: ' + (flag ? 'N/A' : String(+z[cell].toPrecision(7))));
+            for (var h = 1; h < status; h++) {
+                parts.push(meta.channels[h] + ': ' + label(h, codes[k + h]));
+            }
+            line.push(parts.join('<br>'));
+        }
+        text.push(line);
+    }
+    var expanded = Object.assign({}, trace, {text: text});
+    delete expanded.customdata;
+    return Object.assign({}, fig, {data: [expanded]});
+}
+"""
+
+####################################################################################
+def register_compact_figure(app, store_id, graph_id):
+    """Expand compact figures stored in a dcc.Store into a dcc.Graph on the client
+
+    The server callback writes compact_figure(...) into the store; this
+    clientside callback builds the figure of the graph in the browser.
+    """
+
+    from dash import Input, Output
+
+    app.clientside_callback(EXPAND_HOVER_JS, Output(graph_id, 'figure'), Input(store_id, 'data'))
@@ -0,0 +1,163 @@
+import json
+import functools
+
+import numpy as np
+
+from src.grassroots_grids  import study_data, layout_shape
+from src.grassroots_engine import searchPhenotypeTrait, searchPhenotypeUnit
+
+
+####################################################################################
+def plot_index_grid(plots, rows, columns):
+    """(row, column) -> position in the plots list, in a single pass
+
+    Returns:
+        int array (rows, columns), -1 where the layout has no plot
+    """
+
+    index = np.full((rows, columns), -1, dtype=np.int32)
+    for p, plot in enumerate(plots):
+        index[int(plot['row_index']) - 1, int(plot['column_index']) - 1] = p
+
+    return index
+
+####################################################################################
+class PlotDetails:
+    """Cached study with constant time access to the full record of any plot
+
+    Built once per study (one pass over the plots); every click on a cell of
+    a lean_figure is then a single array lookup.
+    """
+
+    def __init__(self, single_study):
+        data = study_data(single_study)
+
+        self.plots      = data['plots']
+        self.phenotypes = data.get('phenotypes', {})
+        self.name       = data.get('so:name')
+        self.rows, self.columns = layout_shape(self.plots, data.get('num_columns'))
+        self.index      = plot_index_grid(self.plots, self.rows, self.columns)
+
+    def plot(self, row, column):
+        """Plot record at 1-based (row, column), None outside the layout or where there is no plot"""
+
+        if not (1 <= row <= self.rows and 1 <= column <= self.columns):
+            return None
+        p = self.index[row - 1, column - 1]
+
+        return None if p < 0 else self.plots[p]
+
+    def details(self, row, column):
+        """Everything known about the plot at 1-based (row, column)
+
+        Returns:
+            dictionary with row, column, plot ID, status ('measured', 'discarded',
+            'blank' or 'missing'), material, treatments and every observation
+            (variable, trait, unit, date, raw and corrected values), in the
+            order of the study
+        """
+
+        details = {'row': row, 'column': column, 'plot_id': None, 'status': 'missing',
+                   'material': None, 'treatments': [], 'observations': []}
+
+        plot = self.plot(row, column)
+        if plot is None or 'rows' not in plot:
+            return details
+
+        plot_row = plot['rows'][0]
+        details['plot_id'] = plot_row.get('study_index')
+        if 'discard' in plot_row or 'blank' in plot_row:
+            details['status'] = 'discarded' if 'discard' in plot_row else 'blank'
+            return details
+
+        details['status']     = 'measured'
+        details['material']   = plot_row.get('material')
+        details['treatments'] = plot_row.get('treatments', [])
+
+        for observation in plot_row.get('observations', []):
+            variable = observation['phenotype']['variable']
+            details['observations'].append({'variable'       : variable,
+                                            'trait'          : searchPhenotypeTrait(self.phenotypes, variable),
+                                            'unit'           : searchPhenotypeUnit(self.phenotypes, variable),
+                                            'date'           : observation.get('date'),
+                                            'raw_value'      : observation.get('raw_value'),
+                                            'corrected_value': observation.get('corrected_value')})
+
+        return details
+
+####################################################################################
+def details_component(details):
+    """Dash components showing plot_details: plot summary and a table of its observations"""
+
+    from dash import html
+
+    header = 'Row ' + str(details['row']) + ', column ' + str(details['column'])
+    if details['plot_id'] is not None:
+        header += ' (plot ' + str(details['plot_id']) + ')'
+    children = [html.H5(header)]
+
+    if details['status'] != 'measured':
+        children.append(html.P(details['status'].capitalize() + ' plot'))
+        return html.Div(children)
+
+    material = details['material'] or {}
+    children.append(html.P('Accession: ' + str(material.get('accession', 'N/A'))))
+    for key, value in material.items():
+        if key != 'accession' and not isinstance(value, (dict, list)):
+            children.append(html.P(key + ': ' + str(value)))
+    for treatment in details['treatments']:
+        children.append(html.P('Treatment: ' + str(treatment.get('so:sameAs')) + ' (' + str(treatment.get('label')) + ')'))
+
+    columns = ['variable', 'trait', 'unit', 'date', 'raw_value', 'corrected_value']
+    head    = html.Tr([html.Th(column) for column in columns])
+    body    = [html.Tr([html.Td('' if obs[column] is None else str(obs[column])) for column in columns])
+               for obs in details['observations']]
+    children.append(html.Table([html.Thead(head), html.Tbody(body)]))
+
+    return html.Div(children)
+
+####################################################################################
+def register_plot_details(app, graph_id, details_id, study_dropdown_id, fetch, cache_size=8, version=None):
+    """Show the full record of a clicked cell of a lean_figure
+
+    The study is fetched and indexed once (PlotDetails) and kept in a small
+    LRU cache, so each click only costs an array lookup on the server. The
+    cache is keyed on the study id and its version, so a study updated in
+    the store is indexed again; the returned callback also has cache_clear,
+    e.g. for a sync_catalogue hook in the same process.
+
+        register_plot_details(app, 'HEATMAP', 'DETAILS', 'DROPDOWN1',
+                              functools.partial(load_cached_study, store_dir),
+                              version=lambda study_id: os.path.getmtime(study_path(store_dir, study_id)))
+
+    Args:
+        graph_id         : dcc.Graph showing the lean figure
+        details_id       : html.Div receiving the details
+        study_dropdown_id: dropdown whose value is the study id
+        fetch            : function returning a study JSON given its id (get_plot,
+                           or functools.partial(load_cached_study, store_dir))
+        cache_size       : number of indexed studies kept in memory
+        version          : optional function giving the version of a study (payload hash,
+                           modification time of the cached file), default the study never changes
+    """
+
+    from dash import Input, Output, State
+    from dash.exceptions import PreventUpdate
+
+    @functools.lru_cache(maxsize=cache_size)
+    def study_plots(study_id, study_version):
+        return PlotDetails(json.loads(fetch(study_id)))
+
+    @app.callback(Output(details_id, 'children'), Input(graph_id, 'clickData'), State(study_dropdown_id, 'value'))
+    def show_details(click_data, study_id):
+        if click_data is None or study_id is None:
+            raise PreventUpdate
+        point = click_data['points'][0]
+
+        study_version = None if version is None else version(study_id)
+
+        return details_component(study_plots(study_id, study_version).details(int(point['y']), int(point['x'])))
+
+    show_details.cache_clear = study_plots.cache_clear
+
+    return show_details
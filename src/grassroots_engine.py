@@ -0,0 +1,544 @@
+import numpy as np
+from functools import reduce
+from dataclasses import dataclass
+
+from src.grassroots_grids import observation_value, observation_layers, layout_shape
+from src.grassroots_instrument import timed
+
+
+# codes of the status grids (uint8), the NaN/inf sentinels of the value grids made explicit
+MEASURED      = 0
+NOT_AVAILABLE = 1   # plot without a value for the phenotype (inf)
+DISCARDED     = 2   # discarded or missing plot (NaN)
+BLANK         = 3   # blank plot (NaN)
+
+####################################################################################
+@dataclass
+class StudyGrid:
+    """Grids of one phenotype of a study, shared by the notebook and Dash front ends
+
+    Arrays are flat, in row major order (row 1 first).
+    values uses NaN for discarded/blank plots and inf for N/A plots;
+    raw_layer and cor_layer keep raw_value and corrected_value apart
+    (values prefers the corrected one). status holds the same information
+    as the sentinels as uint8 codes (MEASURED, NOT_AVAILABLE, DISCARDED, BLANK).
+    """
+
+    rows      : int
+    columns   : int
+    values    : np.ndarray
+    trait     : str
+    unit      : str
+    accession : np.ndarray
+    plot_ids  : np.ndarray
+    raw_layer : np.ndarray
+    cor_layer : np.ndarray
+    status    : np.ndarray = None
+
+    def grid(self):
+        """values as a (rows, columns) array"""
+        return self.values.reshape(self.rows, self.columns)
+
+    def dense(self):
+        """Already dense (see SparseGrid.dense)"""
+        return self
+
+###################################################################
+def lookup_keys(dictionary, keys, default=None):
+     return reduce(lambda d, key: d.get(key, default) if isinstance(d, dict) else default, keys.split("."), dictionary)
+
+###################################################################
+def searchPhenotypeTrait(listPheno, value):
+
+    name = listPheno[value]['definition']['trait']['so:name']
+
+    return name
+
+###################################################################
+def searchPhenotypeUnit(listPheno, value):
+
+    name = listPheno[value]['definition']['unit']['so:name']
+
+    return name
+
+
+###################################################################
+def search_phenotype(list_observations, value):
+
+    found = False
+    for i in range(len(list_observations)):
+
+        dic            = list_observations[i]
+        phenotype_name = lookup_keys(dic, 'phenotype.variable')
+        if  (phenotype_name == value ):
+              return True
+              break
+
+    return found
+
+############################################################################
+def search_phenotype_index(list_observations, value):
+
+    for i in range(len(list_observations)):
+
+        dic            = list_observations[i]
+        phenotype_name = lookup_keys(dic, 'phenotype.variable')
+        if  (phenotype_name == value ):
+              return i
+
+
+####################################################################
+@timed('dict_phenotypes')
+def dict_phenotypes(pheno, plots):
+    """Extract traits of phenotypes 
+
+    Args:
+        pheno: list of phenotypes of a particular study 
+        plots     : plots data of a particular study
+
+    Returns:
+        dictionary: keys: phenotypes names, values: traits
+    """
+
+    names = []
+    traits = []
+    for key in pheno:
+        #print("-->", key)
+         
+
+        names.append(key)
+        traits.append(pheno[key]['definition']['trait']['so:name'])
+
+    phenoDict = dict(zip(names, traits))
+
+    for j in range(len(plots)):
+        if ( 'discard' in plots[j]['rows'][0] ):
+            pass
+        if ('observations' in plots[j]['rows'][0]):
+            for k in range(len(plots[j]['rows'][0]['observations'])):
+                if ('raw_value' in plots[j]['rows'][0]['observations'][k]):
+                    rawValue = plots[j]['rows'][0]['observations'][k]['raw_value']
+                if ('corrected_value' in plots[j]['rows'][0]['observations'][k]):
+                    rawValue = plots[j]['rows'][0]['observations'][k]['corrected_value']
+                if ( type(rawValue) == str):
+                    name = plots[j]['rows'][0]['observations'][k]['phenotype']['variable']
+                    if( name in phenoDict.keys() ):
+                        # print("Remove:", phenoDict[name])
+                        del phenoDict[name]
+    
+    return phenoDict   
+
+
+####################################################################
+@timed('create_matrices')
+def build_grid(json, pheno, current_name, total_rows, total_columns, dtype=np.float64):
+    """create numpy matrices for plotting
+
+    Args:
+        json     : Plots data of a particular study
+        pheno    : Phenotypes of particular study
+        name     : Name of current study
+        dtype    : float type of the value grids (np.float32 halves their size)
+
+    Returns:
+        StudyGrid: flat value, accession and plot ID arrays of a rectangular study,
+        SparseGrid of an odd-shaped one (dense() gives its StudyGrid when plotting)
+    """
+
+
+    traitName = searchPhenotypeTrait(pheno, current_name)
+    unit      = searchPhenotypeUnit( pheno, current_name)
+
+    rows, columns = layout_shape(json)
+    if not row_major(json, rows, columns):
+        # odd shape: plots placed by their indexes in the bounding box (widened
+        # to total_columns) in a single pass, no walk and nothing dense yet
+        rows, columns = layout_shape(json, total_columns)
+        grid = sparse_layout(json, current_name, rows, columns, dtype)
+        grid.trait, grid.unit = traitName, unit
+        return grid
+
+    dtID= np.dtype(('U', 4))
+
+    row_raw   = np.array([])
+    matrix    = np.array([])
+    row_acc   = np.array([])
+    raw_layer = np.array([])   # raw_value and corrected_value kept apart, row_raw prefers corrected
+    cor_layer = np.array([])
+    accession = np.array([])
+    plotsIds  = np.array([], dtype=dtID)  #format of strings
+
+    num_columns = 1
+    row    = 1
+    column = 1
+    #loop throght observations in the same fashion as in old JS code. 
+    for j in range(len(json)):
+        if ( int( json[j]['row_index'] ) == row ):
+            if  (int( json[j]['column_index'] ) == column):
+               if column > num_columns:
+                   num_columns = column
+
+               if   ( 'discard' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
+                    raw_layer, cor_layer = np.append(raw_layer, np.nan), np.append(cor_layer, np.nan)
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+               elif ( 'blank' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
+                    raw_layer, cor_layer = np.append(raw_layer, np.nan), np.append(cor_layer, np.nan)
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+      
+               elif ( 'observations' in json[j]['rows'][0] ):
+                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
+                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
+                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
+                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
+                        row_raw  = np.append(row_raw, rawValue) 
+                        rawLayer, corLayer   = observation_layers(json[j]['rows'][0]['observations'][indexCurrentPhenotype])
+                        raw_layer, cor_layer = np.append(raw_layer, rawLayer), np.append(cor_layer, corLayer)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+                    else:
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        raw_layer, cor_layer = np.append(raw_layer, np.inf), np.append(cor_layer, np.inf)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+               else:
+                    if ( 'rows' in json[j] ):
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        raw_layer, cor_layer = np.append(raw_layer, np.inf), np.append(cor_layer, np.inf)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+         
+  
+               column+=1
+               columns = json[j]['column_index']#
+
+        elif ( int( json[j]['row_index'] ) > row  ):
+            if column > num_columns:
+                   num_columns = column
+
+            if   ( 'discard' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  
+                    raw_layer, cor_layer = np.append(raw_layer, np.nan), np.append(cor_layer, np.nan)
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+            elif   ( 'blank' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  
+                    raw_layer, cor_layer = np.append(raw_layer, np.nan), np.append(cor_layer, np.nan)
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+        
+            elif ( 'observations' in json[j]['rows'][0] ):
+                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
+                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
+                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
+                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
+                        row_raw  = np.append(row_raw, rawValue) 
+                        rawLayer, corLayer   = observation_layers(json[j]['rows'][0]['observations'][indexCurrentPhenotype])
+                        raw_layer, cor_layer = np.append(raw_layer, rawLayer), np.append(cor_layer, corLayer)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+                    else:
+                        row_raw  = np.append(row_raw, np.inf )
+                        raw_layer, cor_layer = np.append(raw_layer, np.inf), np.append(cor_layer, np.inf)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+            else:
+                    if ( 'rows' in json[j] ):
+                        ##print("rows with no observations------",json[j])
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        raw_layer, cor_layer = np.append(raw_layer, np.inf), np.append(cor_layer, np.inf)
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+             
+
+            row+=1
+            column=2
+            columns = json[j]['column_index']
+
+
+    #column = columns # use actual number of columns instead of counter
+    column = num_columns-1
+
+    if column<columns:
+        column=columns
+
+    status = status_grid(json, row_raw, row, column)
+
+    return StudyGrid(rows=row, columns=column, values=row_raw.astype(dtype, copy=False), trait=traitName, unit=unit,
+                     accession=row_acc, plot_ids=plotsIds, raw_layer=raw_layer.astype(dtype, copy=False),
+                     cor_layer=cor_layer.astype(dtype, copy=False), status=status)
+
+####################################################################################
+def row_major(plots, rows, columns):
+    """True when the plots fill the rows x columns layout one by one, row 1 first"""
+
+    if len(plots) != rows * columns:
+        return False
+    for k, plot in enumerate(plots):
+        if int(plot['row_index']) != k // columns + 1 or int(plot['column_index']) != k % columns + 1:
+            return False
+
+    return True
+
+####################################################################################
+def status_grid(plots, values, rows, columns):
+    """Status codes of a flat value array, blank plots told apart from discarded ones
+
+    Returns:
+        flat uint8 array: MEASURED, NOT_AVAILABLE (inf), DISCARDED (NaN) or BLANK
+    """
+
+    status = np.full(len(values), MEASURED, dtype=np.uint8)
+    status[np.isinf(values)] = NOT_AVAILABLE
+    status[np.isnan(values)] = DISCARDED
+
+    for plot in plots:
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        if 'blank' in plot_row and 'discard' not in plot_row:
+            i = int(plot['row_index'])    - 1
+            j = int(plot['column_index']) - 1
+            if i < rows and j < columns:
+                status[i*columns + j] = BLANK
+
+    return status
+
+##############--------------------------------##########################
+def study_grid(single_study, selected, dtype=np.float64):
+    """StudyGrid (SparseGrid for odd shapes) of a phenotype of a deserialised study"""
+
+    data = single_study['results'][0]['results'][0]['data']
+
+    return build_grid(data['plots'], data['phenotypes'], selected, data.get('num_rows'), data.get('num_columns'), dtype)
+
+####################################################################################
+@dataclass
+class SparseGrid:
+    """Plots of one phenotype of a study as coordinates, one entry per real plot
+
+    Memory follows the number of plots, not the (rows, columns) bounding box;
+    densify builds a flat row major array of the box only when it is needed.
+    Entries follow the create_matrices conventions (NaN discarded/blank,
+    inf N/A, 'nan' accession for discarded/blank plots).
+    """
+
+    rows         : int
+    columns      : int
+    row_index    : np.ndarray   # 0-based
+    column_index : np.ndarray   # 0-based
+    values       : np.ndarray
+    raw_layer    : np.ndarray
+    cor_layer    : np.ndarray
+    status       : np.ndarray
+    accession    : np.ndarray
+    plot_ids     : np.ndarray
+    trait        : str = None
+    unit         : str = None
+
+    # cells of the bounding box without a plot
+    FILLS = {'values': np.nan, 'raw_layer': np.nan, 'cor_layer': np.nan, 'status': DISCARDED,
+             'accession': 'Discarded', 'plot_ids': 'N/A'}
+
+    def densify(self, field):
+        """Flat (rows * columns) array of a field, bounding box cells filled as oddShape* did"""
+
+        sparse = getattr(self, field)
+        fill   = self.FILLS[field]
+        dtype  = np.result_type(sparse.dtype, np.array(fill).dtype) if sparse.dtype.kind == 'U' else sparse.dtype
+        dense  = np.full(self.rows * self.columns, fill, dtype=dtype)
+        dense[self.row_index * self.columns + self.column_index] = sparse
+
+        return dense
+
+    def dense(self):
+        """StudyGrid of the bounding box, built when the grid is plotted"""
+
+        return StudyGrid(rows=self.rows, columns=self.columns, values=self.densify('values'), trait=self.trait,
+                         unit=self.unit, accession=self.densify('accession'), plot_ids=self.densify('plot_ids'),
+                         raw_layer=self.densify('raw_layer'), cor_layer=self.densify('cor_layer'),
+                         status=self.densify('status'))
+
+####################################################################################
+@timed('sparse_layout')
+def sparse_layout(plots, phenotype, rows=None, columns=None, dtype=np.float64):
+    """SparseGrid of a phenotype in a single pass over the plots
+
+    Args:
+        plots    : plots data of a particular study
+        phenotype: phenotype variable
+        rows     : rows of the bounding box, default the largest row_index
+        columns  : columns of the bounding box, default the largest column_index
+        dtype    : float type of the values
+    """
+
+    n      = len(plots)
+    row_i  = np.empty(n, dtype=np.int32)
+    col_j  = np.empty(n, dtype=np.int32)
+    values = np.empty(n, dtype=dtype)
+    raw    = np.empty(n, dtype=dtype)
+    cor    = np.empty(n, dtype=dtype)
+    status = np.empty(n, dtype=np.uint8)
+    names  = []
+    ids    = []
+
+    k = 0
+    for plot in plots:
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        row_i[k] = int(plot['row_index'])    - 1
+        col_j[k] = int(plot['column_index']) - 1
+        # as oddShapePlotID: blank plots and plots without observations keep 'N/A'
+        has_id = 'discard' in plot_row or ('blank' not in plot_row and 'observations' in plot_row)
+        ids.append(str(plot_row.get('study_index', 'N/A')) if has_id else 'N/A')
+
+        if 'discard' in plot_row or 'blank' in plot_row:
+            values[k] = raw[k] = cor[k] = np.nan
+            status[k] = DISCARDED if 'discard' in plot_row else BLANK
+            names.append('nan')
+        else:
+            names.append(lookup_keys(plot_row, 'material.accession', ''))
+            index = None
+            if 'observations' in plot_row:
+                index = search_phenotype_index(plot_row['observations'], phenotype)
+            value = None
+            if index is not None:
+                observation = plot_row['observations'][index]
+                value       = observation_value(observation)
+            if value is None:
+                values[k] = raw[k] = cor[k] = np.inf      # N/A
+                status[k] = NOT_AVAILABLE
+            else:
+                values[k] = value
+                raw[k], cor[k] = observation_layers(observation)
+                status[k] = MEASURED
+        k += 1
+
+    if rows is None:
+        rows = int(row_i[:k].max()) + 1 if k else 0
+    if columns is None:
+        columns = int(col_j[:k].max()) + 1 if k else 0
+
+    return SparseGrid(rows=rows, columns=columns, row_index=row_i[:k], column_index=col_j[:k],
+                      values=values[:k], raw_layer=raw[:k], cor_layer=cor[:k], status=status[:k],
+                      accession=np.array(names, dtype=str), plot_ids=np.array(ids, dtype=str))
+
+####################################################################################
+def sparse_grid(single_study, selected, dtype=np.float64):
+    """SparseGrid of a phenotype of a deserialised study, bounding box as build_grid"""
+
+    data    = single_study['results'][0]['results'][0]['data']
+    columns = None
+    if data.get('num_columns') is not None:
+        columns = max(int(data['num_columns']), max((int(p['column_index']) for p in data['plots']), default=0))
+
+    return sparse_layout(data['plots'], selected, columns=columns, dtype=dtype)
+
+####################################################################################
+# dense views of sparse_layout, kept for callers of the old odd shape walks
+def oddShapeValues(arraysJson, rows, columns, phenotype, layers=False):
+
+    sparse = sparse_layout(arraysJson, phenotype, rows, columns)
+    matrix = sparse.densify('values')
+
+    if layers:
+        return matrix, sparse.densify('raw_layer'), sparse.densify('cor_layer')
+    return matrix
+
+#######################################################################
+def oddShapeAccession(arraysJson, rows, columns, phenotype):
+
+    return sparse_layout(arraysJson, phenotype, rows, columns).densify('accession')
+
+#######################################################################
+def oddShapePlotID(arraysJson, rows, columns, phenotype):
+
+    return sparse_layout(arraysJson, phenotype, rows, columns).densify('plot_ids')
+
+##############################################################################################
+@timed('hover_text')
+def value_strings(values, missing=None):
+    """Hover strings of a value array, 'N/A' for sentinels
+
+    Args:
+        values : value array (any shape, strings keep it)
+        missing: optional mask of the sentinels, ~isfinite(values) if not given
+    """
+
+    strings = np.array(["%s" % x for x in values.flat]).reshape(np.shape(values))
+    flat    = strings.reshape(-1)
+
+    for i in range(len(flat)):   #remove decimal place when floats are integers
+        string_split = flat[i].split('.')
+        if( len(string_split)==2):
+            if(string_split[1]=='0'):
+                flat[i] = flat[i][:-2]
+
+    if missing is None:
+        missing = ~np.isfinite(values)
+    strings[missing] = 'N/A'
+    return strings
+
+##############################################################################################
+def render_prep(numpy_matrix, shape, status=None):
+    """Grid view and sentinel masks of a value array, derived once for rendering
+
+    Nothing is copied or modified: values is a (rows, columns) view of the
+    input, so cached grids can be rendered from several threads. When a
+    status grid is given the masks come from it instead of the sentinels.
+
+    Returns:
+        dictionary with
+            values       : (rows, columns) view of numpy_matrix
+            not_available: bool mask of N/A plots (inf)
+            discarded    : bool mask of discarded/blank plots (NaN)
+            blank        : bool mask of blank plots, None without status
+            measured     : bool mask of plots with a value
+    """
+
+    values = np.asarray(numpy_matrix).reshape(shape)
+
+    if status is not None:
+        status = np.asarray(status).reshape(shape)
+        return {'values'       : values,
+                'not_available': status == NOT_AVAILABLE,
+                'discarded'    : status >= DISCARDED,
+                'blank'        : status == BLANK,
+                'measured'     : status == MEASURED}
+
+    not_available = np.isinf(values)
+    discarded     = np.isnan(values)
+
+    return {'values'       : values,
+            'not_available': not_available,
+            'discarded'    : discarded,
+            'blank'        : None,
+            'measured'     : ~(not_available | discarded)}
+
+##############################################################################################
+def hover_grids(prep, accession):
+    """Value strings and accession names of the hover text, (rows, columns) in field order
+
+    Inputs are left untouched: values are 'N/A' for sentinels and the
+    accession of discarded plots is 'Discarded' ('Blank' for blank plots
+    when the status grid is known).
+
+    Args:
+        prep     : render_prep of the values
+        accession: accession names (rows, columns)
+    """
+
+    strings   = value_strings(prep['values'], ~prep['measured'])
+    accession = np.where(prep['discarded'], 'Discarded', accession)
+    if prep['blank'] is not None:
+        accession = np.where(prep['blank'], 'Blank', accession)
+
+    return strings, accession
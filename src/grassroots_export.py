@@ -0,0 +1,154 @@
+import json
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:   # parquet output is optional, CSV always works
+    pa = None
+    pq = None
+
+
+EXPORT_COLUMNS = ['study', 'row', 'column', 'plot_id', 'accession', 'phenotype',
+                  'raw_value', 'corrected_value', 'date', 'treatment', 'raw_text', 'corrected_text']
+
+####################################################################################
+def numeric_value(value):
+    """Split an observation value into (number, text)
+
+    Returns:
+        tuple: (float, None) for a number, (None, original string) for a value
+               that is not a number, (None, None) when the value is absent
+    """
+
+    if value is None:
+        return None, None
+    if isinstance(value, bool):
+        return None, str(value)
+    try:
+        return float(value), None
+    except (TypeError, ValueError):
+        return None, str(value)
+
+####################################################################################
+def treatment_label(plot_row):
+    """Combine treatments of a plot into a single string, same format as the hover text"""
+
+    treat = []
+    for t in plot_row.get('treatments', []):
+        treat.append(t['so:sameAs'] + ' (' + t['label'] + ')')
+
+    return ', '.join(treat)
+
+####################################################################################
+def study_records(json_study):
+    """Flatten plots x observations of a study into long format records
+
+    Args:
+        json_study: study as returned by get_plot (JSON string) or already deserialised
+
+    Absent raw or corrected values are left empty (null in parquet); values
+    that are not numbers are left empty as well and kept as written in
+    raw_text / corrected_text, so nothing is silently turned into NaN.
+
+    Returns:
+        generator: one tuple per observation, ordered as EXPORT_COLUMNS
+    """
+
+    if isinstance(json_study, str):
+        json_study = json.loads(json_study)
+
+    data  = json_study['results'][0]['results'][0]['data']
+    study = data.get('_id', {}).get('$oid', data.get('so:name'))
+
+    for plot in data['plots']:
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row:
+            continue
+
+        accession = plot_row.get('material', {}).get('accession')
+        treatment = treatment_label(plot_row)
+
+        for obs in plot_row.get('observations', []):
+            raw_value, raw_text             = numeric_value(obs.get('raw_value'))
+            corrected_value, corrected_text = numeric_value(obs.get('corrected_value'))
+            yield (study,
+                   int(plot['row_index']),
+                   int(plot['column_index']),
+                   str(plot_row['study_index']),
+                   accession,
+                   obs['phenotype']['variable'],
+                   raw_value,
+                   corrected_value,
+                   obs.get('date'),
+                   treatment,
+                   raw_text,
+                   corrected_text)
+
+####################################################################################
+def _write_chunk(writer, chunk):
+
+    if writer[0] == 'parquet':
+        schema = writer[2]
+        table  = pa.Table.from_arrays([pa.array(col, type=schema.field(i).type) for i, col in enumerate(chunk)],
+                                      schema=schema)
+        writer[1].write_table(table)
+    else:
+        writer[1].writerows(zip(*chunk))
+
+####################################################################################
+def export_observations(json_studies, path, chunk_size=100000):
+    """Export observations of several studies into a single columnar long table
+
+    Studies are consumed one at a time and rows are written every chunk_size
+    records, so a generator of studies, e.g. (get_plot(i) for i in ids), keeps
+    memory bounded whatever the size of the catalogue.
+
+    Args:
+        json_studies: iterable of studies (JSON strings or deserialised)
+        path        : output file, .parquet (needs pyarrow) or anything else for CSV
+        chunk_size  : number of records held in memory before writing
+
+    Returns:
+        int: total number of records written
+    """
+
+    parquet = str(path).endswith('.parquet')
+    if parquet and pa is None:
+        raise ImportError("pyarrow is required for parquet export, use a .csv path instead")
+
+    if parquet:
+        schema = pa.schema([('study', pa.string()), ('row', pa.int32()), ('column', pa.int32()),
+                            ('plot_id', pa.string()), ('accession', pa.string()),
+                            ('phenotype', pa.string()), ('raw_value', pa.float64()),
+                            ('corrected_value', pa.float64()), ('date', pa.string()),
+                            ('treatment', pa.string()), ('raw_text', pa.string()),
+                            ('corrected_text', pa.string())])
+        handle = pq.ParquetWriter(path, schema)
+        writer = ('parquet', handle, schema)
+    else:
+        handle = open(path, 'w', newline='')
+        writer = ('csv', csv.writer(handle))
+        writer[1].writerow(EXPORT_COLUMNS)
+
+    total = 0
+    chunk = [[] for _ in EXPORT_COLUMNS]
+    try:
+        for json_study in json_studies:
+            for record in study_records(json_study):
+                for col, value in zip(chunk, record):
+                    col.append(value)
+                if len(chunk[0]) >= chunk_size:
+                    _write_chunk(writer, chunk)
+                    total += len(chunk[0])
+                    chunk = [[] for _ in EXPORT_COLUMNS]
+
+        if len(chunk[0]) > 0:
+            _write_chunk(writer, chunk)
+            total += len(chunk[0])
+    finally:
+        handle.close()
+
+    return total
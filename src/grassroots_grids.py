@@ -0,0 +1,318 @@
+import json
+
+import numpy as np
+
+
+LAYERS = ['value', 'raw', 'corrected', 'difference']   # value: corrected if available, else raw
+
+####################################################################################
+def study_data(single_study):
+    """Data section of a study (JSON string from get_plot or deserialised)"""
+
+    if isinstance(single_study, str):
+        single_study = json.loads(single_study)
+
+    return single_study['results'][0]['results'][0]['data']
+
+####################################################################################
+def observation_value(observation):
+    """Value of an observation, corrected value preferred over raw value (as in create_matrices)"""
+
+    value = None
+    if 'raw_value' in observation:
+        value = observation['raw_value']
+    if 'corrected_value' in observation:
+        value = observation['corrected_value']
+
+    return value
+
+####################################################################################
+def observation_layers(observation):
+    """Raw and corrected values of an observation, inf (N/A) for the missing one"""
+
+    raw       = observation.get('raw_value', np.inf)
+    corrected = observation.get('corrected_value', np.inf)
+
+    return raw, corrected
+
+####################################################################################
+def difference_layer(raw_layer, cor_layer):
+    """Corrected minus raw value where both exist, N/A (inf) where one is missing, NaN for discarded"""
+
+    both = np.isfinite(raw_layer) & np.isfinite(cor_layer)
+    with np.errstate(invalid='ignore'):
+        difference = np.where(both, cor_layer - raw_layer, np.inf)
+    difference[np.isnan(raw_layer)] = np.nan
+
+    return difference
+
+####################################################################################
+def layout_shape(plots, total_columns=None):
+    """Bounding box (rows, columns) of the plots of a study, 1-based indexes"""
+
+    rows    = 0
+    columns = 0
+    for plot in plots:
+        rows    = max(rows,    int(plot['row_index']))
+        columns = max(columns, int(plot['column_index']))
+
+    if total_columns is not None and columns < total_columns:
+        columns = total_columns
+
+    return rows, columns
+
+####################################################################################
+def study_tensor(single_study, phenotypes=None, dtype=np.float64, sparse=False):
+    """Values of every phenotype of a study in a single pass over the plots
+
+    Cells follow the same conventions as create_matrices: NaN for discarded,
+    blank or missing plots and inf for plots without a value (N/A).
+    Phenotypes with non-numeric values are dropped, as dict_phenotypes does.
+
+    The tensor is built with one entry per plot (sparse=True returns it as
+    is, row_index and column_index giving the cell of every entry), so odd
+    shaped studies never pay for their bounding box unless a grid is asked
+    for (dense_tensor).
+
+    Args:
+        single_study: study (JSON string or deserialised)
+        phenotypes  : phenotype variables to extract, default all of the study
+        dtype       : float type of values (np.float32 halves the tensor)
+        sparse      : one entry per plot instead of (rows, columns) grids
+
+    Returns:
+        dictionary with
+            phenotypes     : list of phenotype variables, first axis of values
+            values         : float array (phenotypes, rows, columns)
+            status         : uint8 array (phenotypes, rows, columns), 0 measured,
+                             1 N/A, 2 discarded or missing, 3 blank (as grassroots_engine)
+            accessions     : list of accession names
+            accession_codes: int array (rows, columns), index in accessions, -1 if none
+            plot_index     : int array (rows, columns), index in plots list, -1 if none
+            rows, columns  : shape of the grid
+        with sparse=True the (rows, columns) axes are replaced by one axis of
+        plots, plus row_index and column_index (0-based) of every plot
+    """
+
+    data  = study_data(single_study)
+    plots = data['plots']
+
+    if phenotypes is None:
+        phenotypes = list(data['phenotypes'].keys())
+    pheno_index = {name: k for k, name in enumerate(phenotypes)}
+
+    rows, columns = layout_shape(plots, data.get('num_columns'))
+
+    n               = sum(1 for plot in plots if 'rows' in plot)
+    values          = np.full((len(phenotypes), n), np.nan, dtype=dtype)
+    status          = np.full((len(phenotypes), n), 2, dtype=np.uint8)
+    accession_codes = np.full(n, -1, dtype=np.int32)
+    plot_index      = np.full(n, -1, dtype=np.int32)
+    row_index       = np.empty(n, dtype=np.int32)
+    column_index    = np.empty(n, dtype=np.int32)
+    accession_index = {}
+    non_numeric     = set()
+
+    e = 0
+    for p, plot in enumerate(plots):
+        if 'rows' not in plot:
+            continue
+        row_index[e]    = int(plot['row_index'])    - 1
+        column_index[e] = int(plot['column_index']) - 1
+        plot_index[e]   = p
+        e += 1
+
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row:
+            continue
+        if 'blank' in plot_row:
+            status[:, e - 1] = 3
+            continue
+
+        values[:, e - 1] = np.inf   # N/A unless observed below
+        status[:, e - 1] = 1
+
+        if 'material' in plot_row:
+            name = plot_row['material']['accession']
+            accession_codes[e - 1] = accession_index.setdefault(name, len(accession_index))
+
+        seen = set()
+        for obs in plot_row.get('observations', []):
+            k = pheno_index.get(obs['phenotype']['variable'])
+            if k is None or k in seen:      # keep first match, as search_phenotype_index
+                continue
+            seen.add(k)
+            value = observation_value(obs)
+            if isinstance(value, str):
+                non_numeric.add(k)
+                continue
+            if value is not None:
+                values[k, e - 1] = value
+                status[k, e - 1] = 0
+
+    keep = [k for k in range(len(phenotypes)) if k not in non_numeric]
+    if len(keep) < len(phenotypes):
+        values     = values[keep]
+        status     = status[keep]
+        phenotypes = [phenotypes[k] for k in keep]
+
+    tensor = {'phenotypes'     : list(phenotypes),
+              'values'         : values,
+              'status'         : status,
+              'accessions'     : list(accession_index.keys()),
+              'accession_codes': accession_codes,
+              'plot_index'     : plot_index,
+              'row_index'      : row_index,
+              'column_index'   : column_index,
+              'rows'           : rows,
+              'columns'        : columns}
+
+    return tensor if sparse else dense_tensor(tensor)
+
+####################################################################################
+def dense_tensor(tensor):
+    """(rows, columns) grids of a sparse study_tensor, cells without a plot NaN / discarded"""
+
+    if 'row_index' not in tensor:      # already dense
+        return tensor
+
+    rows, columns = tensor['rows'], tensor['columns']
+    cells         = (tensor['row_index'], tensor['column_index'])
+    n_pheno       = len(tensor['phenotypes'])
+
+    values          = np.full((n_pheno, rows, columns), np.nan, dtype=tensor['values'].dtype)
+    status          = np.full((n_pheno, rows, columns), 2, dtype=np.uint8)
+    accession_codes = np.full((rows, columns), -1, dtype=np.int32)
+    plot_index      = np.full((rows, columns), -1, dtype=np.int32)
+    values[:, cells[0], cells[1]] = tensor['values']
+    status[:, cells[0], cells[1]] = tensor['status']
+    accession_codes[cells]        = tensor['accession_codes']
+    plot_index[cells]             = tensor['plot_index']
+
+    return {'phenotypes'     : tensor['phenotypes'],
+            'values'         : values,
+            'status'         : status,
+            'accessions'     : tensor['accessions'],
+            'accession_codes': accession_codes,
+            'plot_index'     : plot_index,
+            'rows'           : rows,
+            'columns'        : columns}
+
+####################################################################################
+def phenotype_frames(single_study, phenotype):
+    """Values of a phenotype for every observation date, in a single pass over the plots
+
+    Plots can hold several observations of the same phenotype taken on
+    different dates; each date becomes one frame of the stack. Within a frame
+    cells follow the create_matrices conventions (NaN discarded/blank, inf N/A).
+    Observations without a date are grouped under the date None.
+
+    Args:
+        single_study: study (JSON string or deserialised)
+        phenotype   : phenotype variable
+
+    Returns:
+        dictionary with
+            dates          : sorted list of dates, first axis of frames
+            frames         : float array (dates, rows, columns)
+            accessions     : list of accession names
+            accession_codes: int array (rows, columns), -1 if none
+            plot_index     : int array (rows, columns), index in plots list, -1 if none
+            rows, columns  : shape of the grid
+    """
+
+    data  = study_data(single_study)
+    plots = data['plots']
+
+    rows, columns = layout_shape(plots, data.get('num_columns'))
+
+    base            = np.full((rows, columns), np.nan)
+    accession_codes = np.full((rows, columns), -1, dtype=np.int32)
+    plot_index      = np.full((rows, columns), -1, dtype=np.int32)
+    accession_index = {}
+    date_index      = {}
+    obs_date, obs_i, obs_j, obs_value = [], [], [], []
+
+    for p, plot in enumerate(plots):
+        if 'rows' not in plot:
+            continue
+        i = int(plot['row_index'])    - 1
+        j = int(plot['column_index']) - 1
+        plot_index[i, j] = p
+
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row:
+            continue
+        base[i, j] = np.inf
+
+        if 'material' in plot_row:
+            name = plot_row['material']['accession']
+            accession_codes[i, j] = accession_index.setdefault(name, len(accession_index))
+
+        for obs in plot_row.get('observations', []):
+            if obs['phenotype']['variable'] != phenotype:
+                continue
+            value = observation_value(obs)
+            if value is None or isinstance(value, str):
+                continue
+            obs_date.append(date_index.setdefault(obs.get('date'), len(date_index)))
+            obs_i.append(i)
+            obs_j.append(j)
+            obs_value.append(value)
+
+    dates = sorted(date_index, key=lambda d: (d is not None, d or ''))
+    order = np.array([date_index[d] for d in dates], dtype=np.intp)
+    rank  = np.empty(len(dates), dtype=np.intp)
+    rank[order] = np.arange(len(dates))
+
+    frames = np.repeat(base[np.newaxis], len(dates), axis=0)
+    if len(obs_value) > 0:
+        # reversed so that the first observation of a date wins, as search_phenotype_index
+        frames[rank[obs_date[::-1]], obs_i[::-1], obs_j[::-1]] = obs_value[::-1]
+
+    return {'dates'          : dates,
+            'frames'         : frames,
+            'accessions'     : list(accession_index.keys()),
+            'accession_codes': accession_codes,
+            'plot_index'     : plot_index,
+            'rows'           : rows,
+            'columns'        : columns}
+
+####################################################################################
+def treatment_codes(plots, rows, columns):
+    """Treatments of every plot interned into integer codes, in a single pass
+
+    Each distinct combination of treatments gets one code; the full label of
+    a code ("so:sameAs (label), ...", as shown in the hover text) is kept in
+    the lookup list, so labels of any length are preserved.
+
+    Args:
+        plots  : plots data of a particular study
+        rows   : number of rows of the grid
+        columns: number of columns of the grid
+
+    Returns:
+        codes : int array (rows, columns), -1 for discarded/blank plots or no treatment
+        labels: list of labels, indexed by code
+    """
+
+    codes       = np.full((rows, columns), -1, dtype=np.int32)
+    combination = {}
+    labels      = []
+
+    for plot in plots:
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row or 'treatments' not in plot_row:
+            continue
+
+        key  = tuple((t['so:sameAs'], t['label']) for t in plot_row['treatments'])
+        code = combination.get(key)
+        if code is None:
+            code = combination[key] = len(labels)
+            labels.append(', '.join(same_as + ' (' + label + ')' for same_as, label in key))
+
+        codes[int(plot['row_index']) - 1, int(plot['column_index']) - 1] = code
+
+    return codes, labels
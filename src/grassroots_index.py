@@ -0,0 +1,246 @@
+import os
+import json
+import bisect
+
+from src.grassroots_grids import study_data
+from src.grassroots_sync  import load_cached_study, _write_atomic
+from src.grassroots_stats import compare_accessions
+
+
+INDEX_FILE = 'search_index.json'
+KINDS      = ('phenotype', 'trait', 'accession')
+
+####################################################################################
+def study_terms(single_study):
+    """Searchable terms of a study and the number of plots behind each of them
+
+    Returns:
+        dictionary: kind ('phenotype', 'trait', 'accession') -> {term: plots}
+                    trait terms are the so:sameAs of the phenotypes (as in dict_otherName)
+    """
+
+    data   = study_data(single_study)
+    traits = {}
+    for key, phenotype in data.get('phenotypes', {}).items():
+        same_as = phenotype.get('definition', {}).get('trait', {}).get('so:sameAs')
+        if same_as is not None:
+            traits[key] = same_as
+
+    terms = {kind: {} for kind in KINDS}
+    for plot in data.get('plots', []):
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row:
+            continue
+
+        if 'material' in plot_row:
+            name = plot_row['material']['accession']
+            terms['accession'][name] = terms['accession'].get(name, 0) + 1
+
+        variables = set(obs['phenotype']['variable'] for obs in plot_row.get('observations', []))
+        for variable in variables:
+            terms['phenotype'][variable] = terms['phenotype'].get(variable, 0) + 1
+        for same_as in set(traits[v] for v in variables if v in traits):
+            terms['trait'][same_as] = terms['trait'].get(same_as, 0) + 1
+
+    return terms
+
+####################################################################################
+class StudyIndex:
+    """Inverted index of the cached studies: phenotype, trait term and accession -> studies
+
+    Every term keeps the plot count of each study it appears in. Terms are
+    also kept in sorted lists (case-insensitive) so prefix queries are a
+    bisection; adding or removing a study only touches its own terms.
+    """
+
+    def __init__(self):
+        self.studies  = {}                             # study id -> {'name', kind: {term: plots}}
+        self.postings = {kind: {} for kind in KINDS}   # kind -> term -> {study id: plots}
+        self.sorted   = {kind: [] for kind in KINDS}   # kind -> sorted [(term.lower(), term)]
+
+    def add_study(self, study_id, json_study):
+        """Index a study (JSON string or deserialised), replacing its previous entry"""
+
+        if isinstance(json_study, str):
+            json_study = json.loads(json_study)
+
+        self.remove_study(study_id)
+        entry = study_terms(json_study)
+        entry['name'] = study_data(json_study).get('so:name')
+        self._insert(study_id, entry)
+
+    def _insert(self, study_id, entry):
+
+        self.studies[study_id] = entry
+        for kind in KINDS:
+            for term, plots in entry[kind].items():
+                posting = self.postings[kind].get(term)
+                if posting is None:
+                    posting = self.postings[kind][term] = {}
+                    bisect.insort(self.sorted[kind], (term.lower(), term))
+                posting[study_id] = plots
+
+    def remove_study(self, study_id):
+
+        entry = self.studies.pop(study_id, None)
+        if entry is None:
+            return
+        for kind in KINDS:
+            for term in entry[kind]:
+                posting = self.postings[kind][term]
+                del posting[study_id]
+                if len(posting) == 0:
+                    del self.postings[kind][term]
+                    keys = self.sorted[kind]
+                    del keys[bisect.bisect_left(keys, (term.lower(), term))]
+
+    def lookup(self, kind, term):
+        """Exact query: {study id: plots} of the studies with the term"""
+
+        return dict(self.postings[kind].get(term, {}))
+
+    def prefix(self, kind, text, limit=50):
+        """Terms starting with text (case-insensitive), in alphabetical order"""
+
+        keys  = self.sorted[kind]
+        text  = text.lower()
+        terms = []
+        for k in range(bisect.bisect_left(keys, (text,)), len(keys)):
+            if not keys[k][0].startswith(text) or len(terms) == limit:
+                break
+            terms.append(keys[k][1])
+
+        return terms
+
+    def search(self, kind, text, limit=50):
+        """Studies of every term starting with text
+
+        Returns:
+            dictionary: study id -> plots, summed over the matching terms
+        """
+
+        found = {}
+        for term in self.prefix(kind, text, limit):
+            for study_id, plots in self.postings[kind][term].items():
+                found[study_id] = found.get(study_id, 0) + plots
+
+        return found
+
+    def to_json(self):
+        return json.dumps({'studies': self.studies}, sort_keys=True)
+
+    def save(self, store_dir):
+        _write_atomic(os.path.join(store_dir, INDEX_FILE), self.to_json())
+
+####################################################################################
+def load_index(store_dir):
+    """Index saved in the store, empty if there is none yet"""
+
+    index = StudyIndex()
+    path  = os.path.join(store_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            for study_id, entry in json.load(f)['studies'].items():
+                index._insert(study_id, entry)
+
+    return index
+
+####################################################################################
+def build_index(store_dir):
+    """Index every study cached in the store (see grassroots_sync) and save it"""
+
+    index  = StudyIndex()
+    folder = os.path.join(store_dir, 'studies')
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if name.endswith('.json'):
+            study_id = name[:-len('.json')]
+            index.add_study(study_id, load_cached_study(store_dir, study_id))
+    index.save(store_dir)
+
+    return index
+
+####################################################################################
+def index_hook(index, store_dir):
+    """sync_catalogue hook keeping the index up to date with the store
+
+    The index is updated in memory for every study and saved once, when
+    sync_catalogue flushes its hooks at the end of the sync.
+
+        sync_catalogue(store_dir, hooks=[index_hook(index, store_dir)])
+    """
+
+    def hook(study_id, json_study):
+        if json_study is None:      # study removed from the catalogue
+            index.remove_study(study_id)
+        else:
+            index.add_study(study_id, json_study)
+
+    hook.flush = lambda: index.save(store_dir)
+
+    return hook
+
+####################################################################################
+def term_options(index, kind, text, limit=50):
+    """Options of a Dash dropdown listing the terms starting with text"""
+
+    options = []
+    for term in index.prefix(kind, text, limit):
+        options.append({'label': term + ' (' + str(len(index.postings[kind][term])) + ' studies)', 'value': term})
+
+    return options
+
+####################################################################################
+def study_options(index, kind, text, limit=50):
+    """Options of the study dropdown restricted to studies with a term starting with text
+
+    Studies with the most matching plots come first.
+    """
+
+    found   = index.search(kind, text, limit)
+    options = []
+    for study_id in sorted(found, key=lambda s: -found[s]):
+        name = index.studies[study_id]['name'] or study_id
+        options.append({'label': name + ' (' + str(found[study_id]) + ' plots)', 'value': study_id})
+
+    return options
+
+####################################################################################
+def register_search_dropdown(app, index, search_id, dropdown_id, all_options, kind='phenotype'):
+    """Restrict a study dropdown to the studies matching the text of a search box
+
+    The text of the dcc.Input search_id is looked up in the index (study_options)
+    and becomes the options of the dcc.Dropdown dropdown_id; an empty search box
+    brings back all_options. The search box is separate from the dropdown because
+    the dropdown filters its options by label, and study labels do not contain
+    phenotype, trait or accession names.
+
+    Args:
+        search_id  : dcc.Input with the searched term
+        dropdown_id: dcc.Dropdown of study ids
+        all_options: options of the dropdown when nothing is searched
+        kind       : 'phenotype', 'trait' or 'accession'
+    """
+
+    from dash import Input, Output
+
+    @app.callback(Output(dropdown_id, 'options'), Input(search_id, 'value'))
+    def update_options(text):
+        if not text:
+            return all_options
+        return study_options(index, kind, text)
+
+    return update_options
+
+####################################################################################
+def compare_accessions_in_store(store_dir, index, trait):
+    """compare_accessions over the cached studies with the trait, found through the index
+
+    Args:
+        trait: phenotype variable or so:sameAs trait term
+    """
+
+    study_ids = set(index.lookup('phenotype', trait)) | set(index.lookup('trait', trait))
+
+    return compare_accessions((load_cached_study(store_dir, study_id) for study_id in sorted(study_ids)), trait)
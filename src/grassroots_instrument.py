@@ -0,0 +1,200 @@
+import json
+import time
+import logging
+import tracemalloc
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('grassroots.instrument')
+
+# recorder of the current context, None when instrumentation is off (the default)
+_recorder = contextvars.ContextVar('grassroots_recorder', default=None)
+
+# records of the last instrument() block run in the current thread/task (default of summary)
+_last_records = contextvars.ContextVar('grassroots_last_records', default=None)
+
+RECENT_BLOCKS  = 20
+recent_records = deque(maxlen=RECENT_BLOCKS)   # records of the last blocks of every thread, for the Dash summary
+
+# Python 3.8 has no reset_peak: peaks are then measured from the start of tracing (upper bounds)
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+####################################################################################
+class Recorder:
+    """Records of the stages run inside an instrument() block"""
+
+    def __init__(self, log, memory):
+        self.log     = log
+        self.memory  = memory
+        self.records = []
+        self.stack   = []
+
+####################################################################################
+@contextmanager
+def instrument(log=True, memory=True):
+    """Turn on stage instrumentation for the code run inside the block
+
+    Every stage (get_plot, JSON decoding, dict_phenotypes, create_matrices,
+    oddShape*, hover text, figure construction, cache lookups) records its
+    wall time, peak allocations (tracemalloc, approximate for nested stages)
+    and counters such as bytes transferred or cache hits/misses.
+
+        with instrument() as recorder:
+            plotly_heatmap(json_study, "Greens", phenotype)
+        print_summary(recorder.records)
+
+    Args:
+        log   : also emit every record as JSON on the 'grassroots.instrument' logger
+        memory: track peak allocations (tracemalloc slows allocations down)
+    """
+
+    recorder = Recorder(log, memory)
+    started  = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+        if started:
+            tracemalloc.stop()
+        _last_records.set(recorder.records)
+        recent_records.append(recorder.records)
+
+####################################################################################
+@contextmanager
+def stage(name):
+    """Time a pipeline stage, no-op when instrumentation is off"""
+
+    recorder = _recorder.get()
+    if recorder is None:
+        yield None
+        return
+
+    frame = {'stage': name, 'depth': len(recorder.stack), 'counters': {}, 'peak': 0}
+    if recorder.memory:
+        current, peak = tracemalloc.get_traced_memory()
+        for parent in recorder.stack:
+            parent['peak'] = max(parent['peak'], peak - parent['start'])
+        if _reset_peak is not None:
+            _reset_peak()
+        frame['start'] = current
+
+    recorder.stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield frame['counters']
+    finally:
+        elapsed = time.perf_counter() - start
+        recorder.stack.pop()
+
+        record = {'stage': name, 'depth': frame['depth'], 'seconds': elapsed}
+        if recorder.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record['peak_bytes'] = max(frame['peak'], peak - frame['start'])
+            for parent in recorder.stack:
+                parent['peak'] = max(parent['peak'], peak - parent['start'])
+        record.update(frame['counters'])
+
+        recorder.records.append(record)
+        if recorder.log:
+            logger.info(json.dumps(record))
+
+####################################################################################
+def count(**counters):
+    """Add counters (bytes=..., cache_hit=1, ...) to the innermost running stage"""
+
+    recorder = _recorder.get()
+    if recorder is None or len(recorder.stack) == 0:
+        return
+
+    current = recorder.stack[-1]['counters']
+    for key, value in counters.items():
+        current[key] = current.get(key, 0) + value
+
+####################################################################################
+def timed(name):
+    """Decorator running a function as a stage; direct call when instrumentation is off"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder.get() is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+####################################################################################
+def summary(records=None):
+    """Aggregate records by stage
+
+    Args:
+        records: records to aggregate, default those of the last instrument()
+                 block of the current thread (or asyncio task)
+
+    Returns:
+        list: one dictionary per stage (calls, total/mean/max seconds, max peak
+              bytes and summed counters), slowest stage first
+    """
+
+    if records is None:
+        records = _last_records.get() or []
+
+    stages = {}
+    for record in records:
+        row = stages.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'total_seconds': 0.0,
+                                                  'max_seconds': 0.0, 'peak_bytes': 0})
+        row['calls']         += 1
+        row['total_seconds'] += record['seconds']
+        row['max_seconds']    = max(row['max_seconds'], record['seconds'])
+        row['peak_bytes']     = max(row['peak_bytes'], record.get('peak_bytes', 0))
+        for key, value in record.items():
+            if key not in ('stage', 'depth', 'seconds', 'peak_bytes'):
+                row[key] = row.get(key, 0) + value
+
+    rows = sorted(stages.values(), key=lambda row: -row['total_seconds'])
+    for row in rows:
+        row['mean_seconds'] = row['total_seconds'] / row['calls']
+
+    return rows
+
+####################################################################################
+def print_summary(records=None):
+    # for Jupyter notebook
+
+    for row in summary(records):
+        counters = {k: v for k, v in row.items() if k not in ('stage', 'calls', 'total_seconds', 'max_seconds', 'mean_seconds', 'peak_bytes')}
+        print(f"{row['stage']:<20} calls: {row['calls']:<5} total: {1000*row['total_seconds']:9.2f} ms  "
+              f"mean: {1000*row['mean_seconds']:8.2f} ms  peak: {row['peak_bytes']/1024:9.1f} KB  {counters if counters else ''}")
+
+####################################################################################
+def summary_table(records=None):
+    """Columns and data of the summary for a dash_table.DataTable"""
+
+    rows    = summary(records)
+    keys    = []
+    for row in rows:
+        for key in row:
+            if key not in keys:
+                keys.append(key)
+    columns = [{'name': key, 'id': key} for key in keys]
+
+    return columns, rows
+
+####################################################################################
+def register_summary_route(app, route='/instrumentation'):
+    """Expose the summary of the last RECENT_BLOCKS instrument() blocks (any thread) as JSON on the Dash server"""
+
+    @app.server.route(route)
+    def instrumentation_summary():
+        records = [record for block in list(recent_records) for record in block]
+        return app.server.response_class(json.dumps(summary(records)), mimetype='application/json')
+
+    return instrumentation_summary
@@ -0,0 +1,156 @@
+import numpy as np
+
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+MAX_CELLS = 10000   # cells sent to the browser per view, whatever the size of the field
+
+####################################################################################
+def lod_factor(rows, columns, max_cells=MAX_CELLS):
+    """Smallest block size such that the downsampled grid has at most max_cells cells"""
+
+    factor = 1
+    while int(np.ceil(rows / factor)) * int(np.ceil(columns / factor)) > max_cells:
+        factor += 1
+
+    return factor
+
+####################################################################################
+def downsample_grid(grid, factor):
+    """Mean of the measured plots of every factor x factor block of a value grid
+
+    Blocks without any measured plot are NaN.
+
+    Returns:
+        means : float array (ceil(rows/factor), ceil(columns/factor))
+        counts: number of measured plots of every block
+    """
+
+    rows, columns = grid.shape
+    R = int(np.ceil(rows    / factor))
+    C = int(np.ceil(columns / factor))
+
+    padded = np.full((R * factor, C * factor), np.nan)
+    padded[:rows, :columns] = grid
+
+    measured = np.isfinite(padded)
+    values   = np.where(measured, padded, 0.0).reshape(R, factor, C, factor)
+    counts   = measured.reshape(R, factor, C, factor).sum(axis=(1, 3))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = values.sum(axis=(1, 3)) / counts
+
+    return means, counts
+
+####################################################################################
+def lod_trace(grid, accession, plot_ids, x_range=None, y_range=None, max_cells=MAX_CELLS):
+    """Heatmap trace of the visible part of a grid, never more than max_cells cells
+
+    The visible region (axes in plot numbers, 1-based) is sent at full
+    resolution with hover data when it fits in max_cells, otherwise as an
+    aggregate of blocks without per-plot hover data.
+
+    Args:
+        grid     : value grid (rows, columns) with NaN/inf sentinels
+        accession: accession names grid (rows, columns)
+        plot_ids : plot ID grid (rows, columns)
+        x_range  : visible (first, last) column number, default all
+        y_range  : visible (first, last) row number, default all
+                   (parts of the view outside the field are ignored)
+
+    Returns:
+        plotly Heatmap trace
+    """
+
+    rows, columns = grid.shape
+    if x_range is None:
+        x_range = (1, columns)
+    if y_range is None:
+        y_range = (1, rows)
+
+    # axes are in plot numbers (1-based), slice bounds are 0-based and kept inside the field
+    x0 = int(np.clip(np.floor(min(x_range)) - 1, 0, columns))
+    y0 = int(np.clip(np.floor(min(y_range)) - 1, 0, rows))
+    x1 = int(np.clip(np.ceil(max(x_range)), 0, columns))
+    y1 = int(np.clip(np.ceil(max(y_range)), 0, rows))
+
+    if x1 <= x0 or y1 <= y0:          # view entirely outside the field
+        return go.Heatmap(z=[], coloraxis='coloraxis', hoverinfo='skip')
+
+    window = grid[y0:y1, x0:x1]
+    factor = lod_factor(*window.shape, max_cells=max_cells)
+
+    if factor == 1:
+        finite = np.isfinite(window)
+        values = np.where(finite, window, np.nan)
+        status = np.where(np.isinf(window), 'N/A', np.where(np.isnan(window), 'Discarded', ''))
+        customdata = np.moveaxis([accession[y0:y1, x0:x1], plot_ids[y0:y1, x0:x1], status], 0, -1)
+        return go.Heatmap(z=values, x0=x0 + 1, dx=1, y0=y0 + 1, dy=1, customdata=customdata, coloraxis='coloraxis',
+                          hovertemplate="Accession: %{customdata[0]}<br>Value: %{z} %{customdata[2]}<br>Plot ID: %{customdata[1]}"
+                                        " (column: %{x}, row: %{y})<extra></extra>")
+
+    means, counts = downsample_grid(window, factor)
+    return go.Heatmap(z=means, x0=x0 + 1 + (factor - 1) / 2, dx=factor, y0=y0 + 1 + (factor - 1) / 2, dy=factor,
+                      customdata=counts, coloraxis='coloraxis',
+                      hovertemplate="Mean: %{z}<br>Measured plots: %{customdata}"
+                                    " (block of " + str(factor) + "x" + str(factor) + " plots)<extra></extra>")
+
+####################################################################################
+def lod_figure(grid, accession, plot_ids, title, unit, colormap="Greens", max_cells=MAX_CELLS, color_range=None):
+    """Level of detail heatmap: aggregated overview of the whole field
+
+    Use lod_update on zoom (Dash relayoutData) to swap in full resolution tiles
+    of the visible region. Axes are in plot numbers, row 1 at the bottom as plotly_plot.
+    color_range: optional (min, max) of the color scale, default the range of the grid
+    """
+
+    rows, columns = grid.shape
+    finite = grid[np.isfinite(grid)]
+    if color_range is None:
+        color_range = (finite.min(), finite.max()) if len(finite) else (None, None)
+
+    fig = go.Figure(lod_trace(grid, accession, plot_ids, max_cells=max_cells))
+    fig.update_layout(coloraxis=dict(colorscale=getattr(px.colors.sequential, colormap),
+                                     cmin=color_range[0],
+                                     cmax=color_range[1],
+                                     colorbar=dict(title='Units: ' + unit)),
+                      height=600, plot_bgcolor='black', uirevision='lod',   # keep user zoom on updates
+                      font=dict(family="Courier New, monospace", size=12, color="Black"),
+                      title={'text': title, 'y': 0.98, 'x': 0.5, 'xanchor': 'center', 'yanchor': 'top'})
+    fig.update_xaxes(title='columns', range=[0.5, columns + 0.5], showgrid=False, zeroline=False)
+    fig.update_yaxes(title='rows',    range=[0.5, rows    + 0.5], showgrid=False, zeroline=False)
+
+    return fig
+
+####################################################################################
+def lod_update(figure, relayout_data, grid, accession, plot_ids, max_cells=MAX_CELLS):
+    """Replace the heatmap of a lod_figure with the visible region after a zoom
+
+    Args:
+        figure       : current figure (dict from dcc.Graph or go.Figure)
+        relayout_data: relayoutData of the Dash graph
+
+    Returns:
+        go.Figure with the new trace, axes ranges kept as zoomed by the user
+    """
+
+    fig = go.Figure(figure)
+    relayout_data = relayout_data or {}
+
+    if relayout_data.get('xaxis.autorange') or relayout_data.get('autosize'):
+        x_range = y_range = None
+    else:
+        x_range = (relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']) if 'xaxis.range[0]' in relayout_data else None
+        y_range = (relayout_data['yaxis.range[0]'], relayout_data['yaxis.range[1]']) if 'yaxis.range[0]' in relayout_data else None
+        if x_range is None and fig.layout.xaxis.range is not None:
+            x_range = tuple(fig.layout.xaxis.range)
+        if y_range is None and fig.layout.yaxis.range is not None:
+            y_range = tuple(fig.layout.yaxis.range)
+        fig.update_xaxes(range=x_range)
+        fig.update_yaxes(range=y_range)
+
+    fig.data = []
+    fig.add_trace(lod_trace(grid, accession, plot_ids, x_range, y_range, max_cells))
+
+    return fig
@@ -0,0 +1,177 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from src.grassroots_grids import study_tensor
+from src.grassroots_sync  import study_path
+
+
+SHARED_ARRAYS = ('values', 'status', 'accession_codes', 'plot_index', 'row_index', 'column_index')
+
+####################################################################################
+def tensor_path(store_dir, study_id):
+    return os.path.join(store_dir, 'tensors', study_id + '.npz')
+
+####################################################################################
+def _build_worker(path, dtype=np.float64):
+    """Process pool task: sparse tensor of every phenotype of a stored study, returned through shared memory
+
+    Only the segment name, the array layout and the short name lists are
+    pickled back to the parent; the arrays themselves are copied once into
+    a shared memory segment that the parent unlinks after use.
+    """
+
+    with open(path) as f:
+        tensor = study_tensor(f.read(), dtype=dtype, sparse=True)     # one entry per plot, no bounding box
+
+    layout = []
+    offset = 0
+    for key in SHARED_ARRAYS:
+        array = tensor[key]
+        layout.append((key, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // 8) * 8      # keep every array 8 byte aligned
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for key, dtype, shape, start in layout:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view[...] = tensor[key]
+        del view
+    name = shm.name
+    shm.close()
+    resource_tracker.unregister(shm._name, 'shared_memory')   # the parent owns and unlinks the segment
+
+    return {'shm'       : name,
+            'layout'    : layout,
+            'phenotypes': tensor['phenotypes'],
+            'accessions': tensor['accessions'],
+            'rows'      : tensor['rows'],
+            'columns'   : tensor['columns']}
+
+####################################################################################
+def _attach(result):
+    """Numpy views on the shared memory segment of a worker result"""
+
+    shm    = shared_memory.SharedMemory(name=result['shm'])
+    grids  = {key: result[key] for key in ('phenotypes', 'accessions', 'rows', 'columns')}
+    for key, dtype, shape, start in result['layout']:
+        grids[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+
+    return shm, grids
+
+####################################################################################
+def _release(shm, grids):
+
+    for key in SHARED_ARRAYS:
+        grids.pop(key, None)     # views must go before the segment is closed
+    shm.close()
+    shm.unlink()
+
+####################################################################################
+def save_tensor(store_dir, study_id, grids):
+    """Default consumer of build_catalogue: save the grids of a study in the store"""
+
+    path = tensor_path(store_dir, study_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, values=grids['values'], status=grids['status'], accession_codes=grids['accession_codes'],
+                        plot_index=grids['plot_index'], row_index=grids['row_index'], column_index=grids['column_index'],
+                        shape=np.array([grids['rows'], grids['columns']]), phenotypes=np.array(grids['phenotypes'], dtype=str),
+                        accessions=np.array(grids['accessions'], dtype=str))
+
+####################################################################################
+def build_catalogue(store_dir, study_ids=None, consume=None, workers=None, max_in_flight=None, dtype=np.float64):
+    """Build the grids of many stored studies on every core
+
+    Studies are farmed out to a process pool; each worker reads the study
+    payload from the store itself and returns its values and codes, one
+    entry per plot (study_tensor with sparse=True, dense_tensor gives the
+    grids), through shared memory. At most max_in_flight studies are
+    submitted or waiting to be consumed at any time, so memory stays bounded
+    whatever the size of the catalogue.
+
+    Args:
+        store_dir    : directory of the local store (see grassroots_sync)
+        study_ids    : studies to build, default every stored study
+        consume      : callable consume(study_id, grids) run in this process for
+                       every built study; arrays of grids are views on shared
+                       memory, only valid during the call (copy to keep them).
+                       Default save_tensor into the store.
+        workers      : number of processes, default os.cpu_count()
+        max_in_flight: bound on pending studies, default 2 * workers
+        dtype        : float type of the value grids (np.float32 halves memory and copies)
+
+    Returns:
+        dictionary: ids of built studies and (id, error) of failed ones
+    """
+
+    if study_ids is None:
+        folder    = os.path.join(store_dir, 'studies')
+        study_ids = sorted(name[:-len('.json')] for name in os.listdir(folder) if name.endswith('.json'))
+    if consume is None:
+        consume = lambda study_id, grids: save_tensor(store_dir, study_id, grids)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    summary = {'built': [], 'failed': []}
+    pending = {}
+    queue   = iter(study_ids)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def refill():
+            for study_id in queue:
+                pending[pool.submit(_build_worker, study_path(store_dir, study_id), dtype)] = study_id
+                if len(pending) >= max_in_flight:
+                    break
+
+        try:
+            refill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    study_id = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        summary['failed'].append((study_id, repr(error)))
+                        continue
+
+                    shm, grids = _attach(result)
+                    try:
+                        consume(study_id, grids)
+                        summary['built'].append(study_id)
+                    except Exception as error:
+                        summary['failed'].append((study_id, repr(error)))
+                    finally:
+                        _release(shm, grids)
+                refill()
+        finally:
+            # interrupted: free the segments of studies already built
+            for future in pending:
+                future.cancel()
+            for future in list(pending):
+                if not future.cancelled() and future.exception() is None:
+                    _release(*_attach(future.result()))
+
+    return summary
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the grids of every stored study on all cores')
+    parser.add_argument('store_dir', help='directory of the local store')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--float32', action='store_true', help='build value grids as float32')
+    args = parser.parse_args()
+
+    summary = build_catalogue(args.store_dir, workers=args.workers, dtype=np.float32 if args.float32 else np.float64)
+    print("Built studies: ", len(summary['built']))
+    for study_id, error in summary['failed']:
+        print("Failed:", study_id, error)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import json
 
 import numpy as np
-from functools import reduce
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -11,6 +10,15 @@ import base64
 import os
 
 import plotly.express as px
+import plotly.graph_objects as go
+
+from src.grassroots_grids import observation_layers, difference_layer, phenotype_frames, treatment_codes, LAYERS
+from src.grassroots_stats import trait_summary, trait_correlations, plotly_correlation_heatmap, treatment_summary
+from src.grassroots_spatial import process_grid, study_outliers, add_outlier_overlay
+from src.grassroots_instrument import stage, timed
+from src.grassroots_engine import (lookup_keys, searchPhenotypeTrait, searchPhenotypeUnit, search_phenotype,
+                                  search_phenotype_index, dict_phenotypes, build_grid, study_grid, oddShapeValues,
+                                  oddShapeAccession, oddShapePlotID, value_strings, render_prep, hover_grids)
 
 
 ####################################################################################
@@ -131,102 +139,15 @@ def dict_units(pheno, plots):
     return phenoDict  
 
 
-###################################################################
-def lookup_keys(dictionary, keys, default=None):
-     return reduce(lambda d, key: d.get(key, default) if isinstance(d, dict) else default, keys.split("."), dictionary)
-
-###################################################################
-def searchPhenotypeTrait(listPheno, value):
-
-    name = listPheno[value]['definition']['trait']['so:name']
-
-    return name
-
-###################################################################
-def searchPhenotypeUnit(listPheno, value):
-
-    name = listPheno[value]['definition']['unit']['so:name']
-
-    return name
-
-
-###################################################################
-def search_phenotype(list_observations, value):
-
-    found = False
-    for i in range(len(list_observations)):
-
-        dic            = list_observations[i]
-        phenotype_name = lookup_keys(dic, 'phenotype.variable')
-        if  (phenotype_name == value ):
-              return True
-              break
-
-    return found
-
-############################################################################
-def search_phenotype_index(list_observations, value):
-
-    for i in range(len(list_observations)):
-
-        dic            = list_observations[i]
-        phenotype_name = lookup_keys(dic, 'phenotype.variable')
-        if  (phenotype_name == value ):
-              return i
-
-
-####################################################################
-def dict_phenotypes(pheno, plots):
-    """Extract traits of phenotypes 
-
-    Args:
-        pheno: list of phenotypes of a particular study 
-        plots     : plots data of a particular study
-
-    Returns:
-        dictionary: keys: phenotypes names, values: traits
-    """
-
-    names = []
-    traits = []
-    for key in pheno:
-        #print("-->", key)
-         
-
-        names.append(key)
-        traits.append(pheno[key]['definition']['trait']['so:name'])
-
-    phenoDict = dict(zip(names, traits))
-
-    for j in range(len(plots)):
-        if ( 'discard' in plots[j]['rows'][0] ):
-            pass
-        if ('observations' in plots[j]['rows'][0]):
-            for k in range(len(plots[j]['rows'][0]['observations'])):
-                if ('raw_value' in plots[j]['rows'][0]['observations'][k]):
-                    rawValue = plots[j]['rows'][0]['observations'][k]['raw_value']
-                if ('corrected_value' in plots[j]['rows'][0]['observations'][k]):
-                    rawValue = plots[j]['rows'][0]['observations'][k]['corrected_value']
-                if ( type(rawValue) == str):
-                    name = plots[j]['rows'][0]['observations'][k]['phenotype']['variable']
-                    if( name in phenoDict.keys() ):
-                        # print("Remove:", phenoDict[name])
-                        del phenoDict[name]
-    
-    return phenoDict   
-
-
 ######################################################################
 # for Jupyter notebook. Simplify presentation of code.
 def print_plot_data(json_study, phenotype_selected):
 
     single_study  = json.loads(json_study)
-    plots_arrays  = matrices(single_study, phenotype_selected)
+    grid          = study_grid(single_study, phenotype_selected).dense()
     #np.flipud
-    values =  plots_arrays[2]
-    data   = values.reshape(plots_arrays[0], plots_arrays[1])
-    print( plots_arrays[3])
-    print(np.flipud(data))
+    print( grid.trait)
+    print(np.flipud(grid.grid()))
 
 ######################################################################
 # for Jupyter notebook. Simplify presentation of code.
@@ -239,11 +160,18 @@ def print_phenotype_traits(json_study):
     plots      = single_study['results'][0]['results'][0]['data']['plots']
     traits = dict_phenotypes(phenotypes, plots)
     units = dict_units(phenotypes, plots)
-    
+    summary = trait_summary(single_study)       # statistics of all phenotypes in one pass
+    index   = {name: k for k, name in enumerate(summary['phenotypes'])}
     
     i=1
     for item in traits:
         print(f'{i}) {item}:  ({traits[item]})   Units: {units[item]} ')
+        if item in index:
+            k = index[item]
+            q = summary['quantiles'][k]
+            print(f'     min: {summary["min"][k]:g}  q25: {q[0]:g}  median: {q[1]:g}  q75: {q[2]:g}  '
+                  f'max: {summary["max"][k]:g}  mean: {summary["mean"][k]:g}  '
+                  f'N/A: {summary["na"][k]}  discarded: {summary["discarded"][k]}  blank: {summary["blank"][k]}')
         i=i+1
     
     study = single_study['results'][0]['results'][0]['data']['so:name']
@@ -254,314 +182,153 @@ def print_phenotype_traits(json_study):
 
 ##############--------------------------------##########################
 #### new plotly function. Reduce lines of code for jupyter notebook###
-def plotly_heatmap(json_study, colormap, phenotype_selected):
-    single_study = json.loads(json_study) # "Deserialising" data 
+# mode: 'raw' or smoothing/detrending of the grid ('mean', 'gaussian', 'median', 'detrend')
+# outliers: mark plots flagged by study_outliers
+# layer: 'value' (corrected if available, else raw), 'raw', 'corrected' or 'difference' (corrected - raw)
+# color_range: optional (min, max) of the color scale, e.g. grassroots_sketch.color_range for a catalogue-wide scale
+def plotly_heatmap(json_study, colormap, phenotype_selected, mode='raw', outliers=False, layer='value', dtype=np.float64, color_range=None):
+    if layer not in LAYERS:
+        raise ValueError("layer must be one of " + ", ".join(repr(name) for name in LAYERS))
+
+    with stage('json_decode'):
+        single_study = json.loads(json_study) # "Deserialising" data 
 
     phenotypes         = single_study['results'][0]['results'][0]['data']['phenotypes']
     #phenotype_selected = list(phenotypes.keys())[index]
-    arrays             = matrices(single_study, phenotype_selected)
-
-    rows       = arrays[0] 
-    columns    = arrays[1]
-    raw_values = arrays[2]
-    title      = arrays[3]
-    units      = arrays[4]
-    accession  = arrays[5]
+    grid               = study_grid(single_study, phenotype_selected, dtype).dense()   # odd shapes densified to plot
+
+    rows       = grid.rows
+    columns    = grid.columns
+    raw_values = grid.values
+    title      = grid.trait
+    units      = grid.unit
+    accession  = grid.accession
+    raw_layer  = grid.raw_layer
+    cor_layer  = grid.cor_layer
+    status     = grid.status if layer == 'value' and mode == 'raw' else None   # other views move the sentinels
+
+    if layer == 'raw':
+        raw_values = raw_layer.copy()
+    elif layer == 'corrected':
+        raw_values = cor_layer.copy()
+    elif layer == 'difference':
+        raw_values = difference_layer(raw_layer, cor_layer)
+    if layer != 'value':
+        title = title + ' [' + layer + ']'
+
+    if mode != 'raw':
+        raw_values = process_grid(raw_values.reshape(rows,columns), mode).flatten()
+        title      = title + ' (' + mode + ')'
+
+    flagged = None
+    if outliers:
+        flagged = study_outliers(single_study, phenotype_selected)
 
     accession   = accession.reshape(rows,columns)
-    plotly_plot(raw_values, accession, title, units, colormap)
+    plotly_plot(raw_values, accession, title, units, colormap, flagged, (raw_layer, cor_layer), status, color_range)
+
+##############--------------------------------##########################
+#### animated heatmap of a phenotype measured on several dates
+def animated_heatmap(json_study, colormap, phenotype_selected):
+    with stage('json_decode'):
+        single_study = json.loads(json_study) # "Deserialising" data 
+
+    phenotypes = single_study['results'][0]['results'][0]['data']['phenotypes']
+    plots      = single_study['results'][0]['results'][0]['data']['plots']
+    title      = searchPhenotypeTrait(phenotypes, phenotype_selected)
+    units      = searchPhenotypeUnit( phenotypes, phenotype_selected)
+
+    frames = phenotype_frames(single_study, phenotype_selected)
+    fig    = plotly_frames_plot(frames, plots, title, units, colormap)
+    fig.show()
+
+##############--------------------------------##########################
+#### one heatmap per treatment combination plus statistics of each treatment
+def treatment_heatmap(json_study, colormap, phenotype_selected):
+    with stage('json_decode'):
+        single_study = json.loads(json_study) # "Deserialising" data 
+
+    plots  = single_study['results'][0]['results'][0]['data']['plots']
+    study  = study_grid(single_study, phenotype_selected).dense()
+
+    rows    = study.rows
+    columns = study.columns
+    grid    = study.grid()
+    title   = study.trait
+    units   = study.unit
+
+    codes, labels = treatment_codes(plots, rows, columns)
+    if len(labels) == 0:             # study without treatments: a single panel of every plot
+        codes  = np.zeros((rows, columns), dtype=np.int32)
+        labels = ['No treatment']
+    summary       = treatment_summary(grid, codes, labels)
+
+    for k in range(len(labels)):
+        print(f'{labels[k]}:  count: {summary["count"][k]}  mean: {summary["mean"][k]:g}  '
+              f'median: {summary["median"][k]:g}  std: {summary["std"][k]:g}')
+
+    fig = plotly_treatment_facets(grid, codes, labels, title, units, colormap)
+    fig.show()
+
+##############--------------------------------##########################
+#### correlation between all the phenotypes of a study (pearson or spearman)
+def correlation_heatmap(json_study, method='pearson'):
+    with stage('json_decode'):
+        single_study = json.loads(json_study) # "Deserialising" data 
+
+    correlations = trait_correlations(single_study, method)
+    study        = single_study['results'][0]['results'][0]['data']['so:name']
+
+    fig = plotly_correlation_heatmap(correlations, study + ' (' + method + ')')
+    fig.show()
 
 ##############--------------------------------##########################
 #### new seaborn function. Reduce lines of code for jupyter notebook###
-def seaborn_heatmap(json_study, colormap, phenotype_selected):
+def seaborn_heatmap(json_study, colormap, phenotype_selected, mode='raw', dtype=np.float64, color_range=None):
 
-    single_study = json.loads(json_study) # "Deserialising" data 
+    with stage('json_decode'):
+        single_study = json.loads(json_study) # "Deserialising" data 
 
     phenotypes         = single_study['results'][0]['results'][0]['data']['phenotypes']
     #phenotype_selected = list(phenotypes.keys())[index]
-    arrays             = matrices(single_study, phenotype_selected)
+    grid               = study_grid(single_study, phenotype_selected, dtype).dense()
 
-    rows       = arrays[0] 
-    columns    = arrays[1]
-    raw_values = arrays[2]
-    title      = arrays[3]
-    units      = arrays[4]
+    title      = grid.trait
+    units      = grid.unit
+    status     = grid.status
 
-    matrix   = raw_values.reshape(rows,columns)
-    seaborn_plot(matrix, title, units, phenotype_selected, colormap)
+    matrix   = grid.grid()
+    if mode != 'raw':
+        matrix = process_grid(matrix, mode)
+        title  = title + ' (' + mode + ')'
+        status = None
+
+    seaborn_plot(matrix, title, units, phenotype_selected, colormap, status, color_range)
 
 ##############--------------------------------##########################
-########### reduce lines of code for Jupyer notebook  ###########
-def matrices(single_study, selected):
+########### legacy positional view, new code uses study_grid attributes  ###########
+def matrices(single_study, selected, dtype=np.float64):
     plots      = single_study['results'][0]['results'][0]['data']['plots']
     phenotypes = single_study['results'][0]['results'][0]['data']['phenotypes']
-    total_rows = single_study['results'][0]['results'][0]['data']['num_rows']
-    total_cols = single_study['results'][0]['results'][0]['data']['num_columns']
+    total_rows = single_study['results'][0]['results'][0]['data'].get('num_rows')
+    total_cols = single_study['results'][0]['results'][0]['data'].get('num_columns')
     traits     = dict_phenotypes(phenotypes, plots)
 
-    matrices  = create_matrices(plots, phenotypes, selected, total_rows, total_cols)
+    matrices  = create_matrices(plots, phenotypes, selected, total_rows, total_cols, dtype)
     return matrices
 
 ####################################################################
-def create_matrices(json, pheno, current_name, total_rows, total_columns):
-    """create numpy matrices for plotting
-
-    Args:
-        json     : Plots data of a particular study
-        pheno    : Phenotypes of particular study
-        name     : Name of current study
+def create_matrices(json, pheno, current_name, total_rows, total_columns, dtype=np.float64):
+    """create numpy matrices for plotting (legacy dense positional view of build_grid, see StudyGrid)
 
     Returns:
-        matrices: matrix with numpy matrices...
+        list: rows, columns, values, trait, unit, accession, plot IDs, raw layer, corrected layer, status
     """
 
+    grid = build_grid(json, pheno, current_name, total_rows, total_columns, dtype).dense()   # odd shapes densified here, to plot
 
-    traitName = searchPhenotypeTrait(pheno, current_name)
-    unit      = searchPhenotypeUnit( pheno, current_name)
-
-    dtID= np.dtype(('U', 4))
-
-    row_raw   = np.array([])
-    matrix    = np.array([])
-    row_acc   = np.array([])
-    accession = np.array([])
-    plotsIds  = np.array([], dtype=dtID)  #format of strings
-
-    matrices = []
-
-    num_columns = 1
-    row    = 1
-    column = 1
-    #loop throght observations in the same fashion as in old JS code. 
-    for j in range(len(json)):
-        if ( int( json[j]['row_index'] ) == row ):
-            if  (int( json[j]['column_index'] ) == column):
-               if column > num_columns:
-                   num_columns = column
-
-               if   ( 'discard' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-               elif ( 'blank' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-      
-               elif ( 'observations' in json[j]['rows'][0] ):
-                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
-                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
-                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                        row_raw  = np.append(row_raw, rawValue) 
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-                    else:
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-               else:
-                    if ( 'rows' in json[j] ):
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-         
-  
-               column+=1
-               columns = json[j]['column_index']#
-
-        elif ( int( json[j]['row_index'] ) > row  ):
-            if column > num_columns:
-                   num_columns = column
-
-            if   ( 'discard' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-            elif   ( 'blank' in json[j]['rows'][0] ):
-                    row_raw  = np.append(row_raw, np.nan )  
-                    row_acc  = np.append(row_acc, np.nan )  
-                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-        
-            elif ( 'observations' in json[j]['rows'][0] ):
-                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
-                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
-                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
-                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                        row_raw  = np.append(row_raw, rawValue) 
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-                    else:
-                        row_raw  = np.append(row_raw, np.inf )
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-            else:
-                    if ( 'rows' in json[j] ):
-                        ##print("rows with no observations------",json[j])
-                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
-                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
-                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
-             
-
-            row+=1
-            column=2
-            columns = json[j]['column_index']
-
-
-    #column = columns # use actual number of columns instead of counter
-    column = num_columns-1
-
-    if column<columns:
-        column=columns
-    
-    #######print("number of plots and shape check", len(json), row, column, row*(column) )
-    if (len(json) != row*column):
-        #print("NOT rectangular")
-        if(total_columns!=None):
-          if(column<total_columns):
-             column=total_columns
-
-        # fit odd shape plot into bigger rectangular plot.
-        row_raw  = oddShapeValues(   json, row, column, current_name)
-        row_acc  = oddShapeAccession(json, row, column, current_name)
-        plotsIds = oddShapePlotID(   json, row, column, current_name)
-
-    matrices.append(row)
-    matrices.append(column)
-    matrices.append(row_raw)
-    #matrices.append(row_acc)
-    matrices.append(traitName)
-    matrices.append(unit)
-    matrices.append(row_acc)
-    matrices.append(plotsIds)
-    
-    return matrices
-
-####################################################################################
-def oddShapeValues(arraysJson, rows, columns, phenotype):
-
-    matrix = np.zeros((rows,columns))
-    matrix[:] = np.nan
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan
-        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-                indexCurrentPhenotype = search_phenotype_index (arraysJson[r]['rows'][0]['observations'], phenotype)
-                if ('raw_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
-                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
-                if ('corrected_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
-                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
-                matrix[i][j] = rawValue
-            else:
-                matrix[i][j] = np.inf
-
-        else:
-            if('rows' in arraysJson[r]):        #rows field exists but it has no observations!
-               i = int( arraysJson[r]['row_index']    )
-               j = int( arraysJson[r]['column_index'] )
-               i=i-1
-               j=j-1
-               matrix[i][j] = np.inf  # consider it N/A instead as default discarded (nan)
-    
-
-    #matrix = np.flipud(matrix)
-    #print(matrix)
-    matrix  = matrix.flatten()
-
-    return matrix
-#######################################################################
-def oddShapeAccession(arraysJson, rows, columns, phenotype):
-
-    dt= np.dtype(('U', 50)) # define string type for of strings (accession names)
-    matrix = np.empty((rows,columns), dtype=dt)
-    matrix[:] = 'Discarded' #  hovering text in empty plots
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan         #discarded plot
-        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = np.nan         #discarded plot
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-         #   if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
-        elif('rows' in arraysJson[r]):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
-
-
-    matrix  = matrix.flatten()
-
-    return matrix
-
-
-#######################################################################
-def oddShapePlotID(arraysJson, rows, columns, phenotype):
-
-    dt= np.dtype(('U', 40))
-    matrix = np.empty((rows,columns), dtype=dt)
-    matrix[:] = 'N/A'
-
-    for r in range(len(arraysJson)):
-        if  ( 'discard' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-
-        elif ( 'observations' in arraysJson[r]['rows'][0] ):
-            i = int( arraysJson[r]['row_index']    )
-            j = int( arraysJson[r]['column_index'] )
-            i=i-1
-            j=j-1
-            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
-                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-            else:
-            #    matrix[i][j] = np.nan    # No values for that phenotype
-                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
-
-
-
-    matrix  = matrix.flatten()
-
-    return matrix
+    return [grid.rows, grid.columns, grid.values, grid.trait, grid.unit,
+            grid.accession, grid.plot_ids, grid.raw_layer, grid.cor_layer, grid.status]
 
 #####################################################################################################
 '''
@@ -569,43 +336,36 @@ test rendering seaborn image
 '''
 #def seaborn_plot(numpy_matrix, title, unit, uuid, name):
 #def seaborn_plot(numpy_matrix, title, unit, name):
-def seaborn_plot(numpy_matrix, title, unit, name, color_map):
+@timed('seaborn_plot')
+def seaborn_plot(numpy_matrix, title, unit, name, color_map, status=None, color_range=None):
 
     sns.set(rc={'figure.figsize':(15.5,5.7)})
 
-    numpy_matrix = np.flipud(numpy_matrix)      # To Match order shown originally in JS code
-    notAvailable = np.zeros_like(numpy_matrix)
-    discarded    =  np.zeros_like(numpy_matrix)
-    indexInf     =  np.where(np.isinf(numpy_matrix))
-    indexDiscard =  np.where(np.isnan(numpy_matrix))
-    notAvailable[indexInf]   = 1
-    discarded[indexDiscard]  = 1
-    NA        = np.where(notAvailable < 1, np.nan, notAvailable)
-    discarded = np.where(   discarded < 1, np.nan, discarded)
+    prep  = render_prep(numpy_matrix, np.shape(numpy_matrix), status)   # masks derived once, input left untouched
     units = 'Units: '+ unit
 
-    numpy_matrix[indexInf] = np.nan # Replace Inf by NaN
-
-    # Reverse Y ticks and start them from 1
-    size  = numpy_matrix.shape
+    # Y ticks start from 1, row 1 drawn at the bottom by inverting the axis
+    size  = prep['values'].shape
     Y     = size[0]
     Yvals = np.arange(0.5, Y+0.5, 1.0)
     Yaxis = np.arange(1,Y+1)
-    Yaxis = np.flip(Yaxis)
 
     X     = size[1]
     Xvals = np.arange(0, X)
     Xaxis = np.arange(1,X+1)
 
-
-    maxVal = np.nanmax(numpy_matrix)
-    minVal = np.nanmin(numpy_matrix)
+    measured = prep['values'][prep['measured']]
+    maxVal   = measured.max() if len(measured) else None
+    minVal   = measured.min() if len(measured) else None
+    if color_range is not None:     # shared scale (grassroots_sketch.color_range) instead of the grid's own
+        minVal, maxVal = color_range
     #print(minVal)
     colormap  = sns.light_palette(color_map, as_cmap=True)
     dark      = sns.dark_palette((260, 75, 60), input="husl")
-    sns.heatmap(NA, linewidth=0.5,cmap=dark, cbar=False )
+    sns.heatmap(prep['not_available'], mask=~prep['not_available'], linewidth=0.5,cmap=dark, cbar=False )
 
-    g = sns.heatmap(numpy_matrix,  vmax=maxVal, vmin=minVal,linewidth=0.5,cmap=colormap, cbar_kws={'label': units}) 
+    g = sns.heatmap(prep['values'], mask=~prep['measured'], vmax=maxVal, vmin=minVal,linewidth=0.5,cmap=colormap, cbar_kws={'label': units}) 
+    g.invert_yaxis()
     ##g.set_facecolor('xkcd:black')
 
     g.patch.set_facecolor('white')
@@ -627,7 +387,9 @@ def seaborn_plot(numpy_matrix, title, unit, name, color_map):
 test rendering plotly interactive heatmap
 '''
 #def plotly_plot(numpy_matrix, accession, title, unit, IDs, treatments):
-def plotly_plot(numpy_matrix, accession, title, unit, colormap):
+# layers: optional (raw, corrected) flat arrays shown together in the hover text
+@timed('plotly_plot')
+def plotly_plot(numpy_matrix, accession, title, unit, colormap, outliers=None, layers=None, status=None, color_range=None):
     #colormap = "Hot"
     ##numpy_matrix = np.flipud(numpy_matrix)      # To Match order shown originally in JS code
     #plotID      = np.flipud(IDs)        
@@ -635,48 +397,8 @@ def plotly_plot(numpy_matrix, accession, title, unit, colormap):
     Y    = size[0]
     X    = size[1]
 
-    indexInf     =  np.where(np.isinf(numpy_matrix))
-    indexDiscard =  np.where(np.isnan(numpy_matrix))
-    
-    numpy_matrix[indexInf] = np.nan # Replace Inf by NaN
-
-    strings     = np.array(["%s" % x for x in numpy_matrix])  #matrix has to be flattened for conversion to strings
-
-    for i in range(len(strings)):   #remove decimal place when floats are integers
-        string1 = strings[i]
-        string_split = string1.split('.')
-        if( len(string_split)==2):
-            if(string_split[1]=='0'):
-                integer = strings[i]
-                integer = integer[:-2]
-                strings[i] = integer
-    
-
-    strings[indexInf]     = 'N/A'    # use array of string for custumising hovering text
-    strings[indexDiscard] = 'N/A'
-
-    accession = accession.flatten()
-    accession[indexDiscard] = 'Discarded'
-    accession = accession.reshape(Y,X)                       
-
-    s_matrix = strings.reshape(Y,X)                  
-    s_matrix = np.flipud(s_matrix)      
-
-    numpy_matrix[indexInf] = np.inf # but back inf (N/A values)
-    numpy_matrix           = numpy_matrix.reshape(Y,X) 
-
-
-    numpy_matrix = np.flipud(numpy_matrix)  # For matching order of JS table
-    accession    = np.flipud(accession)        
-    #plotID       = np.flipud(IDs)        
-
-    # Reverse Y ticks and start them from 1
-    Yvals = np.arange(0,Y)
-    Yaxis = np.arange(1,Y+1)
-    Yaxis = np.flip(Yaxis)
-    
-    Xvals = np.arange(0, X)
-    Xaxis = np.arange(1,X+1)
+    prep                = render_prep(numpy_matrix, (Y,X), status)   # views and masks, inputs left untouched
+    s_matrix, accession = hover_grids(prep, accession)        # 'N/A' values, 'Discarded' accessions
 
     units = 'Units: '+unit
     color = "px.colors.sequential."+colormap
@@ -684,30 +406,126 @@ def plotly_plot(numpy_matrix, accession, title, unit, colormap):
     #CM=eval("px.colors.sequential.Greens")
     CM=eval(color)
     #print(CM)
-    fig = px.imshow(numpy_matrix, aspect="auto",
+    # row 1 at the bottom (as in the JS table) through the axis, not flipped copies
+    fig = px.imshow(prep['values'], x=np.arange(1,X+1), y=np.arange(1,Y+1), origin='lower', aspect="auto",
             labels=dict(x="columns", y="rows", color=units),
             #color_continuous_scale=px.colors.sequential.Hot, height=800 )
-            color_continuous_scale=CM, height=600 )
+            color_continuous_scale=CM, range_color=color_range, height=600 )
     #else:
-    fig.update_traces(
-    #customdata = np.moveaxis([accession, s_matrix, plotID], 0,-1),
-    customdata  = np.moveaxis([accession, s_matrix], 0,-1),
-    hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{customdata[1]}<br> (column: %{x}, row:%{y})<extra></extra>")
+    if layers is not None:
+        raw_strings = value_strings(layers[0].reshape(Y,X))
+        cor_strings = value_strings(layers[1].reshape(Y,X))
+        fig.update_traces(
+        customdata  = np.moveaxis([accession, s_matrix, raw_strings, cor_strings], 0,-1),
+        hovertemplate="Accession: %{customdata[0]}<br>Value: %{customdata[1]}<br>Raw value: %{customdata[2]}<br>Corrected value: %{customdata[3]}<br> (column: %{x}, row:%{y})<extra></extra>")
+    else:
+        fig.update_traces(
+        #customdata = np.moveaxis([accession, s_matrix, plotID], 0,-1),
+        customdata  = np.moveaxis([accession, s_matrix], 0,-1),
+        hovertemplate="Accession: %{customdata[0]}<br>Raw value: %{customdata[1]}<br> (column: %{x}, row:%{y})<extra></extra>")
     fig.update_layout(font=dict(family="Courier New, monospace",size=12,color="Black"),title={
     'text': title,
     'y':0.98,'x':0.5,
     'xanchor': 'center','yanchor': 'top'})
 
-    fig.update_layout( yaxis = dict(tickmode = 'array', tickvals = Yvals, ticktext = Yaxis ) )
-    fig.update_layout( xaxis = dict(tickmode = 'array', tickvals = Xvals, ticktext = Xaxis ) )
-
-
-    fig.update_xaxes(showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
-    fig.update_yaxes(showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
+    fig.update_xaxes(dtick=1, showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
+    fig.update_yaxes(dtick=1, showgrid=True, gridwidth=7, gridcolor='Black', zeroline=False)
     fig['layout'].update(plot_bgcolor='black')
 
+    if outliers is not None:
+        add_outlier_overlay(fig, outliers)
+
     #plot_div = plotlyOffline(fig, output_type='div')
     fig.show()   ## ADDED ONLY FOR DASH TEST
     
     #return fig
 
+
+##############################################################################################
+'''
+animated plotly heatmap, one frame per observation date (frames from phenotype_frames)
+hover data (accession, plot ID) is computed once and shared by every frame,
+frames only carry the values
+'''
+def plotly_frames_plot(frames, plots, title, unit, colormap):
+
+    Y = frames['rows']
+    X = frames['columns']
+
+    # shared hover layer, in field order (row 1 goes at the bottom through the axis)
+    names     = np.array(frames['accessions'] + ['Discarded'], dtype=object)
+    ids       = np.array([str(plot['rows'][0].get('study_index', 'N/A')) if 'rows' in plot else 'N/A' for plot in plots] + ['N/A'], dtype=object)
+    accession = names[frames['accession_codes']]
+    plotID    = ids[frames['plot_index']]
+    customdata = np.moveaxis([accession, plotID], 0, -1)
+
+    stack  = frames['frames']
+    finite = np.isfinite(stack)
+    zmin   = stack[finite].min() if np.any(finite) else None
+    zmax   = stack[finite].max() if np.any(finite) else None
+    z      = np.where(finite, stack, np.nan)      # N/A and discarded both left empty
+
+    labels = [str(date) if date is not None else 'undated' for date in frames['dates']]
+    CM     = getattr(px.colors.sequential, colormap)
+    hover  = "Accession: %{customdata[0]}<br>Value: %{z}<br>Plot ID: %{customdata[1]} (column: %{x}, row:%{y})<extra></extra>"
+
+    fig = go.Figure(
+        data=[go.Heatmap(z=z[0], x=np.arange(1,X+1), y=np.arange(1,Y+1), customdata=customdata, hovertemplate=hover,
+                         colorscale=CM, zmin=zmin, zmax=zmax, colorbar=dict(title='Units: ' + unit))],
+        frames=[go.Frame(data=[go.Heatmap(z=z[k])], traces=[0], name=labels[k]) for k in range(len(labels))])
+
+    steps = [dict(method='animate', label=labels[k],
+                  args=[[labels[k]], dict(mode='immediate', frame=dict(duration=0, redraw=True), transition=dict(duration=0))])
+             for k in range(len(labels))]
+    fig.update_layout(height=600, sliders=[dict(active=0, currentvalue=dict(prefix='Date: '), steps=steps)],
+                      updatemenus=[dict(type='buttons', showactive=False, x=0, y=-0.15, xanchor='left',
+                                        buttons=[dict(label='Play', method='animate',
+                                                      args=[None, dict(frame=dict(duration=800, redraw=True), fromcurrent=True)])])])
+    fig.update_layout(font=dict(family="Courier New, monospace",size=12,color="Black"),title={
+    'text': title,
+    'y':0.98,'x':0.5,
+    'xanchor': 'center','yanchor': 'top'})
+
+    # row 1 at the bottom (as in the JS table and plotly_plot) through the axis, not flipped copies
+    fig.update_layout(yaxis=dict(title='rows', dtick=1, autorange=True), xaxis=dict(title='columns', dtick=1))
+    fig['layout'].update(plot_bgcolor='black')
+
+    return fig
+
+##############################################################################################
+'''
+faceted plotly heatmap, one panel per treatment combination (codes from treatment_codes)
+plots of other treatments are left empty in every panel
+'''
+def plotly_treatment_facets(grid, codes, labels, title, unit, colormap, facet_col_wrap=2):
+
+    if len(labels) == 0:
+        raise ValueError("no treatment to plot, give at least one label (see treatment_heatmap)")
+
+    Y, X = grid.shape
+
+    values = np.where(np.isfinite(grid), grid, np.nan)
+    stack  = np.where(codes[np.newaxis] == np.arange(len(labels))[:, np.newaxis, np.newaxis], values, np.nan)
+
+    # row 1 at the bottom (as in the JS table and plotly_plot) through the axis, not flipped copies
+    CM  = getattr(px.colors.sequential, colormap)
+    fig = px.imshow(stack, x=np.arange(1,X+1), y=np.arange(1,Y+1), origin='lower', facet_col=0,
+            facet_col_wrap=facet_col_wrap, aspect="auto",
+            labels=dict(x="columns", y="rows", color='Units: '+unit),
+            color_continuous_scale=CM, height=400 * int(np.ceil(len(labels) / facet_col_wrap)))
+
+    for annotation in fig.layout.annotations:    # facet titles "facet_col=k" -> treatment label
+        k = int(annotation.text.split('=')[1])
+        annotation.text = labels[k]
+
+    fig.update_traces(hovertemplate="Value: %{z}<br> (column: %{x}, row:%{y})<extra></extra>")
+    fig.update_layout(font=dict(family="Courier New, monospace",size=12,color="Black"),title={
+    'text': title,
+    'y':0.98,'x':0.5,
+    'xanchor': 'center','yanchor': 'top'})
+
+    fig.update_yaxes(dtick=1)
+    fig.update_xaxes(dtick=1)
+    fig.update_layout(plot_bgcolor='black')
+
+    return fig
@@ -0,0 +1,115 @@
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import ListedColormap
+import seaborn as sns
+
+from src.grassroots_engine import render_prep
+from src.grassroots_instrument import timed
+
+
+####################################################################################
+@timed('render_heatmap')
+def render_heatmap(numpy_matrix, title, unit, color_map, status=None, figsize=(15.5, 5.7), dpi=100, fmt='png', color_range=None):
+    """Static image of a field heatmap, safe to call from several threads at once
+
+    Draws the same picture as seaborn_plot (N/A plots in dark, discarded
+    plots hatched, row 1 at the bottom) on its own Figure and Agg canvas:
+    no pyplot figure manager, no sns.set and no rcParams changes, so
+    concurrent calls share no mutable state. The input grid is not modified.
+
+    Args:
+        numpy_matrix: value grid (rows, columns) with NaN/inf sentinels
+        color_map   : matplotlib color of the seaborn light palette
+        status      : optional status grid (build_grid), drives the N/A and discarded masks
+        color_range : optional (min, max) of the color scale, default the range of the grid
+        fmt         : image format of savefig ('png', 'svg', 'pdf', ...)
+
+    Returns:
+        bytes: the encoded image
+    """
+
+    prep   = render_prep(numpy_matrix, np.shape(numpy_matrix), status)
+    values = prep['values']
+    Y, X   = values.shape
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax  = fig.add_subplot()
+
+    ax.set_facecolor('white')
+    ax.patch.set_edgecolor('black')
+    ax.patch.set_hatch('xx')        # discarded and blank plots are left empty
+
+    dark  = ListedColormap(sns.dark_palette((260, 75, 60), input="husl"))
+    light = sns.light_palette(color_map, as_cmap=True)
+
+    not_available = prep['not_available']
+    ax.pcolormesh(np.ma.masked_where(~not_available, not_available.astype(np.uint8)), cmap=dark,
+                  edgecolors='white', linewidth=0.5)
+
+    measured = values[prep['measured']]
+    if color_range is None:
+        color_range = (measured.min(), measured.max()) if len(measured) else (None, None)
+    mesh = ax.pcolormesh(np.ma.masked_where(~prep['measured'], values), cmap=light,
+                         vmin=color_range[0], vmax=color_range[1],
+                         edgecolors='white', linewidth=0.5)
+    fig.colorbar(mesh, ax=ax, label='Units: ' + unit)
+
+    ax.set_xlim(0, X)
+    ax.set_ylim(0, Y)               # row 1 at the bottom, as seaborn_plot
+    ax.set_xticks(np.arange(0.5, X))
+    ax.set_xticklabels(np.arange(1, X + 1), size=10)
+    ax.set_yticks(np.arange(0.5, Y))
+    ax.set_yticklabels(np.arange(1, Y + 1), size=10)
+    ax.set_xlabel("Columns", fontsize=14)
+    ax.set_ylabel("Rows", fontsize=14)
+    ax.set_title(title, fontsize=20)
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format=fmt)
+
+    return buffer.getvalue()
+
+####################################################################################
+def _render_job(job):
+    return render_heatmap(**job)
+
+####################################################################################
+def render_many(jobs, workers=4, processes=False, max_in_flight=None):
+    """Render many heatmaps concurrently with a bounded pool
+
+    At most max_in_flight jobs are queued or running, so memory stays
+    bounded however many jobs are given; images come back in job order.
+
+        jobs   = ({'numpy_matrix': grid, 'title': name, 'unit': unit, 'color_map': 'green'} for ...)
+        images = list(render_many(jobs, workers=8))
+
+    Args:
+        jobs         : iterable of keyword argument dictionaries of render_heatmap
+        workers      : number of threads (or processes)
+        processes    : use a process pool instead of threads (jobs must be picklable)
+        max_in_flight: bound on pending jobs, default 2 * workers
+
+    Yields:
+        bytes: image of every job, in order
+    """
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pending  = deque()
+
+    with Executor(max_workers=workers) as pool:
+        for job in jobs:
+            pending.append(pool.submit(_render_job, job))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
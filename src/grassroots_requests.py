@@ -1,16 +1,182 @@
 import requests
 import json
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+from src.grassroots_instrument import stage, count
 
 
 server_url = "http://localhost:2000/grassroots/public_backend"
 server_url = "https://grassroots.tools/public_backend"
 
+INTERACTIVE = 0     # dashboard and notebook users, served first
+BATCH       = 1     # warm-ups, syncs and other bulk jobs
+
+REQUEST_TIMEOUT = 60   # seconds without an answer before a request fails (and counts against the breaker)
+
+####################################################################
+class Scheduler:
+    """Shared budget of backend requests
+
+    A token bucket limits the request rate (rate per second, bursts of up
+    to burst requests), at most max_concurrency requests run at once, and
+    waiting requests are served by priority (INTERACTIVE before BATCH),
+    first come first served within a priority. Queue waits are recorded
+    per priority (see metrics).
+    """
+
+    def __init__(self, rate=4.0, burst=8, max_concurrency=4):
+        self.rate            = rate            # None: no rate limit
+        self.burst           = burst
+        self.max_concurrency = max_concurrency
+        self.tokens          = burst
+        self.updated         = time.monotonic()
+        self.running         = 0
+        self.waiting         = []              # heap of (priority, arrival) tickets
+        self.arrivals        = itertools.count()
+        self.condition       = threading.Condition()
+        self.stats           = {}
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens  = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """Block until the request may go to the backend; yields the queue wait in seconds"""
+
+        start  = time.monotonic()
+        ticket = (priority, next(self.arrivals))
+
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                self._refill(time.monotonic())
+                first = self.waiting[0] == ticket and self.running < self.max_concurrency
+                if first and (self.rate is None or self.tokens >= 1):
+                    break
+                # only the head of the queue knows when its token arrives
+                self.condition.wait((1 - self.tokens) / self.rate if first else None)
+
+            heapq.heappop(self.waiting)
+            if self.rate is not None:
+                self.tokens -= 1
+            self.running += 1
+            waited = time.monotonic() - start
+
+            stats = self.stats.setdefault(priority, {'requests': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+            stats['requests']   += 1
+            stats['total_wait'] += waited
+            stats['max_wait']    = max(stats['max_wait'], waited)
+            self.condition.notify_all()     # the next ticket may be allowed too
+
+        count(queue_wait=waited)
+        try:
+            yield waited
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    def metrics(self):
+        """Requests, mean/max/total queue wait per priority, plus queued and running requests"""
+
+        with self.condition:
+            metrics = {}
+            for priority, stats in self.stats.items():
+                metrics[priority] = dict(stats, mean_wait=stats['total_wait'] / stats['requests'])
+            queued = [priority for priority, arrival in self.waiting]
+
+        return {'priorities': metrics,
+                'queued'    : {p: queued.count(p) for p in set(queued)},
+                'running'   : self.running}
+
+scheduler = Scheduler()    # one budget for every request of this process
+
+####################################################################
+class BackendUnavailable(Exception):
+    """Raised instead of sending a request while the circuit breaker is open"""
+
+####################################################################
+class CircuitBreaker:
+    """Stop calling a failing backend for a while
+
+    After threshold consecutive failures (connection errors, timeouts, 5xx
+    answers) the breaker opens and requests fail at once with
+    BackendUnavailable. Once reset_after seconds have passed a single trial
+    request is let through: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold   = threshold
+        self.reset_after = reset_after
+        self.failures    = 0
+        self.opened      = None      # time the breaker opened, None when closed
+        self.trial       = False     # a trial request is running (half open)
+        self.lock        = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if self.trial or time.monotonic() - self.opened >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def check(self):
+        """Raise BackendUnavailable unless a request may be sent now"""
+
+        with self.lock:
+            if self.opened is None:
+                return
+            if self.trial or time.monotonic() - self.opened < self.reset_after:
+                raise BackendUnavailable('backend failed ' + str(self.failures) + ' times in a row, retry later')
+            self.trial = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened   = None
+            self.trial    = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            self.trial = False
+
+breaker = CircuitBreaker()
+
+####################################################################
+def post(url, request, priority=INTERACTIVE):
+    """POST a service request to the backend through the circuit breaker and the scheduler"""
+
+    breaker.check()
+    with scheduler.slot(priority):
+        try:
+            res = requests.post(url, data=json.dumps(request), timeout=REQUEST_TIMEOUT)
+        except Exception:        # connection error, timeout, ...
+            breaker.failure()
+            raise
+
+    if res.status_code >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+
+    return res
+
 '''
 Get study using id
-returns JSON from backend
+returns JSON from backend (url: backend to ask, default server_url)
 '''
 
-def get_plot(id):
+def get_plot(id, priority=INTERACTIVE, url=None):
     plot_request = {
             "services": [{
                 "so:name": "Search Field Trials",
@@ -30,6 +196,53 @@ def get_plot(id):
                 }
             }]
         }
-    res = requests.post(server_url, data=json.dumps(plot_request))
-    return json.dumps(res.json())
+    with stage('get_plot'):
+        res = post(url or server_url, plot_request, priority)
+        count(bytes=len(res.content))
+    with stage('json_decode'):
+        data = res.json()
+    return json.dumps(data)
+
+
+####################################################################
+'''
+Get list of all field trials (catalogue)
+returns JSON from backend (url: backend to ask, default server_url)
+'''
 
+def get_all_fieldtrials(priority=INTERACTIVE, url=None):
+    list_all_ft_request = {
+        "services": [
+            {
+                "so:name": "Search Field Trials",
+                "start_service": True,
+                "parameter_set": {
+                    "level": "simple",
+                    "parameters": [
+                        {
+                            "param": "FT Keyword Search",
+                            "current_value": ""
+                        },
+                        {
+                            "param": "FT Study Facet",
+                            "current_value": True
+                        },
+                        {
+                            "param": "FT Results Page Number",
+                            "current_value": 0
+                        },
+                        {
+                            "param": "FT Results Page Size",
+                            "current_value": 500
+                        }
+                    ]
+                }
+            }
+        ]
+    }
+    with stage('get_all_fieldtrials'):
+        res = post(url or server_url, list_all_ft_request, priority)
+        count(bytes=len(res.content))
+    with stage('json_decode'):
+        data = res.json()
+    return json.dumps(data)
@@ -0,0 +1,301 @@
+import os
+import json
+import math
+
+import numpy as np
+
+from src.grassroots_grids import study_data, observation_value
+from src.grassroots_sync  import load_cached_study, _write_atomic
+
+
+SKETCH_FILE       = 'trait_sketches.json'
+RELATIVE_ACCURACY = 0.01
+UNDATED           = 'undated'       # season of observations without a date
+
+####################################################################################
+class QuantileSketch:
+    """Streaming quantile sketch with relative accuracy (DDSketch)
+
+    Values fall in logarithmic bins of ratio gamma = (1 + a) / (1 - a), so
+    every quantile is within a relative error a of the true one whatever the
+    distribution, memory grows with the log of the value range rather than the
+    number of values, and two sketches merge (or subtract) by adding bin counts.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma     = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive  = {}     # bin -> count of values in (gamma**(bin-1), gamma**bin]
+        self.negative  = {}     # same for -value
+        self.zeros     = 0
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.positive.values()) + sum(self.negative.values())
+
+    def add(self, values):
+        """Add an array of values, non-finite ones (NaN/inf sentinels) are ignored"""
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+
+        self.zeros += int(np.count_nonzero(values == 0))
+        for bins, magnitudes in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if len(magnitudes) == 0:
+                continue
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+            for key, n in zip(keys.tolist(), counts.tolist()):
+                bins[key] = bins.get(key, 0) + n
+
+    def merge(self, other, sign=1):
+        """Add the counts of another sketch of the same accuracy (sign=-1 takes them out)"""
+
+        for bins, others in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, n in others.items():
+                total = bins.get(key, 0) + sign * n
+                if total > 0:
+                    bins[key] = total
+                else:
+                    bins.pop(key, None)
+        self.zeros = max(self.zeros + sign * other.zeros, 0)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Value at quantile q (0 to 1), None for an empty sketch"""
+
+        total = self.count
+        if total == 0:
+            return None
+
+        rank = min(max(q, 0), 1) * (total - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):     # most negative first
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'zeros': self.zeros,
+                'positive': {str(k): n for k, n in self.positive.items()},
+                'negative': {str(k): n for k, n in self.negative.items()}}
+
+    @classmethod
+    def from_dict(cls, entry):
+        sketch = cls(entry['relative_accuracy'])
+        sketch.zeros    = entry['zeros']
+        sketch.positive = {int(k): n for k, n in entry['positive'].items()}
+        sketch.negative = {int(k): n for k, n in entry['negative'].items()}
+
+        return sketch
+
+####################################################################################
+def trait_term(phenotypes, variable):
+    """Trait term of a phenotype variable (so:sameAs of its trait, as the search index), else the variable"""
+
+    same_as = phenotypes.get(variable, {}).get('definition', {}).get('trait', {}).get('so:sameAs')
+
+    return same_as if same_as is not None else variable
+
+####################################################################################
+def observation_season(observation):
+    """Season (year of the observation date) an observation counts towards"""
+
+    date = observation.get('date')
+
+    return str(date)[:4] if date else UNDATED
+
+####################################################################################
+def study_sketches(single_study, relative_accuracy=RELATIVE_ACCURACY):
+    """Sketches of the numeric values of a study, in a single pass over the plots
+
+    Values are the ones shown in the heatmaps (corrected preferred over raw)
+    of every observation of plots that are neither discarded nor blank;
+    observations without a phenotype variable are skipped.
+
+    Returns:
+        dictionary: trait term -> season -> QuantileSketch
+    """
+
+    data       = study_data(single_study)
+    phenotypes = data.get('phenotypes', {})
+
+    values = {}      # (term, season) -> list of values
+    for plot in data.get('plots', []):
+        if 'rows' not in plot:
+            continue
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row:
+            continue
+        for observation in plot_row.get('observations', []):
+            variable = observation.get('phenotype', {}).get('variable') if isinstance(observation, dict) else None
+            if variable is None:
+                continue
+            value = observation_value(observation)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                key = (trait_term(phenotypes, variable), observation_season(observation))
+                values.setdefault(key, []).append(value)
+
+    sketches = {}
+    for (term, season), term_values in values.items():
+        sketch = QuantileSketch(relative_accuracy)
+        sketch.add(term_values)
+        sketches.setdefault(term, {})[season] = sketch
+
+    return sketches
+
+####################################################################################
+class TraitSketches:
+    """Quantile sketches of every trait term and season over the cached studies
+
+    The sketch of each study is kept apart from the totals, so a modified or
+    removed study is taken out exactly (bin counts are subtracted) and the
+    catalogue never has to be read again to keep the totals current.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.studies = {}   # study id -> term -> season -> QuantileSketch
+        self.totals  = {}   # term -> season -> QuantileSketch
+
+    def add_study(self, study_id, json_study):
+        """Add the values of a study (JSON string or deserialised), replacing its previous ones"""
+
+        self.remove_study(study_id)
+        self._insert(study_id, study_sketches(json_study, self.relative_accuracy))
+
+    def _insert(self, study_id, sketches):
+
+        self.studies[study_id] = sketches
+        for term, seasons in sketches.items():
+            for season, sketch in seasons.items():
+                total = self.totals.setdefault(term, {}).get(season)
+                if total is None:
+                    total = self.totals[term][season] = QuantileSketch(self.relative_accuracy)
+                total.merge(sketch)
+
+    def remove_study(self, study_id):
+
+        sketches = self.studies.pop(study_id, None)
+        if sketches is None:
+            return
+        for term, seasons in sketches.items():
+            for season, sketch in seasons.items():
+                total = self.totals[term][season]
+                total.merge(sketch, sign=-1)
+                if total.count == 0:
+                    del self.totals[term][season]
+            if len(self.totals[term]) == 0:
+                del self.totals[term]
+
+    def seasons(self, term):
+        return sorted(self.totals.get(term, {}))
+
+    def sketch(self, term, season=None):
+        """Sketch of a trait term for one season, or over every season (None)"""
+
+        seasons = self.totals.get(term, {})
+        if season is not None:
+            return seasons.get(season, QuantileSketch(self.relative_accuracy))
+
+        merged = QuantileSketch(self.relative_accuracy)
+        for sketch in seasons.values():
+            merged.merge(sketch)
+
+        return merged
+
+    def to_json(self):
+        return json.dumps({'relative_accuracy': self.relative_accuracy,
+                           'studies': {study_id: {term: {season: sketch.to_dict() for season, sketch in seasons.items()}
+                                                  for term, seasons in sketches.items()}
+                                       for study_id, sketches in self.studies.items()}}, sort_keys=True)
+
+    def save(self, store_dir):
+        _write_atomic(os.path.join(store_dir, SKETCH_FILE), self.to_json())
+
+####################################################################################
+def load_sketches(store_dir):
+    """Sketches saved in the store, empty if there are none yet"""
+
+    path = os.path.join(store_dir, SKETCH_FILE)
+    if not os.path.exists(path):
+        return TraitSketches()
+
+    with open(path) as f:
+        saved = json.load(f)
+    sketches = TraitSketches(saved['relative_accuracy'])
+    for study_id, terms in saved['studies'].items():
+        sketches._insert(study_id, {term: {season: QuantileSketch.from_dict(entry) for season, entry in seasons.items()}
+                                    for term, seasons in terms.items()})
+
+    return sketches
+
+####################################################################################
+def build_sketches(store_dir, relative_accuracy=RELATIVE_ACCURACY):
+    """Sketch every study cached in the store (see grassroots_sync), one study in memory at a time, and save"""
+
+    sketches = TraitSketches(relative_accuracy)
+    folder   = os.path.join(store_dir, 'studies')
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if name.endswith('.json'):
+            study_id = name[:-len('.json')]
+            sketches.add_study(study_id, load_cached_study(store_dir, study_id))
+    sketches.save(store_dir)
+
+    return sketches
+
+####################################################################################
+def sketch_hook(sketches, store_dir):
+    """sync_catalogue hook keeping the sketches up to date with the store
+
+    The sketches are updated in memory for every study and saved once, when
+    sync_catalogue flushes its hooks at the end of the sync.
+
+        sync_catalogue(store_dir, hooks=[sketch_hook(sketches, store_dir)])
+    """
+
+    def hook(study_id, json_study):
+        if json_study is None:      # study removed from the catalogue
+            sketches.remove_study(study_id)
+        else:
+            sketches.add_study(study_id, json_study)
+
+    hook.flush = lambda: sketches.save(store_dir)
+
+    return hook
+
+####################################################################################
+def color_range(sketches, phenotypes, variable, season=None, quantiles=(0.02, 0.98)):
+    """Shared color range of a phenotype: quantiles of its trait term over the catalogue
+
+    A single outlier no longer stretches the scale, and the same trait gets
+    the same colors in every study, so heatmaps can be compared side by side.
+
+        lower, upper = color_range(sketches, phenotypes, 'GY_kg', season='2019')
+        plotly_heatmap(json_study, "Greens", 'GY_kg', color_range=(lower, upper))
+
+    Args:
+        sketches  : TraitSketches
+        phenotypes: phenotypes of the study (to find the trait term of the variable)
+        variable  : phenotype variable
+        season    : year of the observations, default every season
+        quantiles : lower and upper quantiles of the range
+
+    Returns:
+        tuple: (lower, upper), None when the trait has no values
+    """
+
+    sketch = sketches.sketch(trait_term(phenotypes, variable), season)
+    if sketch.count == 0:
+        return None
+
+    return sketch.quantile(quantiles[0]), sketch.quantile(quantiles[1])
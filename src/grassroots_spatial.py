@@ -0,0 +1,257 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import plotly.graph_objects as go
+
+from src.grassroots_grids import study_data, study_tensor
+from src.grassroots_stats import group_stats
+
+
+HEATMAP_MODES = ['raw', 'mean', 'gaussian', 'median', 'detrend']
+
+####################################################################################
+def _convolve_axis(grid, kernel, axis):
+    """Same-size 1D convolution of a 2D grid along one axis (zero padding)"""
+
+    half   = len(kernel) // 2
+    pad    = [(0, 0), (0, 0)]
+    pad[axis] = (half, half)
+    padded = np.pad(grid, pad)
+    windows = sliding_window_view(padded, len(kernel), axis=axis)
+
+    return windows @ kernel
+
+####################################################################################
+def _window_kernel(method, size, sigma):
+
+    if method == 'mean':
+        return np.ones(size)
+
+    x = np.arange(size) - size // 2
+    return np.exp(-0.5 * (x / sigma)**2)
+
+####################################################################################
+def smooth_grid(grid, method='mean', size=3, sigma=1.0):
+    """NaN-aware neighbourhood smoothing of a value grid
+
+    Only measured plots contribute to and receive smoothed values; discarded
+    or blank plots (NaN), N/A plots (inf) and cells outside odd shaped layouts
+    keep their original value. Mean and gaussian use a normalised convolution
+    (weighted sum of measured neighbours divided by the sum of their weights).
+
+    Args:
+        grid  : 2D value grid (rows, columns) as built by create_matrices
+        method: 'mean', 'gaussian' or 'median'
+        size  : odd width of the square neighbourhood
+        sigma : standard deviation (in plots) of the gaussian kernel
+
+    Returns:
+        numpy array: smoothed grid, the input is left untouched
+    """
+
+    if size % 2 == 0:
+        raise ValueError("size of the neighbourhood must be odd")
+
+    measured = np.isfinite(grid)
+    smoothed = np.array(grid, dtype=float)
+
+    if method == 'median':
+        half    = size // 2
+        padded  = np.pad(np.where(measured, grid, np.nan), half, constant_values=np.nan)
+        windows = sliding_window_view(padded, (size, size))
+        smoothed[measured] = np.nanmedian(windows[measured], axis=(1, 2))
+        return smoothed
+
+    if method not in ('mean', 'gaussian'):
+        raise ValueError("unknown smoothing method: " + str(method))
+
+    kernel = _window_kernel(method, size, sigma)
+    values = np.where(measured, grid, 0.0)
+    weight = measured.astype(float)
+
+    # separable kernel: convolve rows then columns, values and weights alike
+    numerator   = _convolve_axis(_convolve_axis(values, kernel, 0), kernel, 1)
+    denominator = _convolve_axis(_convolve_axis(weight, kernel, 0), kernel, 1)
+
+    smoothed[measured] = numerator[measured] / denominator[measured]
+    return smoothed
+
+####################################################################################
+def detrend_grid(grid, iterations=10, tolerance=1e-6):
+    """Remove row and column trends of a value grid by median polish
+
+    Row and column effects are estimated from measured plots only and
+    subtracted; the overall level is kept so values stay in the trait units.
+    Sentinel cells (NaN, inf) are left as they are.
+
+    Args:
+        grid      : 2D value grid (rows, columns)
+        iterations: maximum number of polish sweeps
+        tolerance : stop when effects change less than this
+
+    Returns:
+        numpy array: detrended grid, the input is left untouched
+    """
+
+    measured  = np.isfinite(grid)
+    detrended = np.array(grid, dtype=float)
+    if not np.any(measured):
+        return detrended
+
+    residual = np.where(measured, grid, np.nan)
+    overall  = np.nanmedian(residual)
+    residual = residual - overall
+
+    for _ in range(iterations):
+        row_effect = np.nan_to_num(_nanmedian(residual, 1))
+        residual   = residual - row_effect
+        col_effect = np.nan_to_num(_nanmedian(residual, 0))
+        residual   = residual - col_effect
+
+        if np.abs(row_effect).max(initial=0) < tolerance and np.abs(col_effect).max(initial=0) < tolerance:
+            break
+
+    detrended[measured] = residual[measured] + overall
+    return detrended
+
+####################################################################################
+def _nanmedian(values, axis):
+    """nanmedian keeping dimensions, NaN (no warning) for empty rows/columns"""
+
+    empty  = np.all(np.isnan(values), axis=axis, keepdims=True)
+    filled = np.where(np.broadcast_to(empty, values.shape), 0.0, values)
+    median = np.nanmedian(filled, axis=axis, keepdims=True)
+    median[empty] = np.nan
+
+    return median
+
+####################################################################################
+def process_grid(grid, mode='raw', size=3, sigma=1.0):
+    """Apply one of the HEATMAP_MODES to a value grid before plotting"""
+
+    if mode == 'raw':
+        return grid
+    if mode == 'detrend':
+        return detrend_grid(grid)
+    if mode in ('mean', 'gaussian', 'median'):
+        return smooth_grid(grid, mode, size, sigma)
+
+    raise ValueError("unknown heatmap mode: " + str(mode))
+
+####################################################################################
+def _robust_z(residual):
+    """Residuals scaled by their median absolute deviation (normal consistent)
+
+    When more than half of the residuals are equal (integer scores) the MAD is
+    0 and the mean absolute deviation is used instead; residuals with no
+    spread at all score 0, so nothing gets flagged.
+    """
+
+    finite = residual[np.isfinite(residual)]
+    if len(finite) == 0:
+        return np.full(residual.shape, np.nan)
+
+    deviation = np.abs(finite - np.median(finite))
+    scale     = 1.4826 * np.median(deviation)
+    if scale == 0:
+        scale = 1.2533 * np.mean(deviation)
+    if scale == 0:
+        return np.where(np.isfinite(residual), 0.0, np.nan)
+
+    return residual / scale
+
+####################################################################################
+def spatial_outliers(grid, accession_codes, threshold=3.5, size=3):
+    """Score every measured plot against its spatial neighbours and its accession replicates
+
+    Neighbour score: value minus the median of the measured plots around it.
+    Replicate score: value minus the median of the plots of the same accession.
+    Both residuals are turned into robust z-scores (median/MAD over the grid).
+
+    Args:
+        grid           : 2D value grid (rows, columns), NaN/inf sentinels allowed
+        accession_codes: int grid of the same shape, -1 where there is no accession
+        threshold      : plots with an absolute score above it are flagged
+        size           : odd width of the neighbourhood
+
+    Returns:
+        dictionary: neighbour_score, replicate_score (float grids) and flags (bool grid)
+    """
+
+    measured = np.isfinite(grid)
+    values   = np.where(measured, grid, np.nan)
+
+    half    = size // 2
+    padded  = np.pad(values, half, constant_values=np.nan)
+    windows = sliding_window_view(padded, (size, size)).reshape(grid.shape + (size * size,))
+    around  = np.delete(windows[measured], (size * size) // 2, axis=1)   # drop the plot itself
+
+    neighbour = np.full(grid.shape, np.nan)
+    has_any   = ~np.all(np.isnan(around), axis=1)
+    cells     = np.flatnonzero(measured)[has_any]
+    neighbour.flat[cells] = values.flat[cells] - np.nanmedian(around[has_any], axis=1)
+
+    replicate = np.full(grid.shape, np.nan)
+    coded     = measured & (accession_codes >= 0)
+    if np.any(coded):
+        codes  = accession_codes[coded]
+        stats  = group_stats(codes, values[coded], codes.max() + 1)
+        single = stats['count'][codes] < 2      # no replicate to compare with
+        residual = values[coded] - stats['median'][codes]
+        residual[single] = np.nan
+        replicate[coded] = residual
+
+    neighbour_score = _robust_z(neighbour)
+    replicate_score = _robust_z(replicate)
+
+    with np.errstate(invalid='ignore'):
+        flags = (np.abs(neighbour_score) > threshold) | (np.abs(replicate_score) > threshold)
+
+    return {'neighbour_score': neighbour_score, 'replicate_score': replicate_score, 'flags': flags}
+
+####################################################################################
+def study_outliers(single_study, phenotype, threshold=3.5, size=3):
+    """Flagged plots of a study for one phenotype
+
+    Returns:
+        list: one dictionary per flagged plot with plot_id (study_index), row,
+              column (1-based), accession, value and both scores
+    """
+
+    data   = study_data(single_study)
+    plots  = data['plots']
+    tensor = study_tensor(single_study, [phenotype])
+    if len(tensor['phenotypes']) == 0:
+        return []
+
+    grid   = tensor['values'][0]
+    scores = spatial_outliers(grid, tensor['accession_codes'], threshold, size)
+
+    outliers = []
+    for i, j in zip(*np.nonzero(scores['flags'])):
+        plot_row = plots[tensor['plot_index'][i, j]]['rows'][0]
+        outliers.append({'plot_id'        : plot_row['study_index'],
+                         'row'            : int(i) + 1,
+                         'column'         : int(j) + 1,
+                         'accession'      : plot_row.get('material', {}).get('accession'),
+                         'value'          : float(grid[i, j]),
+                         'neighbour_score': float(scores['neighbour_score'][i, j]),
+                         'replicate_score': float(scores['replicate_score'][i, j])})
+
+    return outliers
+
+####################################################################################
+def add_outlier_overlay(fig, outliers):
+    """Mark flagged plots on a heatmap from plotly_plot (axes in plot numbers)"""
+
+    if len(outliers) == 0:
+        return fig
+
+    x    = [o['column'] for o in outliers]
+    y    = [o['row']    for o in outliers]
+    text = ["Outlier plot ID: %s<br>Neighbour score: %.2f<br>Replicate score: %.2f"
+            % (o['plot_id'], o['neighbour_score'], o['replicate_score']) for o in outliers]
+
+    fig.add_trace(go.Scatter(x=x, y=y, mode='markers', text=text, hoverinfo='text', showlegend=False,
+                             marker=dict(symbol='x-thin-open', size=18, color='red', line=dict(width=3))))
+    return fig
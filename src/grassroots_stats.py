@@ -0,0 +1,314 @@
+import json
+
+import numpy as np
+
+import plotly.express as px
+
+from src.grassroots_grids import study_data, study_tensor
+from src.grassroots_engine import DISCARDED, BLANK
+
+
+####################################################################################
+def group_stats(codes, values, n_groups):
+    """Grouped count, mean, median and std of values by integer codes (no python loops)
+
+    Args:
+        codes   : int array, group of each value (0..n_groups-1)
+        values  : float array of finite values, same length as codes
+        n_groups: number of groups
+
+    Returns:
+        dictionary: count, mean, median, std arrays of length n_groups (NaN for empty groups)
+    """
+
+    codes  = np.asarray(codes, dtype=np.intp)
+    values = np.asarray(values, dtype=float)
+
+    count = np.bincount(codes, minlength=n_groups)
+    total = np.bincount(codes, weights=values, minlength=n_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        sq   = np.bincount(codes, weights=(values - mean[codes])**2, minlength=n_groups)
+        std  = np.sqrt(sq / (count - 1))
+    std[count < 2] = np.nan
+
+    # median: sort by (group, value) and pick the middle of every group
+    order  = np.lexsort((values, codes))
+    ranked = values[order]
+    start  = np.cumsum(count) - count
+    median = np.full(n_groups, np.nan)
+    filled = count > 0
+    lo = start[filled] + (count[filled] - 1) // 2
+    hi = start[filled] +  count[filled]      // 2
+    median[filled] = (ranked[lo] + ranked[hi]) / 2
+
+    return {'count': count, 'mean': mean, 'median': median, 'std': std}
+
+####################################################################################
+def matching_phenotypes(phenotypes, trait):
+    """Phenotype variables of a study matching a variable name or a so:sameAs trait term"""
+
+    names = []
+    for key in phenotypes:
+        same_as = phenotypes[key]['definition']['trait'].get('so:sameAs')
+        if key == trait or same_as == trait:
+            names.append(key)
+
+    return names
+
+####################################################################################
+def compare_accessions(json_studies, trait):
+    """Compare accessions across studies for one trait
+
+    Args:
+        json_studies: iterable of studies (JSON strings from get_plot or deserialised)
+        trait       : phenotype variable or so:sameAs trait term (as in dict_otherName)
+
+    Returns:
+        dictionary with
+            table     : columns accession, mean, median, std, count, studies; ranked by mean
+            studies   : study names, columns of matrix
+            accessions: accession names, rows of matrix
+            matrix    : mean value of every accession (rows) in every study (columns)
+    """
+
+    study_names  = []
+    local_names  = []
+    local_values = []
+    local_codes  = []
+
+    for json_study in json_studies:
+        if isinstance(json_study, str):
+            json_study = json.loads(json_study)
+        data  = study_data(json_study)
+        names = matching_phenotypes(data['phenotypes'], trait)
+        if len(names) == 0:
+            continue
+
+        tensor   = study_tensor(json_study, names, sparse=True)    # one entry per plot, no bounding box
+        if len(tensor['phenotypes']) == 0:
+            continue
+        values   = tensor['values']
+        codes    = np.broadcast_to(tensor['accession_codes'], values.shape)
+        measured = np.isfinite(values) & (codes >= 0)
+
+        study_names.append(data['so:name'])
+        local_names.append(tensor['accessions'])
+        local_values.append(values[measured])
+        local_codes.append(codes[measured])
+
+    if len(study_names) == 0:
+        raise ValueError("No study has observations of trait: " + trait)
+
+    # map accession codes of every study into one shared set of codes
+    all_names           = np.array([name for names in local_names for name in names], dtype=str)
+    accessions, inverse = np.unique(all_names, return_inverse=True)
+    offsets             = np.cumsum([0] + [len(names) for names in local_names])
+
+    values  = np.concatenate(local_values)
+    codes   = np.concatenate([inverse[offsets[s] + c] for s, c in enumerate(local_codes)])
+    studies = np.concatenate([np.full(len(c), s) for s, c in enumerate(local_codes)])
+
+    n_acc   = len(accessions)
+    n_study = len(study_names)
+
+    stats   = group_stats(codes, values, n_acc)
+    cell    = group_stats(codes * n_study + studies, values, n_acc * n_study)
+    matrix  = cell['mean'].reshape(n_acc, n_study)
+    present = np.count_nonzero(cell['count'].reshape(n_acc, n_study), axis=1)
+
+    rank = np.argsort(-np.nan_to_num(stats['mean'], nan=-np.inf), kind='stable')
+    table = {'accession': accessions[rank],
+             'mean'     : stats['mean'][rank],
+             'median'   : stats['median'][rank],
+             'std'      : stats['std'][rank],
+             'count'    : stats['count'][rank],
+             'studies'  : present[rank]}
+
+    return {'table'     : table,
+            'studies'   : study_names,
+            'accessions': list(accessions[rank]),
+            'matrix'    : matrix[rank]}
+
+####################################################################################
+def plotly_accession_heatmap(comparison, title, colormap="Greens"):
+    """Accession x study heatmap of the result of compare_accessions"""
+
+    CM  = getattr(px.colors.sequential, colormap)
+    fig = px.imshow(comparison['matrix'], aspect="auto",
+                    x=comparison['studies'], y=comparison['accessions'],
+                    labels=dict(x="Study", y="Accession", color="Mean"),
+                    color_continuous_scale=CM, height=max(400, 20 * len(comparison['accessions'])))
+    fig.update_traces(hovertemplate="Accession: %{y}<br>Study: %{x}<br>Mean: %{z}<extra></extra>")
+    fig.update_layout(font=dict(family="Courier New, monospace", size=12, color="Black"), title={
+        'text': title,
+        'y': 0.98, 'x': 0.5,
+        'xanchor': 'center', 'yanchor': 'top'})
+
+    return fig
+
+####################################################################################
+def trait_summary(single_study, quantiles=(0.25, 0.5, 0.75)):
+    """Summary statistics of every numeric phenotype of a study in one pass
+
+    Works on the sparse value tensor of study_tensor (one entry per plot),
+    built once for all phenotypes. N/A plots, discarded plots and blank plots
+    are counted separately (status codes) and excluded from the statistics.
+
+    Args:
+        single_study: study (JSON string or deserialised)
+        quantiles   : quantiles to compute
+
+    Returns:
+        dictionary: phenotypes list plus arrays (one entry per phenotype) min, max,
+                    mean, quantiles (phenotypes x len(quantiles)), count, na, discarded, blank
+    """
+
+    tensor   = study_tensor(single_study, sparse=True)
+    n_pheno  = len(tensor['phenotypes'])
+    values   = tensor['values'].reshape(n_pheno, -1)
+
+    measured = np.isfinite(values)
+    masked   = np.where(measured, values, np.nan)
+    count    = np.count_nonzero(measured, axis=1)
+
+    summary = {'phenotypes': tensor['phenotypes'],
+               'count'     : count,
+               'na'        : np.count_nonzero(np.isinf(values), axis=1),
+               'discarded' : np.count_nonzero(tensor['status'] == DISCARDED, axis=1),
+               'blank'     : np.count_nonzero(tensor['status'] == BLANK, axis=1),
+               'min'       : np.full(n_pheno, np.nan),
+               'max'       : np.full(n_pheno, np.nan),
+               'mean'      : np.full(n_pheno, np.nan),
+               'quantiles' : np.full((n_pheno, len(quantiles)), np.nan)}
+
+    some = count > 0     # avoid all-NaN warnings of the nan* functions
+    if np.any(some):
+        summary['min'][some]       = np.nanmin( masked[some], axis=1)
+        summary['max'][some]       = np.nanmax( masked[some], axis=1)
+        summary['mean'][some]      = np.nanmean(masked[some], axis=1)
+        summary['quantiles'][some] = np.nanquantile(masked[some], quantiles, axis=1).T
+
+    return summary
+
+####################################################################################
+def _average_ranks(values, present):
+    """Ranks of the present values of every row (ties get their average rank), NaN elsewhere
+
+    One sort of the whole (phenotypes, plots) array, no loop over the rows.
+    """
+
+    n_rows, n = values.shape
+    order  = np.argsort(np.where(present, values, np.inf), axis=1, kind='stable')
+    ranked = np.take_along_axis(np.where(present, values, np.inf), order, axis=1)
+
+    # runs of equal values in every sorted row, numbered across the whole array
+    starts        = np.ones((n_rows, n), dtype=bool)
+    starts[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+    runs          = np.cumsum(starts.ravel()) - 1
+    positions     = np.tile(np.arange(1, n + 1, dtype=np.float64), n_rows)
+    average       = np.bincount(runs, weights=positions) / np.bincount(runs)
+
+    ranks = np.empty((n_rows, n))
+    np.put_along_axis(ranks, order, average[runs].reshape(n_rows, n), axis=1)
+    ranks[~present] = np.nan
+
+    return ranks
+
+####################################################################################
+def trait_correlations(single_study, method='pearson', min_plots=3, block_size=64):
+    """Pairwise correlations between every numeric phenotype of a study
+
+    Each pair uses the plots where both values are measured (N/A and discarded
+    sentinels are masked), with masked matrix products instead of a loop over
+    the pairs: with M the presence mask and X the values zero-filled where
+    absent, n = M.Mt, sum x = X.Mt, sum x2 = X2.Mt and sum xy = X.Xt give every
+    pairwise-complete Pearson correlation at once. Values are centred on their
+    phenotype mean first, so large values with a small spread keep their
+    precision. Spearman ranks every phenotype once over its own plots, then
+    takes the same products.
+
+    Args:
+        single_study: study (JSON string or deserialised)
+        method      : 'pearson' or 'spearman'
+        min_plots   : pairs with fewer common plots are NaN
+        block_size  : number of phenotypes per block of the products
+
+    Returns:
+        dictionary: phenotypes, correlation matrix, number of common plots of every pair
+    """
+
+    if method not in ('pearson', 'spearman'):
+        raise ValueError("method must be 'pearson' or 'spearman'")
+
+    tensor  = study_tensor(single_study, sparse=True)
+    n_pheno = len(tensor['phenotypes'])
+    values  = tensor['values'].reshape(n_pheno, -1).astype(np.float64)
+    present = np.isfinite(values)
+
+    if method == 'spearman':
+        values = _average_ranks(values, present)
+
+    counts = present.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(present, values, 0).sum(axis=1) / counts
+    M = present.astype(np.float64)
+    X = np.where(present, values - np.nan_to_num(means)[:, None], 0.0)
+
+    common  = np.empty((n_pheno, n_pheno))
+    sums    = np.empty((n_pheno, n_pheno))     # sums[i, j]: sum of x_i over the plots common to i and j
+    squares = np.empty((n_pheno, n_pheno))
+    cross   = np.empty((n_pheno, n_pheno))
+    for start in range(0, n_pheno, block_size):
+        block = slice(start, start + block_size)
+        common[block]  = M[block] @ M.T
+        sums[block]    = X[block] @ M.T
+        squares[block] = (X[block] * X[block]) @ M.T
+        cross[block]   = X[block] @ X.T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance  = cross - sums * sums.T / common
+        variance    = squares - sums * sums / common
+        correlation = np.clip(covariance / np.sqrt(variance * variance.T), -1.0, 1.0)
+
+    common = np.rint(common).astype(np.int64)
+    correlation[common < min_plots] = np.nan
+
+    return {'phenotypes': tensor['phenotypes'], 'correlation': correlation, 'plots': common}
+
+####################################################################################
+def plotly_correlation_heatmap(correlations, title):
+    """Heatmap of the result of trait_correlations"""
+
+    names = correlations['phenotypes']
+    fig = px.imshow(correlations['correlation'], x=names, y=names, zmin=-1, zmax=1,
+                    labels=dict(color="Correlation"),
+                    color_continuous_scale=px.colors.diverging.RdBu, height=max(600, 18 * len(names)))
+    fig.update_traces(customdata=correlations['plots'],
+                      hovertemplate="%{y} vs %{x}<br>Correlation: %{z:.3f}<br>Plots: %{customdata}<extra></extra>")
+    fig.update_layout(font=dict(family="Courier New, monospace", size=12, color="Black"), title={
+        'text': title,
+        'y': 0.98, 'x': 0.5,
+        'xanchor': 'center', 'yanchor': 'top'})
+
+    return fig
+
+####################################################################################
+def treatment_summary(grid, codes, labels):
+    """Statistics of a phenotype grid for every treatment combination
+
+    Args:
+        grid  : value grid (rows, columns) with NaN/inf sentinels
+        codes : treatment codes of the same shape, from treatment_codes
+        labels: treatment labels indexed by code
+
+    Returns:
+        dictionary: treatment labels plus count, mean, median, std arrays
+    """
+
+    measured = np.isfinite(grid) & (codes >= 0)
+    stats    = group_stats(codes[measured], grid[measured], len(labels))
+    stats['treatment'] = list(labels)
+
+    return stats
@@ -0,0 +1,278 @@
+import json
+import os
+import hashlib
+import argparse
+import functools
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.grassroots_requests import get_plot, get_all_fieldtrials, BATCH, BackendUnavailable
+from src.grassroots_validate import Quarantine, FaultyStudy, checked_study
+from src.grassroots_engine   import dict_phenotypes, study_grid, SparseGrid
+from src.grassroots_instrument import stage, count
+
+
+SYNC_STATE_FILE = 'sync_state.json'
+QUARANTINE_FILE = 'quarantine.json'
+
+####################################################################################
+def fingerprint(data):
+    """Content hash of a JSON-like object (key order independent)"""
+
+    if not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True)
+
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+####################################################################################
+def catalogue_entries(json_catalogue):
+    """Studies listed by get_all_fieldtrials that have phenotypes
+
+    Returns:
+        dictionary: keys: study ids, values: catalogue metadata of the study
+    """
+
+    if isinstance(json_catalogue, str):
+        json_catalogue = json.loads(json_catalogue)
+
+    entries = {}
+    for result in json_catalogue['results'][0]['results']:
+        data = result['data']
+        if 'phenotypes' in data:
+            entries[data['_id']['$oid']] = data
+
+    return entries
+
+####################################################################################
+def study_path(store_dir, study_id):
+    return os.path.join(store_dir, 'studies', study_id + '.json')
+
+####################################################################################
+def grids_path(store_dir, study_id):
+    return os.path.join(store_dir, 'grids', study_id + '.npz')
+
+####################################################################################
+def _write_atomic(path, text):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+####################################################################################
+def load_sync_state(store_dir):
+
+    path = os.path.join(store_dir, SYNC_STATE_FILE)
+    if not os.path.exists(path):
+        return {'last_sync': None, 'studies': {}}
+
+    with open(path) as f:
+        return json.load(f)
+
+####################################################################################
+def save_sync_state(store_dir, state):
+
+    _write_atomic(os.path.join(store_dir, SYNC_STATE_FILE), json.dumps(state, indent=1, sort_keys=True))
+
+####################################################################################
+def load_quarantine(store_dir):
+    """Quarantine of faulty studies saved in the store, empty if there is none yet"""
+
+    path = os.path.join(store_dir, QUARANTINE_FILE)
+    if not os.path.exists(path):
+        return Quarantine()
+
+    with open(path) as f:
+        return Quarantine(json.load(f))
+
+####################################################################################
+def save_quarantine(store_dir, quarantine):
+
+    _write_atomic(os.path.join(store_dir, QUARANTINE_FILE), json.dumps(quarantine.entries, indent=1, sort_keys=True))
+
+####################################################################################
+def load_cached_study(store_dir, study_id):
+    """Study payload from the local store (same JSON string as get_plot), None if not cached"""
+
+    with stage('cache_lookup'):
+        path = study_path(store_dir, study_id)
+        if not os.path.exists(path):
+            count(cache_miss=1)
+            return None
+
+        count(cache_hit=1)
+        with open(path) as f:
+            return f.read()
+
+####################################################################################
+def save_study_grids(store_dir, study_id, json_study, dtype=np.float64):
+    """Build the grids of every numeric phenotype of a study (JSON string or deserialised) and save them next to the payload
+
+    Grids are kept sparse, one entry per plot: row_index and column_index
+    (0-based) of the plots, their accession and plot_ids, then for every
+    phenotype values_<name>, raw_<name> and corrected_<name> of the given
+    float type and a uint8 status_<name> (grassroots_engine status codes).
+    Odd shaped studies are never densified to their bounding box here;
+    load_study_grid gives them back as a SparseGrid, dense() when plotted.
+    """
+
+    single_study = json.loads(json_study) if isinstance(json_study, str) else json_study
+    data         = single_study['results'][0]['results'][0]['data']
+    traits       = dict_phenotypes(data['phenotypes'], data['plots'])
+
+    grids = {}
+    for name in traits:
+        grid = study_grid(single_study, name, dtype)     # SparseGrid for odd shapes, StudyGrid otherwise
+        if 'shape' not in grids:
+            if isinstance(grid, SparseGrid):
+                row_index, column_index = grid.row_index, grid.column_index
+            else:
+                row_index, column_index = np.divmod(np.arange(grid.rows * grid.columns, dtype=np.int32), grid.columns)
+            grids.update(shape=np.array([grid.rows, grid.columns]), row_index=row_index, column_index=column_index,
+                         accession=grid.accession, plot_ids=grid.plot_ids)
+        grids['values_'    + name] = grid.values
+        grids['raw_'       + name] = grid.raw_layer
+        grids['corrected_' + name] = grid.cor_layer
+        grids['status_'    + name] = grid.status
+        grids['trait_'     + name] = np.array(grid.trait)
+        grids['unit_'      + name] = np.array(grid.unit)
+
+    path = grids_path(store_dir, study_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **grids)
+
+####################################################################################
+def load_study_grid(store_dir, study_id, phenotype):
+    """SparseGrid of a phenotype saved by save_study_grids (dense() gives the StudyGrid to plot)
+
+    Raises:
+        KeyError: the phenotype has no saved grid
+    """
+
+    with np.load(grids_path(store_dir, study_id)) as saved:
+        rows, columns = (int(n) for n in saved['shape'])
+        return SparseGrid(rows=rows, columns=columns, row_index=saved['row_index'], column_index=saved['column_index'],
+                          values=saved['values_' + phenotype], raw_layer=saved['raw_' + phenotype],
+                          cor_layer=saved['corrected_' + phenotype], status=saved['status_' + phenotype],
+                          accession=saved['accession'], plot_ids=saved['plot_ids'],
+                          trait=str(saved['trait_' + phenotype]), unit=str(saved['unit_' + phenotype]))
+
+####################################################################################
+def sync_catalogue(store_dir, fetch_catalogue=functools.partial(get_all_fieldtrials, priority=BATCH),
+                   fetch_study=functools.partial(get_plot, priority=BATCH), hooks=(), dtype=np.float64):
+    """Bring the local store up to date with the backend catalogue
+
+    Only studies whose catalogue metadata changed (or that are new) are fetched.
+    A fetched study whose payload hash matches the stored one keeps its grids,
+    so nightly refreshes cost time proportional to what actually changed.
+    Fetched studies are validated first (validate_study): faulty ones are
+    quarantined and not fetched again until the quarantine expires or their
+    metadata changes. Once the backend circuit breaker opens the remaining
+    studies are left for the next sync.
+
+    Args:
+        store_dir      : directory of the local store
+        fetch_catalogue: function returning the catalogue JSON (get_all_fieldtrials, batch priority)
+        fetch_study    : function returning a study JSON given its id (get_plot, batch priority)
+        hooks          : callables hook(study_id, json_study) run for every updated study,
+                         json_study is None for studies removed from the catalogue; hooks
+                         with a flush() attribute (index_hook, sketch_hook) have it called
+                         once at the end of the sync to save what they maintain
+        dtype          : float type of the saved value grids
+
+    Returns:
+        dictionary: ids of new, modified, removed and failed studies, (id, problems)
+                    of quarantined ones, number unchanged
+    """
+
+    state      = load_sync_state(store_dir)
+    known      = state['studies']
+    quarantine = load_quarantine(store_dir)
+    entries    = catalogue_entries(fetch_catalogue())
+
+    summary = {'new': [], 'modified': [], 'unchanged': 0, 'removed': [], 'failed': [], 'quarantined': []}
+
+    for study_id, metadata in entries.items():
+        meta_hash = fingerprint(metadata)
+        record    = known.get(study_id)
+        if record is not None and record['meta_hash'] == meta_hash:
+            summary['unchanged'] += 1
+            continue
+
+        try:
+            json_study, single_study = checked_study(study_id, quarantine, fetch_study, meta_hash)
+            payload_hash = fingerprint(json_study)
+
+            if record is not None and record['payload_hash'] == payload_hash:
+                # metadata moved but the plots did not, keep derived grids
+                record['meta_hash'] = meta_hash
+                summary['unchanged'] += 1
+                continue
+
+            _write_atomic(study_path(store_dir, study_id), json_study)
+            save_study_grids(store_dir, study_id, single_study, dtype)
+            for hook in hooks:
+                hook(study_id, json_study)
+        except FaultyStudy as error:
+            summary['quarantined'].append((study_id, error.problems))
+            continue
+        except BackendUnavailable as error:
+            summary['failed'].append((study_id, repr(error)))
+            break
+        except Exception as error:
+            summary['failed'].append((study_id, repr(error)))
+            continue
+
+        summary['new' if record is None else 'modified'].append(study_id)
+        known[study_id] = {'meta_hash'   : meta_hash,
+                           'payload_hash': payload_hash,
+                           'name'        : metadata.get('so:name'),
+                           'synced'      : datetime.now(timezone.utc).isoformat()}
+
+    for study_id in list(known):
+        if study_id not in entries:
+            for path in (study_path(store_dir, study_id), grids_path(store_dir, study_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+            del known[study_id]
+            summary['removed'].append(study_id)
+            for hook in hooks:
+                hook(study_id, None)
+
+    for study_id in list(quarantine.entries):
+        if study_id not in entries:
+            quarantine.release(study_id)
+
+    for hook in hooks:
+        flush = getattr(hook, 'flush', None)
+        if flush is not None:
+            flush()
+
+    state['last_sync'] = datetime.now(timezone.utc).isoformat()
+    save_sync_state(store_dir, state)
+    save_quarantine(store_dir, quarantine)
+
+    return summary
+
+####################################################################################
+def main():
+    parser = argparse.ArgumentParser(description='Incremental sync of Grassroots field trials into a local store')
+    parser.add_argument('store_dir', help='directory of the local store')
+    parser.add_argument('--float32', action='store_true', help='save value grids as float32')
+    args = parser.parse_args()
+
+    summary = sync_catalogue(args.store_dir, dtype=np.float32 if args.float32 else np.float64)
+    print("New studies:      ", len(summary['new']))
+    print("Modified studies: ", len(summary['modified']))
+    print("Unchanged studies:", summary['unchanged'])
+    print("Removed studies:  ", len(summary['removed']))
+    for study_id, problems in summary['quarantined']:
+        print("Quarantined:", study_id, '; '.join(problems))
+    for study_id, error in summary['failed']:
+        print("Failed:", study_id, error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import time
+import numbers
+
+
+QUARANTINE_TTL = 24 * 3600        # seconds before a faulty study is tried again
+
+####################################################################################
+class FaultyStudy(Exception):
+    """Study payload the heatmap pipeline cannot handle"""
+
+    def __init__(self, study_id, problems):
+        self.study_id = study_id
+        self.problems = problems
+        super().__init__(str(study_id) + ': ' + '; '.join(problems))
+
+####################################################################################
+def _is_index(value):
+    try:
+        return int(value) >= 1 and int(value) == float(value)
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+####################################################################################
+def validate_study(single_study, max_problems=10):
+    """Structural checks of a study, run once before building any grid
+
+    Checks in a single pass what create_matrices, dict_phenotypes and the
+    odd-shape builders take for granted: the data section with plots and
+    phenotypes; a positive integer row and column index and a rows[0] entry
+    for every plot; a material accession for every
+    plot that is neither discarded nor blank; a phenotype variable and a
+    numeric or string value for every observation, and no phenotype mixing
+    numbers and strings. The declared num_rows/num_columns are not checked:
+    they may be missing or stale, and the builders widen the grid to the
+    largest row and column index anyway.
+
+    Args:
+        single_study: deserialised study (get_plot)
+        max_problems: stop after that many problems
+
+    Returns:
+        list: problems found, empty for a valid study
+    """
+
+    problems = []
+    try:
+        data = single_study['results'][0]['results'][0]['data']
+    except (KeyError, IndexError, TypeError):
+        return ['no results/data section']
+
+    for key in ('plots', 'phenotypes'):
+        if key not in data:
+            problems.append('missing ' + key)
+    if problems:
+        return problems
+    if not isinstance(data['plots'], list) or not isinstance(data['phenotypes'], dict):
+        return ['plots or phenotypes of the wrong type']
+
+    for key, phenotype in data['phenotypes'].items():
+        if not isinstance(phenotype, dict) or 'so:name' not in phenotype.get('definition', {}).get('trait', {}):
+            problems.append('phenotype ' + str(key) + ' without trait name')
+
+    kinds = {}       # phenotype variable -> set of value types seen
+    for j, plot in enumerate(data['plots']):
+        if len(problems) >= max_problems:
+            break
+
+        where = 'plot ' + str(j)
+        if not (_is_index(plot.get('row_index')) and _is_index(plot.get('column_index'))):
+            problems.append(where + ': row/column index ' + str(plot.get('row_index')) + ', ' +
+                            str(plot.get('column_index')) + ' is not a positive integer')
+            continue
+        where += ' (' + str(plot['row_index']) + ', ' + str(plot['column_index']) + ')'
+
+        if not isinstance(plot.get('rows'), list) or len(plot['rows']) == 0 or not isinstance(plot['rows'][0], dict):
+            problems.append(where + ': missing rows[0]')
+            continue
+        plot_row = plot['rows'][0]
+        if 'discard' in plot_row or 'blank' in plot_row:
+            continue
+
+        if not isinstance(plot_row.get('material'), dict) or 'accession' not in plot_row['material']:
+            problems.append(where + ': missing material accession')
+
+        for observation in plot_row.get('observations', []):
+            variable = observation.get('phenotype', {}).get('variable') if isinstance(observation, dict) else None
+            if variable is None:
+                problems.append(where + ': observation without phenotype variable')
+                continue
+            if 'raw_value' not in observation and 'corrected_value' not in observation:
+                problems.append(where + ': ' + variable + ' without raw_value or corrected_value')
+                continue
+            for key in ('raw_value', 'corrected_value'):
+                if key not in observation:
+                    continue
+                value = observation[key]
+                if isinstance(value, str):
+                    kinds.setdefault(variable, set()).add('string')
+                elif isinstance(value, numbers.Real) and not isinstance(value, bool):
+                    kinds.setdefault(variable, set()).add('number')
+                else:
+                    problems.append(where + ': ' + variable + ' ' + key + ' is ' + type(value).__name__)
+
+    for variable in sorted(kinds):
+        if len(kinds[variable]) > 1:
+            problems.append('phenotype ' + variable + ' mixes numbers and strings')
+
+    return problems[:max_problems]
+
+####################################################################################
+class Quarantine:
+    """Negative cache of faulty studies
+
+    A quarantined study is skipped until its entry expires (ttl seconds) or
+    the catalogue metadata of the study changes, so a broken study costs one
+    fetch and parse per TTL instead of one per request (see
+    load_quarantine/save_quarantine of grassroots_sync to keep it in a store).
+    """
+
+    def __init__(self, entries=None, ttl=QUARANTINE_TTL):
+        self.ttl     = ttl
+        self.entries = dict(entries or {})      # study id -> {'until', 'problems', 'meta_hash'}
+
+    def is_quarantined(self, study_id, meta_hash=None, now=None):
+        """True while the study has a live entry (and, if given, the same metadata hash)"""
+
+        entry = self.entries.get(study_id)
+        if entry is None:
+            return False
+        if (now or time.time()) >= entry['until'] or (meta_hash is not None and meta_hash != entry['meta_hash']):
+            self.release(study_id)
+            return False
+
+        return True
+
+    def add(self, study_id, problems, meta_hash=None, now=None):
+        self.entries[study_id] = {'until'    : (now or time.time()) + self.ttl,
+                                  'problems' : list(problems),
+                                  'meta_hash': meta_hash}
+
+    def release(self, study_id):
+        self.entries.pop(study_id, None)
+
+####################################################################################
+def checked_study(study_id, quarantine, fetch, meta_hash=None):
+    """Fetch, parse and validate a study unless it is quarantined
+
+        quarantine = Quarantine()
+        try:
+            payload, single_study = checked_study(uuid, quarantine, get_plot)
+        except FaultyStudy as error:
+            print(error.problems)
+
+    Args:
+        quarantine: Quarantine of the faulty studies
+        fetch     : function returning a study JSON string given its id (get_plot)
+        meta_hash : catalogue metadata hash, a changed hash lifts the quarantine
+
+    Returns:
+        tuple: (payload, single_study), the JSON string as fetched and the deserialised study
+
+    Raises:
+        FaultyStudy: the study is quarantined, is not valid JSON or fails validate_study
+    """
+
+    if quarantine.is_quarantined(study_id, meta_hash):
+        raise FaultyStudy(study_id, quarantine.entries[study_id]['problems'])
+
+    payload = fetch(study_id)      # backend errors propagate, they say nothing about the study
+    try:
+        single_study = json.loads(payload)
+    except ValueError as error:
+        problems = ['invalid JSON: ' + str(error)]
+    else:
+        problems = validate_study(single_study)
+
+    if problems:
+        quarantine.add(study_id, problems, meta_hash)
+        raise FaultyStudy(study_id, problems)
+
+    return payload, single_study
@@ -0,0 +1,310 @@
+"""Original create_matrices with its np.append walk and oddShape* fills, kept verbatim as the
+reference the engine is tested against (numpy_data of grass_plots built the same arrays)
+"""
+
+import numpy as np
+from functools import reduce
+
+
+####################################################################################
+def lookup_keys(dictionary, keys, default=None):
+     return reduce(lambda d, key: d.get(key, default) if isinstance(d, dict) else default, keys.split("."), dictionary)
+
+####################################################################################
+def searchPhenotypeTrait(listPheno, value):
+
+    name = listPheno[value]['definition']['trait']['so:name']
+
+    return name
+
+####################################################################################
+def searchPhenotypeUnit(listPheno, value):
+
+    name = listPheno[value]['definition']['unit']['so:name']
+
+    return name
+
+####################################################################################
+def search_phenotype(list_observations, value):
+
+    found = False
+    for i in range(len(list_observations)):
+
+        dic            = list_observations[i]
+        phenotype_name = lookup_keys(dic, 'phenotype.variable')
+        if  (phenotype_name == value ):
+              return True
+              break
+
+    return found
+
+####################################################################################
+def search_phenotype_index(list_observations, value):
+
+    for i in range(len(list_observations)):
+
+        dic            = list_observations[i]
+        phenotype_name = lookup_keys(dic, 'phenotype.variable')
+        if  (phenotype_name == value ):
+              return i
+
+####################################################################################
+def create_matrices(json, pheno, current_name, total_rows, total_columns):
+    """create numpy matrices for plotting
+
+    Args:
+        json     : Plots data of a particular study
+        pheno    : Phenotypes of particular study
+        name     : Name of current study
+
+    Returns:
+        matrices: matrix with numpy matrices...
+    """
+
+
+    traitName = searchPhenotypeTrait(pheno, current_name)
+    unit      = searchPhenotypeUnit( pheno, current_name)
+
+    dtID= np.dtype(('U', 4))
+
+    row_raw   = np.array([])
+    matrix    = np.array([])
+    row_acc   = np.array([])
+    accession = np.array([])
+    plotsIds  = np.array([], dtype=dtID)  #format of strings
+
+    matrices = []
+
+    num_columns = 1
+    row    = 1
+    column = 1
+    #loop throght observations in the same fashion as in old JS code. 
+    for j in range(len(json)):
+        if ( int( json[j]['row_index'] ) == row ):
+            if  (int( json[j]['column_index'] ) == column):
+               if column > num_columns:
+                   num_columns = column
+
+               if   ( 'discard' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+               elif ( 'blank' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  # use NaN for discarded plots
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+      
+               elif ( 'observations' in json[j]['rows'][0] ):
+                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
+                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
+                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
+                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
+                        row_raw  = np.append(row_raw, rawValue) 
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+                    else:
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+               else:
+                    if ( 'rows' in json[j] ):
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+         
+  
+               column+=1
+               columns = json[j]['column_index']#
+
+        elif ( int( json[j]['row_index'] ) > row  ):
+            if column > num_columns:
+                   num_columns = column
+
+            if   ( 'discard' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+            elif   ( 'blank' in json[j]['rows'][0] ):
+                    row_raw  = np.append(row_raw, np.nan )  
+                    row_acc  = np.append(row_acc, np.nan )  
+                    plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+        
+            elif ( 'observations' in json[j]['rows'][0] ):
+                    if( search_phenotype(json[j]['rows'][0]['observations'], current_name) ):
+                        indexCurrentPhenotype = search_phenotype_index (json[j]['rows'][0]['observations'], current_name)
+                        if ('raw_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
+                        if ('corrected_value' in json[j]['rows'][0]['observations'][indexCurrentPhenotype]):    
+                            rawValue = json[j]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
+                        row_raw  = np.append(row_raw, rawValue) 
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession']) 
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+                    else:
+                        row_raw  = np.append(row_raw, np.inf )
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+            else:
+                    if ( 'rows' in json[j] ):
+                        ##print("rows with no observations------",json[j])
+                        row_raw  = np.append(row_raw, np.inf )  # use infinity for N/A data
+                        row_acc  = np.append(row_acc, json[j]['rows'][0]['material']['accession'])  
+                        plotsIds = np.append(plotsIds, json[j]['rows'][0]['study_index'] )
+             
+
+            row+=1
+            column=2
+            columns = json[j]['column_index']
+
+
+    #column = columns # use actual number of columns instead of counter
+    column = num_columns-1
+
+    if column<columns:
+        column=columns
+    
+    #######print("number of plots and shape check", len(json), row, column, row*(column) )
+    if (len(json) != row*column):
+        #print("NOT rectangular")
+        if(total_columns!=None):
+          if(column<total_columns):
+             column=total_columns
+
+        # fit odd shape plot into bigger rectangular plot.
+        row_raw  = oddShapeValues(   json, row, column, current_name)
+        row_acc  = oddShapeAccession(json, row, column, current_name)
+        plotsIds = oddShapePlotID(   json, row, column, current_name)
+
+    matrices.append(row)
+    matrices.append(column)
+    matrices.append(row_raw)
+    #matrices.append(row_acc)
+    matrices.append(traitName)
+    matrices.append(unit)
+    matrices.append(row_acc)
+    matrices.append(plotsIds)
+    
+    return matrices
+
+####################################################################################
+def oddShapeValues(arraysJson, rows, columns, phenotype):
+
+    matrix = np.zeros((rows,columns))
+    matrix[:] = np.nan
+
+    for r in range(len(arraysJson)):
+        if  ( 'discard' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = np.nan
+        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = np.nan
+
+        elif ( 'observations' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
+                indexCurrentPhenotype = search_phenotype_index (arraysJson[r]['rows'][0]['observations'], phenotype)
+                if ('raw_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
+                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['raw_value']
+                if ('corrected_value' in arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]):
+                    rawValue = arraysJson[r]['rows'][0]['observations'][indexCurrentPhenotype]['corrected_value']
+                matrix[i][j] = rawValue
+            else:
+                matrix[i][j] = np.inf
+
+        else:
+            if('rows' in arraysJson[r]):        #rows field exists but it has no observations!
+               i = int( arraysJson[r]['row_index']    )
+               j = int( arraysJson[r]['column_index'] )
+               i=i-1
+               j=j-1
+               matrix[i][j] = np.inf  # consider it N/A instead as default discarded (nan)
+    
+
+    #matrix = np.flipud(matrix)
+    #print(matrix)
+    matrix  = matrix.flatten()
+
+    return matrix
+
+####################################################################################
+def oddShapeAccession(arraysJson, rows, columns, phenotype):
+
+    dt= np.dtype(('U', 50)) # define string type for of strings (accession names)
+    matrix = np.empty((rows,columns), dtype=dt)
+    matrix[:] = 'Discarded' #  hovering text in empty plots
+
+    for r in range(len(arraysJson)):
+        if  ( 'discard' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = np.nan         #discarded plot
+        elif  ( 'blank' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = np.nan         #discarded plot
+
+        elif ( 'observations' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+         #   if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
+            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
+        elif('rows' in arraysJson[r]):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = arraysJson[r]['rows'][0]['material']['accession']
+
+
+    matrix  = matrix.flatten()
+
+    return matrix
+
+####################################################################################
+def oddShapePlotID(arraysJson, rows, columns, phenotype):
+
+    dt= np.dtype(('U', 40))
+    matrix = np.empty((rows,columns), dtype=dt)
+    matrix[:] = 'N/A'
+
+    for r in range(len(arraysJson)):
+        if  ( 'discard' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
+
+        elif ( 'observations' in arraysJson[r]['rows'][0] ):
+            i = int( arraysJson[r]['row_index']    )
+            j = int( arraysJson[r]['column_index'] )
+            i=i-1
+            j=j-1
+            if( search_phenotype(arraysJson[r]['rows'][0]['observations'], phenotype) ):
+                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
+            else:
+            #    matrix[i][j] = np.nan    # No values for that phenotype
+                matrix[i][j] = arraysJson[r]['rows'][0]['study_index']
+
+
+
+    matrix  = matrix.flatten()
+
+    return matrix
@@ -0,0 +1,193 @@
+import numpy as np
+import pytest
+
+from src.grassroots_engine import build_grid, study_grid, StudyGrid, SparseGrid, MEASURED, NOT_AVAILABLE, DISCARDED, BLANK
+from src.grassroots_plots  import create_matrices
+from src.grass_plots       import numpy_data
+
+import baseline_builder
+
+
+nan = np.nan
+inf = np.inf
+
+####################################################################################
+def plot(row, column, index, accession=None, values=None, discard=False, blank=False):
+    """Plot of a study payload, as returned by the backend"""
+
+    plot_row = {'study_index': index}
+    if discard:
+        plot_row['discard'] = True
+    elif blank:
+        plot_row['blank'] = True
+    else:
+        plot_row['material'] = {'accession': accession}
+        if values is not None:
+            plot_row['observations'] = [dict({'phenotype': {'variable': variable}}, **value) for variable, value in values.items()]
+
+    return {'row_index': row, 'column_index': column, 'rows': [plot_row]}
+
+def gy(raw, corrected=None):
+    value = {'raw_value': raw}
+    if corrected is not None:
+        value['corrected_value'] = corrected
+    return {'GY_kg': value}
+
+PHENOTYPES = {'GY_kg': {'definition': {'trait': {'so:name': 'Grain yield'},  'unit': {'so:name': 'kg'}}},
+              'PH_cm': {'definition': {'trait': {'so:name': 'Plant height'}, 'unit': {'so:name': 'cm'}}}}
+
+####################################################################################
+# payloads and the rows, columns, values, accessions and plot IDs the original
+# create_matrices/numpy_data (np.append walk and oddShape*) returned for GY_kg
+CASES = {
+    'rectangular': (
+        [plot(1, 1, 1, 'A1', gy(1.5)), plot(1, 2, 2, 'A2', gy(2.0, 2.5)), plot(1, 3, 3, 'A3', gy(3)),
+         plot(2, 1, 4, 'A4', gy(4.25)), plot(2, 2, 5, 'A5', gy(5)),       plot(2, 3, 6, 'A6', gy(6))],
+        2, 3,
+        [1.5, 2.5, 3.0, 4.25, 5.0, 6.0],
+        ['A1', 'A2', 'A3', 'A4', 'A5', 'A6'],
+        ['1', '2', '3', '4', '5', '6'],
+        [MEASURED] * 6),
+    'odd_shaped': (
+        [plot(1, 1, 1, 'B1', gy(1)), plot(1, 2, 2, 'B2', gy(2)), plot(1, 3, 3, 'B3', gy(3)),
+         plot(2, 1, 4, 'B4', gy(4)),                             plot(2, 3, 6, 'B6', gy(6)),
+         plot(3, 1, 7, 'B7', gy(7)), plot(3, 2, 8, 'B8', {'PH_cm': {'raw_value': 80}})],
+        3, 3,
+        [1.0, 2.0, 3.0, 4.0, nan, 6.0, 7.0, inf, nan],
+        ['B1', 'B2', 'B3', 'B4', 'Discarded', 'B6', 'B7', 'B8', 'Discarded'],
+        ['1', '2', '3', '4', 'N/A', '6', '7', '8', 'N/A'],
+        [MEASURED] * 4 + [DISCARDED, MEASURED, MEASURED, NOT_AVAILABLE, DISCARDED]),
+    'discarded_blank': (
+        [plot(1, 1, 1, 'C1', gy(1)), plot(1, 2, 2, discard=True),
+         plot(2, 1, 3, blank=True),  plot(2, 2, 4, 'C4', gy(4))],
+        2, 2,
+        [1.0, nan, nan, 4.0],
+        ['C1', 'nan', 'nan', 'C4'],
+        ['1', '2', '3', '4'],
+        [MEASURED, DISCARDED, BLANK, MEASURED]),
+    'not_available': (
+        [plot(1, 1, 1, 'D1', gy(1)), plot(1, 2, 2, 'D2', {'PH_cm': {'raw_value': 90}}),
+         plot(2, 1, 3, 'D3'),        plot(2, 2, 4, 'D4', gy(4))],
+        2, 2,
+        [1.0, inf, inf, 4.0],
+        ['D1', 'D2', 'D3', 'D4'],
+        ['1', '2', '3', '4'],
+        [MEASURED, NOT_AVAILABLE, NOT_AVAILABLE, MEASURED]),
+    'odd_mixed': (
+        [plot(1, 1, 1, 'E1', gy(1)), plot(1, 2, 2, discard=True), plot(1, 3, 3, 'E3'),
+         plot(2, 1, 4, blank=True),  plot(2, 2, 5, 'E5', {'PH_cm': {'raw_value': 70}})],
+        2, 3,
+        [1.0, nan, inf, nan, inf, nan],
+        ['E1', 'nan', 'E3', 'nan', 'E5', 'Discarded'],
+        ['1', '2', 'N/A', 'N/A', '5', 'N/A'],
+        [MEASURED, DISCARDED, NOT_AVAILABLE, BLANK, NOT_AVAILABLE, DISCARDED]),
+}
+
+ODD_SHAPES = ('odd_shaped', 'odd_mixed')
+
+####################################################################################
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_build_grid(case):
+    plots, rows, columns, values, accession, plot_ids, status = CASES[case]
+
+    grid = build_grid(plots, PHENOTYPES, 'GY_kg', rows, columns)
+    assert isinstance(grid, SparseGrid if case in ODD_SHAPES else StudyGrid)
+
+    dense = grid.dense()
+    assert (dense.rows, dense.columns) == (rows, columns)
+    assert (dense.trait, dense.unit)   == ('Grain yield', 'kg')
+    np.testing.assert_array_equal(dense.values, values)
+    assert dense.accession.tolist() == accession
+    assert dense.plot_ids.tolist()  == plot_ids
+    assert dense.status.tolist()    == status
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_create_matrices(case):
+    plots, rows, columns, values, accession, plot_ids, status = CASES[case]
+
+    arrays = create_matrices(plots, PHENOTYPES, 'GY_kg', rows, columns)
+    assert arrays[0:2] == [rows, columns]
+    np.testing.assert_array_equal(arrays[2], values)
+    assert arrays[3:5] == ['Grain yield', 'kg']
+    assert arrays[5].tolist() == accession
+    assert arrays[6].tolist() == plot_ids
+    assert arrays[9].tolist() == status
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_numpy_data(case):
+    plots, rows, columns, values, accession, plot_ids, status = CASES[case]
+
+    arrays = numpy_data(plots, PHENOTYPES, 'GY_kg', rows, columns)
+    assert arrays[0:2] == [rows, columns]
+    np.testing.assert_array_equal(arrays[2], values)
+    assert arrays[3].tolist() == accession
+    assert arrays[4:6] == ['Grain yield', 'kg']
+    assert arrays[6].tolist() == plot_ids
+    assert arrays[9].tolist() == status
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_float32_grids(case):
+    plots, rows, columns, values, accession, plot_ids, status = CASES[case]
+
+    arrays = create_matrices(plots, PHENOTYPES, 'GY_kg', rows, columns, np.float32)
+    assert arrays[2].dtype == np.float32
+    np.testing.assert_array_equal(arrays[2], np.array(values, dtype=np.float32))
+
+def test_layers_keep_raw_and_corrected_apart():
+    plots, rows, columns = CASES['rectangular'][:3]
+
+    arrays = create_matrices(plots, PHENOTYPES, 'GY_kg', rows, columns)
+    assert arrays[7][1] == 2.0      # raw_value
+    assert arrays[8][1] == 2.5      # corrected_value, the one shown
+    assert arrays[2][1] == 2.5
+
+####################################################################################
+def field_trial(rows, columns, seed, gaps=()):
+    """Realistic study data: discarded and blank plots, plots without the phenotype
+    or without observations, corrected values, and optional missing plots (gaps)"""
+
+    rng   = np.random.default_rng(seed)
+    plots = []
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            if (row, column) in gaps:
+                continue
+            index = (row - 1) * columns + column
+            u     = rng.random()
+            if u < 0.06:
+                plots.append(plot(row, column, index, discard=True))
+            elif u < 0.1:
+                plots.append(plot(row, column, index, blank=True))
+            elif u < 0.14:
+                plots.append(plot(row, column, index, 'Acc' + str(index % 7)))
+            elif u < 0.2:
+                plots.append(plot(row, column, index, 'Acc' + str(index % 7), {'PH_cm': {'raw_value': 80 + row}}))
+            else:
+                raw       = round(float(rng.normal(6.5, 1.2)), 3)
+                corrected = round(raw + 0.25, 3) if rng.random() < 0.3 else None
+                values    = dict(gy(raw, corrected), PH_cm={'raw_value': 90 + column})
+                plots.append(plot(row, column, index, 'Acc' + str(index % 7), values))
+
+    return {'plots': plots, 'phenotypes': PHENOTYPES, 'num_rows': rows, 'num_columns': columns}
+
+FIELD_TRIALS = {
+    'rectangular': field_trial(12, 10, seed=1),
+    'gaps'       : field_trial(12, 10, seed=2, gaps={(5, 4), (5, 5), (8, 10), (12, 3), (12, 7), (12, 8), (12, 9), (12, 10)}),
+}
+
+@pytest.mark.parametrize('trial', sorted(FIELD_TRIALS))
+def test_matches_baseline_builder(trial):
+    data     = FIELD_TRIALS[trial]
+    args     = (data['plots'], PHENOTYPES, 'GY_kg', data['num_rows'], data['num_columns'])
+    expected = baseline_builder.create_matrices(*args)
+    assert (expected[0] * expected[1] == len(data['plots'])) == (trial == 'rectangular')
+
+    grid = study_grid({'results': [{'results': [{'data': data}]}]}, 'GY_kg').dense()
+    for name, rows, columns, values, accession, plot_ids in [
+            ('study_grid',      grid.rows, grid.columns, grid.values, grid.accession, grid.plot_ids),
+            ('create_matrices', *[create_matrices(*args)[k] for k in (0, 1, 2, 5, 6)]),
+            ('numpy_data',      *[numpy_data(*args)[k]      for k in (0, 1, 2, 3, 6)])]:
+        assert (rows, columns) == (expected[0], expected[1]), name
+        np.testing.assert_array_equal(values, np.asarray(expected[2], dtype=np.float64), err_msg=name)
+        assert accession.tolist() == expected[5].tolist(), name
+        assert plot_ids.tolist()  == expected[6].tolist(), name
@@ -0,0 +1,43 @@
+import csv
+
+import pytest
+
+from src.grassroots_export import export_observations, study_records, EXPORT_COLUMNS
+
+from test_engine import plot, PHENOTYPES
+
+
+STUDY = {'results': [{'results': [{'data': {
+    '_id': {'$oid': 's1'}, 'phenotypes': PHENOTYPES, 'num_rows': 1, 'num_columns': 3,
+    'plots': [plot(1, 1, 1, 'A1', {'GY_kg': {'raw_value': 1.5}}),
+              plot(1, 2, 2, 'A2', {'GY_kg': {'raw_value': 'lodged', 'corrected_value': 2}}),
+              plot(1, 3, 3, discard=True)]}}]}]}
+
+####################################################################################
+def test_missing_and_text_values():
+    records = [dict(zip(EXPORT_COLUMNS, record)) for record in study_records(STUDY)]
+
+    assert len(records) == 2
+    assert (records[0]['raw_value'], records[0]['corrected_value'])  == (1.5, None)
+    assert (records[0]['raw_text'],  records[0]['corrected_text'])   == (None, None)
+    assert (records[1]['raw_value'], records[1]['corrected_value'])  == (None, 2.0)
+    assert records[1]['raw_text'] == 'lodged'
+
+def test_csv_leaves_missing_values_empty(tmp_path):
+    path = tmp_path / 'observations.csv'
+    assert export_observations([STUDY], str(path)) == 2
+
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]['corrected_value'] == ''
+    assert rows[1]['raw_value'] == '' and rows[1]['raw_text'] == 'lodged'
+
+def test_parquet_writes_nulls(tmp_path):
+    pq   = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'observations.parquet'
+    export_observations([STUDY], str(path))
+
+    table = pq.read_table(str(path)).to_pydict()
+    assert table['corrected_value'] == [None, 2.0]
+    assert table['raw_value']       == [1.5, None]
+    assert table['raw_text']        == [None, 'lodged']
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from src.grassroots_grids  import study_tensor, dense_tensor
+from src.grassroots_engine import study_grid, SparseGrid
+from src.grassroots_sync   import save_study_grids, load_study_grid
+
+from test_engine import FIELD_TRIALS
+
+
+def wrap(data):
+    return {'results': [{'results': [{'data': data}]}]}
+
+####################################################################################
+@pytest.mark.parametrize('trial', sorted(FIELD_TRIALS))
+def test_sparse_tensor_densifies_to_the_grid(trial):
+    single_study = wrap(FIELD_TRIALS[trial])
+
+    sparse = study_tensor(single_study, sparse=True)
+    dense  = study_tensor(single_study)
+    assert sparse['values'].shape == (2, len(FIELD_TRIALS[trial]['plots']))
+
+    for key, array in dense_tensor(sparse).items():
+        if isinstance(array, np.ndarray):
+            np.testing.assert_array_equal(array, dense[key])
+        else:
+            assert array == dense[key]
+
+@pytest.mark.parametrize('trial', sorted(FIELD_TRIALS))
+def test_cached_grids_stay_sparse(tmp_path, trial):
+    single_study = wrap(FIELD_TRIALS[trial])
+    save_study_grids(str(tmp_path), 's1', single_study)
+
+    cached = load_study_grid(str(tmp_path), 's1', 'GY_kg')
+    assert isinstance(cached, SparseGrid)
+    assert len(cached.values) == len(FIELD_TRIALS[trial]['plots'])
+
+    cached, expected = cached.dense(), study_grid(single_study, 'GY_kg').dense()
+    assert (cached.rows, cached.columns, cached.trait, cached.unit) == (expected.rows, expected.columns, expected.trait, expected.unit)
+    for field in ('values', 'raw_layer', 'cor_layer', 'status', 'accession', 'plot_ids'):
+        np.testing.assert_array_equal(getattr(cached, field), getattr(expected, field))
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import src.grassroots_stats as grassroots_stats
+from src.grassroots_stats import trait_correlations, trait_summary
+from test_engine import CASES, PHENOTYPES
+
+
+####################################################################################
+def ragged_values(n_pheno=6, n_plots=200, seed=0):
+    """Large values with a small spread, every phenotype missing on different plots"""
+
+    rng    = np.random.default_rng(seed)
+    values = rng.normal(1000.0, 3.0, (n_pheno, n_plots))
+    values[:, ::9] = np.round(values[:, ::9])                  # ties
+    values[rng.random(values.shape) < 0.2]  = np.nan           # discarded
+    values[rng.random(values.shape) < 0.05] = np.inf           # N/A
+
+    return values
+
+def pairwise_pearson(x, y):
+    both = np.isfinite(x) & np.isfinite(y)
+    return np.corrcoef(x[both], y[both])[0, 1], np.count_nonzero(both)
+
+@pytest.fixture
+def tensor(monkeypatch):
+    values = ragged_values()
+    names  = ['T' + str(k) for k in range(len(values))]
+    monkeypatch.setattr(grassroots_stats, 'study_tensor',
+                        lambda single_study, sparse=False: {'phenotypes': names, 'values': values.reshape(len(values), 20, 10)})
+    return values
+
+####################################################################################
+def test_pearson_is_pairwise_complete(tensor):
+    result = trait_correlations(None, 'pearson', block_size=4)
+
+    for i in range(len(tensor)):
+        for j in range(len(tensor)):
+            r, n = pairwise_pearson(tensor[i], tensor[j])
+            assert result['plots'][i, j] == n
+            assert result['correlation'][i, j] == pytest.approx(r, abs=1e-12)
+
+def test_spearman_ranks_each_phenotype_once(tensor):
+    result  = trait_correlations(None, 'spearman')
+    ranks   = grassroots_stats._average_ranks(tensor, np.isfinite(tensor))
+
+    r, n = pairwise_pearson(ranks[0], ranks[1])
+    assert result['correlation'][0, 1] == pytest.approx(r, abs=1e-12)
+    assert result['plots'][0, 1] == n
+
+def test_average_ranks_ties():
+    values  = np.array([[3.0, 1.0, np.nan, 3.0, 2.0]])
+    ranks   = grassroots_stats._average_ranks(values, np.isfinite(values))
+
+    np.testing.assert_array_equal(ranks, [[3.5, 1.0, np.nan, 3.5, 2.0]])
+
+def test_min_plots(tensor):
+    result = trait_correlations(None, min_plots=10**6)
+
+    assert np.all(np.isnan(result['correlation']))
+
+####################################################################################
+def test_summary_counts_blank_apart_from_discarded():
+    plots, rows, columns = CASES['discarded_blank'][:3]
+    data    = {'plots': plots, 'phenotypes': PHENOTYPES, 'num_rows': rows, 'num_columns': columns}
+    summary = trait_summary({'results': [{'results': [{'data': data}]}]})
+
+    k = summary['phenotypes'].index('GY_kg')
+    assert (summary['count'][k], summary['na'][k]) == (2, 0)
+    assert (summary['discarded'][k], summary['blank'][k]) == (1, 1)
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from src.grassroots_validate import validate_study, checked_study, Quarantine, FaultyStudy
+from src.grassroots_plots    import matrices
+
+from test_engine import plot, gy, PHENOTYPES
+
+
+####################################################################################
+def study(plots, num_rows=2, num_columns=2):
+    return {'results': [{'results': [{'data': {'plots': plots, 'phenotypes': PHENOTYPES,
+                                               'num_rows': num_rows, 'num_columns': num_columns}}]}]}
+
+PLOTS = [plot(1, 1, 1, 'A1', gy(1)), plot(1, 2, 2, 'A2', gy(2)),
+         plot(2, 1, 3, 'A3', gy(3)), plot(2, 2, 4, 'A4', gy(4))]
+
+####################################################################################
+def test_valid_study():
+    assert validate_study(study(PLOTS)) == []
+
+def test_num_columns_none_is_valid():
+    single_study = study(PLOTS, num_columns=None)
+
+    assert validate_study(single_study) == []
+    arrays = matrices(single_study, 'GY_kg')
+    assert arrays[0:2] == [2, 2]
+
+def test_indexes_beyond_stale_layout_size_are_valid():
+    single_study = study(PLOTS + [plot(3, 1, 5, 'A5', gy(5))], num_rows=2, num_columns=1)
+
+    assert validate_study(single_study) == []
+    arrays = matrices(single_study, 'GY_kg')     # grid widened to the largest indexes
+    assert arrays[0:2] == [3, 2]
+    assert arrays[2][4] == 5
+
+@pytest.mark.parametrize('row_index', [0, -1, 1.5, 'x', None])
+def test_bad_row_index(row_index):
+    plots = PLOTS[:3] + [dict(PLOTS[3], row_index=row_index)]
+
+    problems = validate_study(study(plots))
+    assert len(problems) == 1 and 'row/column index' in problems[0]
+
+def test_missing_plots():
+    single_study = study(PLOTS)
+    del single_study['results'][0]['results'][0]['data']['plots']
+
+    assert validate_study(single_study) == ['missing plots']
+
+def test_checked_study_quarantines_faulty_studies():
+    quarantine = Quarantine()
+    payload    = json.dumps(study([dict(PLOTS[0], column_index=0)]))
+
+    with pytest.raises(FaultyStudy):
+        checked_study('s1', quarantine, lambda study_id: payload)
+    assert quarantine.is_quarantined('s1')
+
+    payload, single_study = checked_study('s2', quarantine, lambda study_id: json.dumps(study(PLOTS)))
+    assert single_study == json.loads(payload)